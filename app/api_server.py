@@ -0,0 +1,348 @@
+"""
+
+    Flick Insights recommendation API.
+
+    Author: Explore Data Science Academy.
+
+    Description: A headless JSON service over `collab_model`,
+    `content_model` and `hybrid_model`, built on the standard library only. Requests are
+    accepted by a threaded HTTP server and scored in a pool of worker
+    processes, each of which loads the models once. Single requests that
+    arrive together are gathered into one call of the batch recommenders,
+    so concurrent kiosks share the matrix work.
+
+    Endpoints:
+        GET  /healthz                     Loads the models in every worker.
+        GET  /metrics                     Stage timings, see utils.instrumentation.
+        POST /recommend/<algorithm>       {"movies": [...], "top_n": 10}
+        POST /recommend/<algorithm>/batch {"profiles": [[...], ...], "top_n": 10}
+
+    where <algorithm> is `collab`, `content` or `hybrid`.
+
+    Usage:
+        python api_server.py --port 8000 --workers 4
+
+"""
+# Script dependencies
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import (BrokenExecutor, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from recommenders.collaborative_based import batch_collab_model
+from recommenders.content_based import batch_content_model
+from recommenders.hybrid import batch_hybrid_model
+from utils import instrumentation, registry
+
+ALGORITHMS = {'collab': batch_collab_model, 'content': batch_content_model,
+              'hybrid': batch_hybrid_model}
+# Largest top_n and number of profiles accepted per request.
+MAX_TOP_N = 100
+MAX_PROFILES = 1000
+
+
+class BadRequest(ValueError):
+    """A request the client has to fix; answered with status 400."""
+
+
+class UnknownAlgorithm(LookupError):
+    """An algorithm not in `ALGORITHMS`; answered with status 404."""
+
+
+def _warm_up():
+    return registry.warm_up()
+
+
+def _recommend_batch(algorithm, movie_lists, top_n):
+    # Switch to models replaced by update_models.py since the last batch.
+    registry.reload_if_changed()
+    recommended = ALGORITHMS[algorithm](movie_lists, top_n)
+    # The worker's stage timings travel back with its results.
+    return recommended, instrumentation.drain()
+
+
+def _unpack(result):
+    recommended, metrics = result
+    instrumentation.merge(metrics)
+    return recommended
+
+
+class MicroBatcher:
+    """Gathers single requests into batches for the worker pool.
+
+    A batch is sent once `max_batch` requests are waiting or the oldest
+    has waited `max_wait` seconds, whichever comes first.
+
+    Parameters
+    ----------
+    pool : concurrent.futures.Executor
+        Pool that scores the batches.
+    algorithm : str
+        Key of `ALGORITHMS`.
+    max_batch : int
+        Most requests sent together.
+    max_wait : float
+        Seconds a request may wait for others to join its batch.
+    on_error : callable, optional
+        Called with the pool and the exception when the pool refuses a
+        batch, e.g. to replace a broken pool. The batch's requests fail
+        with that exception.
+
+    """
+
+    def __init__(self, pool, algorithm, max_batch=32, max_wait=0.005,
+                 on_error=None):
+        self.pool = pool
+        self.algorithm = algorithm
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.on_error = on_error
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, movies, top_n):
+        """Future of the recommendations for one set of favourites."""
+        future = Future()
+        self._queue.put((movies, top_n, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            # Requests in one batch call must share top_n.
+            for top_n in {top_n for _, top_n, _ in batch}:
+                group = [(movies, future) for movies, n, future in batch
+                         if n == top_n]
+                pool = self.pool
+                try:
+                    result = pool.submit(_recommend_batch, self.algorithm,
+                                         [movies for movies, _ in group], top_n)
+                except Exception as error:
+                    # A broken or shut down pool must not stop the batcher.
+                    for _, future in group:
+                        future.set_exception(error)
+                    if self.on_error is not None:
+                        self.on_error(pool, error)
+                    continue
+                result.add_done_callback(
+                    lambda result, group=group: self._resolve(result, group))
+
+    @staticmethod
+    def _resolve(result, group):
+        error = result.exception()
+        recommended = _unpack(result.result()) if error is None else None
+        for position, (_, future) in enumerate(group):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(recommended[position])
+
+
+class RecommenderService:
+    """Worker pool and batchers behind the HTTP handler.
+
+    Parameters
+    ----------
+    workers : int
+        Worker processes; 0 scores in threads of the server process.
+    max_batch, max_wait
+        Passed to `MicroBatcher`.
+    timeout : float
+        Seconds a request may take before it fails.
+
+    """
+
+    def __init__(self, workers=None, max_batch=32, max_wait=0.005, timeout=30.0):
+        self.threads = workers == 0
+        self.n_workers = workers or os.cpu_count()
+        self.pool = self._new_pool()
+        self._pool_lock = threading.Lock()
+        self.timeout = timeout
+        self.batchers = {name: MicroBatcher(self.pool, name, max_batch, max_wait,
+                                            on_error=self._pool_failed)
+                         for name in ALGORITHMS}
+
+    def _new_pool(self):
+        if self.threads:
+            return ThreadPoolExecutor(self.n_workers)
+        return ProcessPoolExecutor(self.n_workers, initializer=_warm_up)
+
+    def _pool_failed(self, pool, error):
+        """Replace `pool` if it broke, e.g. after a worker was killed."""
+        if not isinstance(error, BrokenExecutor):
+            return
+        with self._pool_lock:
+            if self.pool is not pool:
+                # Already replaced after another failed batch.
+                return
+            print(f"Worker pool broken ({error}); starting a new one.",
+                  flush=True)
+            self.pool = self._new_pool()
+            for batcher in self.batchers.values():
+                batcher.pool = self.pool
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def health(self):
+        """Load the models in the workers and report the time it took.
+
+        Returns the longest load time of each resource over the workers;
+        all zeros once every worker is warm.
+        """
+        start = time.perf_counter()
+        futures = [self.pool.submit(_warm_up) for _ in range(self.n_workers)]
+        timings = registry.warm_up(['movie_index'])
+        for future in futures:
+            for name, seconds in future.result(timeout=self.timeout).items():
+                timings[name] = max(timings.get(name, 0.0), seconds)
+        return {'status': 'ok', 'workers': self.n_workers,
+                'version': registry.version(),
+                'resources': {name: round(seconds, 3)
+                              for name, seconds in timings.items()},
+                'seconds': round(time.perf_counter() - start, 3)}
+
+    def _check(self, algorithm, profiles, top_n):
+        if algorithm not in ALGORITHMS:
+            raise UnknownAlgorithm(algorithm)
+        # bool is an int too, but `"top_n": true` is not a number.
+        if type(top_n) is not int or not 0 < top_n <= MAX_TOP_N:
+            raise BadRequest(f"top_n must be an integer from 1 to {MAX_TOP_N}")
+        movie_index = registry.get('movie_index')
+        for movies in profiles:
+            if (not isinstance(movies, list) or not movies
+                    or not all(isinstance(title, str) for title in movies)):
+                raise BadRequest('Each profile must be a non-empty list of titles')
+            unknown = [title for title in movies if title not in movie_index]
+            if unknown:
+                raise BadRequest(f'Unknown movie title(s): {unknown}')
+
+    def recommend(self, algorithm, movies, top_n=10):
+        self._check(algorithm, [movies], top_n)
+        future = self.batchers[algorithm].submit(movies, top_n)
+        return future.result(timeout=self.timeout)
+
+    def recommend_batch(self, algorithm, profiles, top_n=10):
+        if not isinstance(profiles, list) or len(profiles) > MAX_PROFILES:
+            raise BadRequest(f"profiles must be a list of at most "
+                             f"{MAX_PROFILES} lists of titles")
+        self._check(algorithm, profiles, top_n)
+        pool = self.pool
+        try:
+            future = pool.submit(_recommend_batch, algorithm, profiles, top_n)
+        except Exception as error:
+            self._pool_failed(pool, error)
+            raise
+        return _unpack(future.result(timeout=self.timeout))
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints of a `RecommenderService`, set as `service`."""
+
+    service = None
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            data = instrumentation.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            return self.wfile.write(data)
+        if self.path != '/healthz':
+            return self._send(404, {'error': 'Not found'})
+        try:
+            self._send(200, self.service.health())
+        except Exception as error:
+            self._send(503, {'status': 'unavailable', 'error': str(error)})
+
+    def do_POST(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) not in (2, 3) or parts[0] != 'recommend' or (
+                len(parts) == 3 and parts[2] != 'batch'):
+            return self._send(404, {'error': 'Not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send(400, {'error': 'The body must be a JSON object'})
+        if not isinstance(request, dict):
+            return self._send(400, {'error': 'The body must be a JSON object'})
+        try:
+            top_n = request.get('top_n', 10)
+            if len(parts) == 3:
+                body = {'recommendations': self.service.recommend_batch(
+                    parts[1], request.get('profiles'), top_n)}
+            else:
+                body = {'recommendations': self.service.recommend(
+                    parts[1], request.get('movies'), top_n)}
+        except UnknownAlgorithm:
+            return self._send(404, {'error': f'Unknown algorithm: {parts[1]}'})
+        except BadRequest as error:
+            return self._send(400, {'error': str(error)})
+        except Exception as error:
+            self.log_error('Recommendation failed: %r', error)
+            return self._send(500, {'error': 'Recommendation failed'})
+        self._send(200, body)
+
+
+class RecommendationServer(ThreadingHTTPServer):
+    """Threaded HTTP server with room for bursts of connections."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def serve(host='0.0.0.0', port=8000, workers=None, max_batch=32,
+          max_wait=0.005):
+    """Run the service until interrupted."""
+    RequestHandler.service = RecommenderService(workers, max_batch, max_wait)
+    server = RecommendationServer((host, port), RequestHandler)
+    print(f"Serving recommendations on http://{host}:{port} "
+          f"with {RequestHandler.service.n_workers} workers.", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        RequestHandler.service.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve movie recommendations over HTTP.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Worker processes; 0 to score in threads.')
+    parser.add_argument('--max-batch', type=int, default=32,
+                        help='Most single requests scored together.')
+    parser.add_argument('--max-wait', type=float, default=0.005,
+                        help='Seconds a request waits for others to batch with.')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.max_batch, args.max_wait)
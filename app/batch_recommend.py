@@ -0,0 +1,179 @@
+"""
+
+    Offline bulk recommendation job.
+
+    Author: Explore Data Science Academy.
+
+    Description: Precomputes top-N recommendations for stored user
+    profiles. Profiles are streamed from a JSON lines file, one per line:
+
+        {"id": 42, "movies": ["Toy Story (1995)", "Heat (1995)"]}
+
+    They are scored in chunks by `batch_collab_model`,
+    `batch_content_model` or `batch_hybrid_model` across a pool of worker
+    processes. Each chunk is written to its own `part-NNNNN.jsonl` file in
+    the output folder, one line per profile in input order. A profile that cannot be scored gets
+    an "error" entry instead of "recommendations".
+
+    The settings of a run, a digest of its input and the version of the
+    data and models are written to `manifest.json` in the output folder.
+    Finished parts are skipped when the job is run again with the same
+    manifest, so an interrupted run resumes where it stopped; a folder
+    holding parts of a different run is refused unless `--restart` is
+    given, which removes them first.
+
+    Usage:
+        python batch_recommend.py profiles.jsonl output/ --model collab
+        python batch_recommend.py profiles.jsonl output/ --model content \
+            --chunk-size 5000 --n-jobs 8
+
+"""
+# Script dependencies
+import argparse
+import glob
+import itertools
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from recommenders.collaborative_based import batch_collab_model
+from recommenders.content_based import batch_content_model
+from recommenders.hybrid import batch_hybrid_model
+from utils import registry
+from utils.csv_cache import file_digest
+from utils.files import write_atomic, write_json
+
+MODELS = {'collab': batch_collab_model, 'content': batch_content_model,
+          'hybrid': batch_hybrid_model}
+
+
+def read_profiles(path):
+    """Yield (profile ID, favourite movie titles) from a JSON lines file."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                profile = json.loads(line)
+                yield profile['id'], profile['movies']
+
+
+def part_path(output_dir, number):
+    return os.path.join(output_dir, f'part-{number:05d}.jsonl')
+
+
+def prepare_output(output_dir, manifest, restart=False):
+    """Make `output_dir` ready for the run described by `manifest`.
+
+    Parts left by the same run are kept for it to resume; parts of any
+    other run are removed with `restart`, and refused otherwise.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    previous = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+    parts = glob.glob(os.path.join(output_dir, 'part-*.jsonl'))
+    if parts and previous != manifest:
+        if not restart:
+            changed = sorted(key for key in manifest
+                             if (previous or {}).get(key) != manifest[key])
+            raise SystemExit(f"{output_dir} holds parts of another run "
+                             f"(different {', '.join(changed)}); use "
+                             f"--restart to replace them.")
+        for path in parts:
+            os.remove(path)
+    write_atomic(manifest_path, lambda p: write_json(p, manifest))
+
+
+def score_chunk(model, profiles, top_n, path):
+    """Score one chunk of profiles and write it to `path`.
+
+    Returns
+    -------
+    int
+        Number of profiles written.
+    """
+    # Score with the current models, also in long-lived workers.
+    registry.reload_if_changed()
+    movie_index = registry.get('movie_index')
+    results = {}
+    valid = []
+    for position, (profile_id, movies) in enumerate(profiles):
+        unknown = [title for title in movies if title not in movie_index]
+        if not movies:
+            results[position] = {'id': profile_id, 'error': 'No movies given'}
+        elif unknown:
+            results[position] = {'id': profile_id,
+                                 'error': f'Unknown movie title(s): {unknown}'}
+        else:
+            valid.append(position)
+    recommended = MODELS[model]([profiles[p][1] for p in valid], top_n)
+    for position, titles in zip(valid, recommended):
+        results[position] = {'id': profiles[position][0],
+                             'recommendations': titles}
+
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        for position in range(len(profiles)):
+            f.write(json.dumps(results[position]) + '\n')
+    os.replace(tmp, path)
+    return len(profiles)
+
+
+def _init_worker():
+    # Load the recommender resources once per worker, before its first chunk.
+    registry.warm_up()
+
+
+def run(input_path, output_dir, model='collab', top_n=10, chunk_size=10000,
+        n_jobs=None, restart=False):
+    """Score every profile in `input_path` into parts under `output_dir`.
+
+    At most two chunks per worker are read ahead, so memory use does not
+    grow with the size of the input.
+    """
+    prepare_output(output_dir, {'model': model, 'top_n': top_n,
+                                'chunk_size': chunk_size,
+                                'input': file_digest(input_path),
+                                'version': registry.version()}, restart)
+    n_jobs = n_jobs or os.cpu_count()
+    profiles = read_profiles(input_path)
+    start = time.perf_counter()
+    done = skipped = 0
+    with ProcessPoolExecutor(max_workers=n_jobs,
+                             initializer=_init_worker) as pool:
+        in_flight = set()
+        for number in itertools.count():
+            chunk = list(itertools.islice(profiles, chunk_size))
+            if not chunk:
+                break
+            path = part_path(output_dir, number)
+            if os.path.exists(path):
+                skipped += len(chunk)
+                continue
+            if len(in_flight) >= 2 * n_jobs:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                done += sum(future.result() for future in finished)
+                print(f"{done} profiles scored "
+                      f"({time.perf_counter() - start:.0f}s elapsed)", flush=True)
+            in_flight.add(pool.submit(score_chunk, model, chunk, top_n, path))
+        done += sum(future.result() for future in in_flight)
+    print(f"Done: {done} profiles scored, {skipped} already in {output_dir}, "
+          f"in {time.perf_counter() - start:.0f}s.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Precompute recommendations for stored user profiles.')
+    parser.add_argument('input', help='JSON lines file of profiles.')
+    parser.add_argument('output_dir', help='Folder for the result parts.')
+    parser.add_argument('--model', choices=list(MODELS), default='collab')
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--n-jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--restart', action='store_true',
+                        help='Replace parts left by a different run.')
+    args = parser.parse_args()
+    run(args.input, args.output_dir, args.model, args.top_n, args.chunk_size,
+        args.n_jobs, args.restart)
@@ -0,0 +1,373 @@
+"""
+
+    Recommender benchmark suite.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures the latency and memory use of the recommender
+    functions on synthetic, MovieLens-shaped datasets, so optimisations
+    can be checked at the scale they are meant for.
+
+    Each dataset is generated once from a fixed seed, with the number of
+    users, movies and ratings of a MovieLens release, skewed movie
+    popularity and user activity, and ratings drawn from a low-rank model.
+    Factors (ALS) and the item neighbour index are trained for it the way
+    the offline scripts do. Every function is then measured in a fresh
+    process pointed at the dataset with FLICK_RESOURCES_DIR, which reports:
+
+      - first_call_ms: the first call, including loading resources (the
+        only timed call of functions that train a model);
+      - p50_ms, p95_ms, mean_ms and throughput_per_s over the next calls;
+      - peak_rss_mb: peak resident memory of the process;
+      - alloc_peak_mb and alloc_blocks: peak Python memory traced during
+        one call, and the memory blocks still allocated when it returns
+        (its result included), from tracemalloc.
+
+    Results are written as JSON, with the commit they were measured on;
+    `--compare` prints the change of each latency against an earlier file.
+    The result cache is turned off, so repeated calls are really computed.
+
+    Usage:
+        python benchmark.py --scales 100k 1m --output bench.json
+        python benchmark.py --scales 1m --compare bench.json
+
+"""
+# Script dependencies
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then not reported.
+    resource = None
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = os.path.join(tempfile.gettempdir(), 'flick-benchmarks')
+
+# Scale: (ratings, users, movies) of the MovieLens release it imitates.
+SCALES = {
+    '100k': (100836, 610, 9742),
+    '1m': (1000209, 6040, 3706),
+    '25m': (25000095, 162541, 62423),
+}
+GENRES = ['Drama', 'Comedy', 'Thriller', 'Action', 'Romance', 'Adventure',
+          'Crime', 'Sci-Fi', 'Horror', 'Fantasy', 'Children', 'Animation',
+          'Mystery', 'Documentary', 'War', 'Musical', 'Western', 'IMAX',
+          'Film-Noir']
+FUNCTIONS = ['collab_model', 'content_model', 'hybrid_model',
+             'prediction_item', 'load_movie_titles', 'svd_pp']
+# Functions that train a model: only the first call is timed, and only up
+# to `--train-max-ratings` ratings.
+TRAINING = {'svd_pp'}
+
+
+def _ratings(rng, n_ratings, n_users, n_movies):
+    """(user, movie) rows of `n_ratings` distinct pairs and their ratings."""
+    # Few movies get most ratings, and a few users rate the most.
+    popularity = 1.0 / (np.arange(n_movies) + 10.0)
+    popularity = rng.permutation(popularity / popularity.sum())
+    activity = rng.lognormal(0.0, 1.0, n_users)
+    activity /= activity.sum()
+    pairs = np.empty(0, dtype=np.int64)
+    while len(pairs) < n_ratings:
+        m = int((n_ratings - len(pairs)) * 1.2) + 1000
+        users = rng.choice(n_users, m, p=activity)
+        movies = rng.choice(n_movies, m, p=popularity)
+        pairs = np.unique(np.concatenate([pairs, users * n_movies + movies]))
+    pairs = np.sort(rng.choice(pairs, n_ratings, replace=False))
+    users, movies = np.divmod(pairs, n_movies)
+
+    # Low-rank tastes plus biases and noise, in half stars.
+    n_factors = 8
+    pu = rng.normal(0, 0.35, (n_users, n_factors))
+    qi = rng.normal(0, 0.35, (n_movies, n_factors))
+    estimate = (3.5 + rng.normal(0, 0.4, n_users)[users]
+                + rng.normal(0, 0.5, n_movies)[movies]
+                + np.einsum('ij,ij->i', pu[users], qi[movies])
+                + rng.normal(0, 0.5, n_ratings))
+    ratings = np.clip(np.round(estimate * 2) / 2, 0.5, 5.0)
+    return users, movies, ratings
+
+
+def make_dataset(directory, scale, seed=0):
+    """Write the synthetic `scale` dataset and its models under `directory`.
+
+    The data goes to `data/movies.csv` and `data/ratings.csv`, the models
+    to `models/`. Nothing is done if the dataset is already complete.
+    """
+    done = os.path.join(directory, 'dataset.json')
+    if os.path.exists(done):
+        return
+    n_ratings, n_users, n_movies = SCALES[scale]
+    rng = np.random.default_rng(seed)
+    data_dir = os.path.join(directory, 'data')
+    models_dir = os.path.join(directory, 'models')
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(models_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    # MovieLens IDs have gaps.
+    movie_ids = np.sort(rng.choice(n_movies * 3, n_movies, replace=False)) + 1
+    years = rng.integers(1920, 2020, n_movies)
+    n_genres = rng.integers(1, 4, n_movies)
+    genre_weights = 1.0 / np.arange(1, len(GENRES) + 1)
+    genre_weights /= genre_weights.sum()
+    genres = ['|'.join(rng.choice(GENRES, n, replace=False, p=genre_weights))
+              for n in n_genres]
+    pd.DataFrame({
+        'movieId': movie_ids,
+        'title': [f'Synthetic Movie {i} ({y})' for i, y in zip(movie_ids, years)],
+        'genres': genres,
+    }).to_csv(os.path.join(data_dir, 'movies.csv'), index=False)
+
+    users, movies, ratings = _ratings(rng, n_ratings, n_users, n_movies)
+    pd.DataFrame({
+        'userId': users + 1,
+        'movieId': movie_ids[movies],
+        'rating': ratings,
+        'timestamp': rng.integers(789652009, 1574327703, n_ratings),
+    }).to_csv(os.path.join(data_dir, 'ratings.csv'), index=False)
+    print(f"[{scale}] Data written in {time.perf_counter() - start:.0f}s.",
+          flush=True)
+
+    # The models `collab_model` serves from, as the offline scripts build them.
+    from recommenders.als import ALS
+    from recommenders.neighbours import (build_item_neighbours,
+                                         save_item_neighbours)
+    start = time.perf_counter()
+    user_ids, item_ids = users + 1, movie_ids[movies]
+    ALS(n_factors=50, n_epochs=10, seed=seed).fit(
+        user_ids, item_ids, ratings).save(
+        os.path.join(models_dir, 'svd_factors'), algorithm='ALS')
+    save_item_neighbours(os.path.join(models_dir, 'item_neighbours.npz'),
+                         build_item_neighbours(user_ids, item_ids, ratings))
+    print(f"[{scale}] Models trained in {time.perf_counter() - start:.0f}s.",
+          flush=True)
+
+    with open(done, 'w') as f:
+        json.dump({'scale': scale, 'seed': seed, 'ratings': n_ratings,
+                   'users': n_users, 'movies': n_movies}, f)
+
+
+def _calls(function, n_calls, seed):
+    """`n_calls` argument-free calls of `function` with sampled inputs.
+
+    Imported here, in the measuring process, after FLICK_RESOURCES_DIR is
+    set, so the registry reads the benchmark dataset.
+    """
+    from utils import registry
+    rng = np.random.default_rng(seed)
+    ratings = registry.read_csv('ratings')
+    rated = np.unique(ratings['movieId'].values)
+    movie_index = registry.get('movie_index')
+
+    def profile():
+        return list(movie_index.titles(rng.choice(rated, 3, replace=False)))
+
+    if function == 'collab_model':
+        from recommenders.collaborative_based import collab_model
+        return [lambda p=profile(): collab_model(p, top_n=10)
+                for _ in range(n_calls)]
+    if function == 'content_model':
+        from recommenders.content_based import content_model
+        return [lambda p=profile(): content_model(p, top_n=10)
+                for _ in range(n_calls)]
+    if function == 'hybrid_model':
+        from recommenders.hybrid import hybrid_model
+        return [lambda p=profile(): hybrid_model(p, top_n=10)
+                for _ in range(n_calls)]
+    if function == 'prediction_item':
+        from recommenders.collaborative_based import prediction_item
+        return [lambda m=int(rng.choice(rated)): prediction_item(m, k=10)
+                for _ in range(n_calls)]
+    if function == 'load_movie_titles':
+        from utils.data_loader import load_movie_titles
+        path = registry.data_path('movies.csv')
+        return [lambda: load_movie_titles(path) for _ in range(n_calls)]
+    if function == 'svd_pp':
+        sys.path.insert(0, os.path.join(APP_DIR, 'resources', 'models'))
+        from train_colbased import svd_pp
+        # Kept with the dataset, and overwritten by the next run.
+        output = os.path.join(registry.RESOURCES_DIR, 'svd_pp')
+        os.makedirs(output, exist_ok=True)
+        path = registry.data_path('ratings.csv')
+        return [lambda: svd_pp(os.path.join(output, 'SVD.pkl'), path)
+                for _ in range(n_calls)]
+    raise ValueError(f"Unknown function: {function!r}")
+
+
+def _peak_rss_mb():
+    # VmHWM is this process's own peak; on Linux ru_maxrss also counts the
+    # parent's, as it survives the exec of a spawned process.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+def measure(function, repeats=50, seed=0):
+    """Latency and memory use of `function` in this process.
+
+    Returns
+    -------
+    dict
+        The metrics described in the module docstring.
+    """
+    from utils import registry
+    calls = _calls(function, repeats + 2, seed)
+    # The first call loads what it needs itself.
+    registry.reset()
+    start = time.perf_counter()
+    calls[0]()
+    first_call = time.perf_counter() - start
+
+    times = []
+    for call in calls[1:-1]:
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    times = np.array(times)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = calls[-1]()
+    after = tracemalloc.take_snapshot()
+    alloc_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    alloc_blocks = sum(stat.count_diff for stat in
+                       after.compare_to(before, 'lineno') if stat.count_diff > 0)
+    del result
+
+    return {
+        'function': function,
+        'calls': len(times),
+        'first_call_ms': first_call * 1e3,
+        'p50_ms': float(np.percentile(times, 50)) * 1e3 if len(times) else None,
+        'p95_ms': float(np.percentile(times, 95)) * 1e3 if len(times) else None,
+        'mean_ms': float(times.mean()) * 1e3 if len(times) else None,
+        'throughput_per_s': len(times) / times.sum() if times.sum() else None,
+        'peak_rss_mb': _peak_rss_mb(),
+        'alloc_peak_mb': alloc_peak / (1 << 20),
+        'alloc_blocks': alloc_blocks,
+    }
+
+
+def _measure_in(directory, function, repeats, seed):
+    os.environ['FLICK_RESOURCES_DIR'] = directory
+    os.environ['FLICK_RESULT_CACHE'] = 'off'
+    sys.path.insert(0, APP_DIR)
+    return measure(function, repeats, seed)
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=APP_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales, functions=FUNCTIONS, repeats=50, seed=0, work_dir=WORK_DIR,
+        train_max_ratings=1000000):
+    """Benchmark `functions` on every scale in `scales`.
+
+    Returns
+    -------
+    dict
+        Environment of the run and one result per scale and function.
+    """
+    results = []
+    # A fresh interpreter per measurement, so memory peaks are not shared.
+    context = multiprocessing.get_context('spawn')
+    for scale in scales:
+        directory = os.path.join(work_dir, f'{scale}-seed{seed}')
+        make_dataset(directory, scale, seed)
+        for function in functions:
+            result = {'scale': scale, 'function': function}
+            if function in TRAINING and SCALES[scale][0] > train_max_ratings:
+                result['skipped'] = (f'More than {train_max_ratings} ratings; '
+                                     f'see --train-max-ratings.')
+            else:
+                with context.Pool(1) as pool:
+                    result.update(pool.apply(_measure_in, (
+                        directory, function,
+                        0 if function in TRAINING else repeats, seed)))
+            results.append(result)
+            print(json.dumps(result), flush=True)
+    return {
+        'commit': _commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': seed,
+        'repeats': repeats,
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    """Print the latency change of each result against `baseline`."""
+    previous = {(r['scale'], r['function']): r for r in baseline['results']}
+    print(f"Against {baseline.get('commit')} ({baseline.get('created')}):")
+    for result in report['results']:
+        old = previous.get((result['scale'], result['function']))
+        if old is None or 'skipped' in result or 'skipped' in old:
+            continue
+        changes = []
+        for metric in ('first_call_ms', 'p50_ms', 'p95_ms', 'peak_rss_mb'):
+            if result.get(metric) and old.get(metric):
+                change = result[metric] / old[metric] - 1
+                changes.append(f"{metric} {result[metric]:.2f} ({change:+.0%})")
+        print(f"  {result['scale']:>5} {result['function']:<18} "
+              + ', '.join(changes))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the recommenders on synthetic MovieLens data.')
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES),
+                        default=['100k', '1m'])
+    parser.add_argument('--functions', nargs='+', choices=FUNCTIONS,
+                        default=FUNCTIONS)
+    parser.add_argument('--repeats', type=int, default=50,
+                        help='Timed calls per function, after the first.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=WORK_DIR,
+                        help='Folder of the generated datasets.')
+    parser.add_argument('--train-max-ratings', type=int, default=1000000,
+                        help='Largest dataset the training functions run on.')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='Earlier results to compare with.')
+    args = parser.parse_args()
+
+    report = run(args.scales, args.functions, args.repeats, args.seed,
+                 args.work_dir, args.train_max_ratings)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to: {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
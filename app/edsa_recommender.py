@@ -29,6 +29,10 @@
 import streamlit as st
 
 # Data handling dependencies
+import functools
+import io
+import os
+import threading
 import pandas as pd
 import numpy as np
 
@@ -43,21 +47,176 @@ from matplotlib.backends.backend_agg import RendererAgg
 from matplotlib.figure import Figure
 import seaborn as sns
 from wordcloud import WordCloud
-_lock = RendererAgg.lock
+# Matplotlib's Agg renderer is not thread-safe; newer releases dropped its lock.
+_lock = getattr(RendererAgg, 'lock', None) or threading.RLock()
 
 # Custom Libraries
-from utils.data_loader import load_movie_titles
+from utils import instrumentation, registry
+from utils.insights import cached_image, load_insight
 from recommenders.collaborative_based import collab_model
 from recommenders.content_based import content_model
 
 
-# Data Loading
-title_list = load_movie_titles('./resources/data/movies.csv')
-
-# Creating dataframes
-movies = pd.read_csv('./resources/data/movies.csv')
-imdb_data = pd.read_csv('./resources/data/imdb_data.csv')
-tags = pd.read_csv('./resources/data/tags.csv')
+# Streamlit re-runs this script on every interaction; cached objects
+# survive the reruns and are shared by every session. Older Streamlit
+# releases only provide `st.cache`.
+if hasattr(st, 'cache_resource'):
+    cache_resource, cache_data = st.cache_resource, st.cache_data
+else:
+    cache_resource = functools.partial(st.cache, allow_output_mutation=True)
+    cache_data = st.cache
+
+# Serve Insights plots as cached PNG images rather than redrawing them.
+CACHE_PLOT_IMAGES = os.environ.get('FLICK_CACHE_PLOTS', '1') != '0'
+# Port of a Prometheus text endpoint for the recommender timings, when
+# FLICK_METRICS is on (see utils.instrumentation).
+METRICS_PORT = os.environ.get('FLICK_METRICS_PORT')
+
+
+@cache_resource
+def load_resource(name):
+    """Dataset or model `name`, loaded once (see utils.registry)."""
+    return registry.get(name)
+
+
+@cache_resource
+def metrics_server(port):
+    """Serve the recommender metrics on `port`, once per process."""
+    return instrumentation.start_http_server(port)
+
+
+@cache_data
+def insight_table(selection, version):
+    """Aggregated data behind an Insights plot.
+
+    The counts are precomputed by resources/models/build_insights.py (see
+    utils.insights). `version` is `registry.version()`, so the cached
+    tables are reloaded when the datasets change.
+    """
+    if selection == "-- Popular Movie Genres":
+        return load_insight('genres').rename(columns={'value': 'genres'})
+
+    if selection == "-- Top 20 Actors in most Movies":
+        # Sececting the Top 20 actors in movies
+        movies_actor = load_insight('actors', top=20).rename(
+            columns={'value': 'title_cast', 'count': 'Number of Movies'})
+        return movies_actor.sort_values(by='Number of Movies', ascending=True)
+
+    if selection == "-- Top 20 Directors With Most Movies":
+        movies_director = load_insight('directors', top=20).rename(
+            columns={'value': 'director'})
+        return movies_director.sort_values(by='count', ascending=True)
+
+    if selection == "-- Top 20 Popular Play Plots":
+        movies_plot = load_insight('plot_keywords', top=20).rename(
+            columns={'value': 'plot_keywords'})
+        return movies_plot.sort_values(by='count', ascending=True)
+
+    raise ValueError(f"Unknown Insights plot: {selection}")
+
+
+def insight_figure(selection, version):
+    """Matplotlib figure of an Insights plot."""
+    if selection == "-- Popular Movie Tags":
+        # Word counts precomputed by utils.insights, rather than one string
+        # of every tag re-tokenized on each render.
+        tag_words = load_insight('tag_words', top=100)
+        wc = WordCloud(background_color="white", max_words=100,
+                       width=1600, height=800, collocations=False
+                       ).generate_from_frequencies(
+                           dict(zip(tag_words['value'], tag_words['count'])))
+        fig5 = Figure()
+        ax = fig5.subplots()
+        ax.imshow(wc)
+        ax.axis("off")
+        return fig5
+
+    table = insight_table(selection, version)
+
+    if selection == "-- Popular Movie Genres":
+        fig1 = Figure()
+        ax = fig1.subplots()
+        sns.barplot(x='count', y='genres', data=table, color='pink', alpha=0.9, ax=ax)
+        ax.set_xlabel('count')
+        ax.set_ylabel('Genre')
+        ax.set_title('Popular Movie Genres')
+        return fig1
+
+    if selection == "-- Top 20 Actors in most Movies":
+        # Plot the figure.
+        y_labels = table['title_cast']
+        fig2 = Figure(figsize=(17, 12), dpi=85)
+        ax = fig2.subplots()
+        ax = table['Number of Movies'].plot(
+            kind='barh', color='pink', fontsize=17, xlim=[45, 84], width=.75, alpha=0.8, ax=ax)
+        ax.set_ylabel('Name of Actor', fontsize=30)
+        ax.set_xlabel('Number of movies featuring the actor', fontsize=30)
+        ax.set_title('Top 20 Actors in IMDB Dataset ', fontsize=30)
+        ax.set_yticklabels(y_labels)
+        return fig2
+
+    if selection == "-- Top 20 Directors With Most Movies":
+        y_labels = table['director']
+        # Plot the figure.
+        fig3 = Figure(figsize=(18, 12), dpi=85)
+        ax = fig3.subplots()
+        ax = table['count'].plot(
+            kind='barh', color='blue',  width=.7, fontsize=16, xlim=[8, 30], alpha=0.9, ax=ax)
+        ax.set_title(
+            'Top 20 directors with the  most Movies from imdb database', fontsize=30)
+        ax.set_xlabel('Number of Movies Directed', fontsize=30)
+        ax.set_ylabel('Name of director', fontsize=30)
+        ax.set_yticklabels(y_labels)
+        return fig3
+
+    if selection == "-- Top 20 Popular Play Plots":
+        y_labels = table['plot_keywords']
+        # Plot the figure.
+        fig4 = Figure(figsize=(18, 12), dpi=85)
+        ax = fig4.subplots()
+        ax = table['count'].plot(kind='barh', color='lightblue', fontsize=17, width=.7, alpha=0.7, ax=ax)
+        ax.set_title('Top 20 Popular Play Plots ', fontsize=30)
+        ax.set_xlabel('Total Number of Play Plots', fontsize=30)
+        ax.set_ylabel('Movie plot', fontsize=30)
+        ax.set_yticklabels(y_labels)
+        return fig4
+
+    raise ValueError(f"Unknown Insights plot: {selection}")
+
+
+@cache_data
+def insight_png(selection, version):
+    """PNG image of an Insights plot, rendered once per plot and version.
+
+    Images are also kept on disk (utils.insights.cached_image), so other
+    workers and restarts reuse them.
+    """
+    def render():
+        with _lock:
+            buffer = io.BytesIO()
+            insight_figure(selection, version).savefig(buffer, format='png')
+        return buffer.getvalue()
+    name = selection.strip('- ').lower().replace(' ', '_')
+    return cached_image(name, version, render)
+
+
+def show_insight(selection):
+    """Display an Insights plot, from the image cache if enabled."""
+    version = registry.version()
+    if CACHE_PLOT_IMAGES:
+        st.image(insight_png(selection, version), use_column_width=True)
+    else:
+        st.pyplot(insight_figure(selection, version))
+
+
+# Data Loading. Datasets are read lazily, once per process, by
+# utils.registry; the Insights data is only read when a plot needs it.
+# Models replaced by resources/models/update_models.py are picked up on
+# the next rerun.
+registry.reload_if_changed()
+title_list = load_resource('title_list')
+if METRICS_PORT:
+    metrics_server(int(METRICS_PORT))
 
 
 # App declaration
@@ -167,21 +326,7 @@ def main():
         if plot_selection == "-- Popular Movie Genres":
 
             ################# Plot 1 ############
-            # Create dataframe containing only the movieId and genres
-
-            movies_genres = pd.DataFrame(movies[['movieId', 'genres']],
-                    columns=['movieId', 'genres'])
-            # Split genres seperated by "|" and create a list containing the genres allocated to each movie
-            movies_genres.genres = movies_genres.genres.apply(lambda x: x.split('|'))
-            # Create expanded dataframe where each movie-genre combination is in a seperate row
-            movies_genres = pd.DataFrame([(tup.movieId, d) for tup in movies_genres.itertuples() for d in tup.genres], columns=['movieId', 'genres'])
-
-            fig1 = Figure()
-            ax = fig1.subplots()
-            sns.countplot(y="genres", data=movies_genres, order=movies_genres['genres'].value_counts(ascending=False).index, color='pink', alpha=0.9, ax=ax)
-            ax.set_ylabel('Genre')
-            ax.set_title('Popular Movie Genres')
-            st.pyplot(fig1)
+            show_insight(plot_selection)
             st.write("")
             st.info('Drama and Comedy are the most popular Genres among viewers')
                     ################# Plot 2 ############
@@ -224,37 +369,7 @@ def main():
 
                     ################# Plot 3 ############
         if plot_selection == "-- Top 20 Actors in most Movies":
-            movies_actor = pd.DataFrame(imdb_data[['movieId', 'title_cast']],
-                    columns=['movieId', 'title_cast'])
-
-            # Split title_cast seperated by "|" and create a list containing the title_cast allocated to each movie
-            movies_actor = movies_actor[movies_actor['title_cast'].notnull()]
-            movies_actor.title_cast = movies_actor.title_cast.apply(lambda x: x.split('|'))
-
-            # Create expanded dataframe where each movie-tite_cast combination is in a seperate row
-            movies_actor = pd.DataFrame([(tup.movieId, d) for tup in movies_actor.itertuples() for d in tup.title_cast],
-                    columns=['movieId', 'title_cast'])
-            movies_actor = movies_actor.groupby(
-                ['title_cast'])['movieId'].count().reset_index(name='Number of Movies')
-            movies_actor = movies_actor.sort_values(by='Number of Movies', ascending=False)
-
-            # Sececting the Top 20 actors in movies
-            movies_actor = movies_actor .head(20)
-            movies_actor = movies_actor.sort_values(by='Number of Movies', ascending=True)
-            y_labels = movies_actor['title_cast']
-
-            # Plot the figure.
-            y_labels = movies_actor['title_cast']
-            fig2 = Figure(figsize=(17, 12), dpi=85)
-            ax = fig2.subplots()
-            ax = movies_actor['Number of Movies'].plot(
-                kind='barh', color='pink', fontsize=17, xlim=[45, 84], width=.75, alpha=0.8, ax=ax)
-            #sns.countplot(y='title_cast', data=movies_actor,order=movies_actor['title_cast'].value_counts(ascending=False).index,palette='deep',ax=ax)
-            ax.set_ylabel('Name of Actor', fontsize=30)
-            ax.set_xlabel('Number of movies featuring the actor', fontsize=30)
-            ax.set_title('Top 20 Actors in IMDB Dataset ', fontsize=30)
-            ax.set_yticklabels(y_labels)
-            st.pyplot(fig2)
+            show_insight(plot_selection)
             st.write("")
             st.info('Popular Actors tend to be featured in most movies')
 
@@ -262,29 +377,7 @@ def main():
          ################## Plot 4 ################################
         if plot_selection == "-- Top 20 Directors With Most Movies":
 
-            # grouping the movies by the director and counting the total number of movies per director
-            movies_director = pd.DataFrame(
-                imdb_data[['movieId', 'director']], columns=['movieId', 'director'])
-            movies_director = movies_director.groupby(
-                ['director'])['movieId'].count().reset_index(name="count")
-            movies_director = movies_director.sort_values(
-                by='count', ascending=False)
-            movies_director = movies_director .head(20)
-            movies_director = movies_director.sort_values(
-                by='count', ascending=True)
-
-            y_labels = movies_director['director']
-            # Plot the figure.
-            fig3 = Figure(figsize=(18, 12), dpi=85)
-            ax = fig3.subplots()
-            ax = movies_director['count'].plot(
-                kind='barh', color='blue',  width=.7, fontsize=16, xlim=[8, 30], alpha=0.9, ax=ax)
-            ax.set_title(
-                'Top 20 directors with the  most Movies from imdb database', fontsize=30)
-            ax.set_xlabel('Number of Movies Directed', fontsize=30)
-            ax.set_ylabel('Name of director', fontsize=30)
-            ax.set_yticklabels(y_labels)
-            st.pyplot(fig3)
+            show_insight(plot_selection)
             st.write("")
             st.info('Directors that are mostly liked by people tend to release the most number movies')
             st.write("")
@@ -292,48 +385,14 @@ def main():
 
         ################## Plot 5 ################################
         if plot_selection == "-- Top 20 Popular Play Plots":
-
-            movies_plot = pd.DataFrame(imdb_data[['movieId', 'plot_keywords']], columns=[
-                                       'movieId', 'plot_keywords'])
-            # Split play plot seperated by "|" and create a list containing the play plot allocated to each movie
-            movies_plot = movies_plot[movies_plot['plot_keywords'].notnull()]
-            movies_plot.plot_keywords = movies_plot.plot_keywords.apply(
-                lambda x: x.split('|'))
-            # Create expanded dataframe where each movie-play_plot combination is in a seperate row
-            movies_plot = pd.DataFrame([(tup.movieId, d) for tup in movies_plot.itertuples(
-            ) for d in tup.plot_keywords], columns=['movieId', 'plot_keywords'])
-            movies_plot = movies_plot.groupby(['plot_keywords'])[
-                'movieId'].count().reset_index(name="count")
-            movies_plot = movies_plot.sort_values(by='count', ascending=False)
-            movies_plot = movies_plot.head(20)
-            movies_plot = movies_plot.sort_values(by='count', ascending=True)
-
-            y_labels = movies_plot['plot_keywords']
-            # Plot the figure.
-            fig4 = Figure(figsize=(18, 12), dpi=85)
-            ax = fig4.subplots()
-            ax = movies_plot['count'].plot(kind='barh', color='lightblue', fontsize=17, width=.7, alpha=0.7, ax=ax)
-            ax.set_title('Top 20 Popular Play Plots ', fontsize=30)
-            ax.set_xlabel('Total Number of Play Plots', fontsize=30)
-            ax.set_ylabel('Movie plot', fontsize=30)
-            ax.set_yticklabels(y_labels)
-            st.pyplot(fig4)
+            show_insight(plot_selection)
             st.write("")
             st.info('The  graph show\'s that people tend to enjoy a movie with certain movie plots, such as love and nudity.')
 
 
          ###################### Plot 6 ##############################
         if plot_selection == "-- Popular Movie Tags":
-
-            tags_2 = str(list(tags['tag']))
-
-            wc = WordCloud(background_color="white", max_words=100,
-                           width=1600, height=800, collocations=False).generate(tags_2)
-            plt.imshow(wc)
-            plt.axis("off")
-            st.set_option('deprecation.showPyplotGlobalUse', False)
-            plt.rcParams["axes.grid"] = False
-            st.pyplot()
+            show_insight(plot_selection)
 
     if page_selection == "Company Information":
         st.title("Company Information")
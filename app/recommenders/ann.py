@@ -0,0 +1,305 @@
+"""
+
+    Approximate nearest-neighbour search over movie embeddings.
+
+    Author: Explore Data Science Academy.
+
+    Description: An inverted-file (IVF) index. Movies are clustered with
+    k-means offline and stored list by list; a query is compared with the
+    cluster centroids and then only with the movies of the `nprobe`
+    closest clusters. Raising `nprobe` trades latency for recall, which
+    `recall_at_k` measures against an exact scan.
+
+    Indexes are built by resources/models/build_ann_index.py and saved
+    next to the model as `.npz` files.
+
+"""
+
+# Script dependencies
+import os
+
+import numpy as np
+
+from recommenders.factors import top_k
+
+# Lists probed per query when neither the caller nor the index says.
+NPROBE = int(os.environ.get('FLICK_ANN_NPROBE', 0)) or None
+
+METRICS = ('ip', 'cosine')
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def _nearest(vectors, centroids, block_size=65536):
+    """Index of the closest centroid (Euclidean) to each vector."""
+    sq_norms = (centroids ** 2).sum(axis=1)
+    assign = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        assign[start:start + block_size] = np.argmin(
+            sq_norms - 2 * block @ centroids.T, axis=1)
+    return assign
+
+
+def kmeans(vectors, n_clusters, n_iter=20, sample_size=100000, seed=0):
+    """Lloyd's k-means on (a sample of) `vectors`.
+
+    Parameters
+    ----------
+    vectors : np.ndarray
+        Points to cluster, shape (n, dim).
+    n_clusters : int
+        Number of centroids.
+    n_iter : int
+        Lloyd iterations.
+    sample_size : int
+        Points the centroids are trained on; the rest only get assigned.
+    seed : int
+        Seed of the sample and the initial centroids.
+
+    Returns
+    -------
+    np.ndarray
+        Centroids, shape (n_clusters, dim).
+
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = _nearest(vectors, centroids)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.stack([np.bincount(assign, weights=vectors[:, d],
+                                     minlength=n_clusters)
+                         for d in range(vectors.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Restart empty clusters from random points.
+        n_empty = int((~filled).sum())
+        if n_empty:
+            centroids[~filled] = vectors[rng.choice(len(vectors), n_empty)]
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index of movie vectors.
+
+    Parameters
+    ----------
+    centroids : np.ndarray
+        Cluster centroids, shape (n_lists, dim).
+    offsets : np.ndarray
+        Start of each cluster's movies in `vectors`, plus the end.
+    item_ids : np.ndarray
+        Raw movie IDs, grouped by cluster.
+    vectors : np.ndarray
+        Movie vectors, grouped by cluster.
+    metric : str
+        'ip' for inner product, 'cosine' for cosine similarity (vectors
+        are then stored normalized).
+    nprobe : int
+        Clusters searched per query unless `search` is told otherwise.
+    version : str, optional
+        Version of the model the vectors came from, e.g.
+        `LatentFactors.version`, so an index left from an earlier model
+        can be told apart.
+
+    """
+
+    def __init__(self, centroids, offsets, item_ids, vectors, metric='ip',
+                 nprobe=8, version=None):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+        self.centroids = centroids
+        self.offsets = offsets
+        self.item_ids = item_ids
+        self.vectors = vectors
+        self.metric = metric
+        self.nprobe = int(nprobe)
+        self.version = version
+
+    @classmethod
+    def build(cls, vectors, item_ids, metric='ip', n_lists=None, nprobe=8,
+              n_iter=20, seed=0):
+        """Cluster movie vectors into an index.
+
+        Parameters
+        ----------
+        vectors : np.ndarray
+            One vector per movie, shape (n_items, dim).
+        item_ids : array-like
+            Raw movie IDs, in `vectors` order.
+        metric : str
+            'ip' or 'cosine'.
+        n_lists : int, optional
+            Number of clusters; defaults to 4 * sqrt(n_items).
+        nprobe : int
+            Default clusters searched per query.
+        n_iter : int
+            k-means iterations.
+        seed : int
+            Seed of the clustering.
+
+        Returns
+        -------
+        IVFIndex
+            The index.
+
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if metric == 'cosine':
+            vectors = _normalize(vectors)
+        n_lists = n_lists or int(4 * np.sqrt(len(vectors)))
+        n_lists = max(1, min(n_lists, len(vectors)))
+        centroids = kmeans(vectors, n_lists, n_iter=n_iter, seed=seed)
+        assign = _nearest(vectors, centroids)
+        order = np.argsort(assign, kind='stable')
+        offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+        return cls(centroids.astype(np.float32), offsets,
+                   np.asarray(item_ids)[order], vectors[order], metric, nprobe)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with `save`."""
+        with np.load(path) as data:
+            version = str(data['version']) if 'version' in data.files else ''
+            return cls(data['centroids'], data['offsets'], data['item_ids'],
+                       data['vectors'], str(data['metric']),
+                       int(data['nprobe']), version or None)
+
+    def save(self, path):
+        """Save the index as a `.npz` file."""
+        np.savez(path, centroids=self.centroids, offsets=self.offsets,
+                 item_ids=self.item_ids, vectors=self.vectors,
+                 metric=self.metric, nprobe=self.nprobe,
+                 version=self.version or '')
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def _query(self, query):
+        query = np.asarray(query, dtype=np.float32)
+        return _normalize(query) if self.metric == 'cosine' else query
+
+    def _top(self, positions, scores, k, exclude):
+        if exclude is not None and len(exclude):
+            scores[np.isin(self.item_ids[positions], exclude)] = -np.inf
+        best = top_k(scores, k)
+        best = best[np.isfinite(scores[best])]
+        return self.item_ids[positions[best]].tolist(), scores[best]
+
+    def search(self, query, k=10, nprobe=None, exclude=None):
+        """Approximate top-k movies for a query vector.
+
+        Parameters
+        ----------
+        query : np.ndarray
+            Query vector, shape (dim,).
+        k : int
+            Number of movies to return.
+        nprobe : int, optional
+            Clusters to search; defaults to `FLICK_ANN_NPROBE`, then to the
+            index's own `nprobe`. More is slower and more accurate.
+        exclude : list, optional
+            Raw movie IDs never to return.
+
+        Returns
+        -------
+        tuple (list, np.ndarray)
+            Movie IDs, best first, and their similarity to the query.
+
+        """
+        query = self._query(query)
+        nprobe = min(nprobe or NPROBE or self.nprobe, len(self.centroids))
+        lists = top_k(self.centroids @ query, nprobe)
+        positions = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1])
+                                    for l in lists])
+        return self._top(positions, self.vectors[positions] @ query, k, exclude)
+
+    def exact_search(self, query, k=10, exclude=None):
+        """Exact top-k movies for a query vector, by scanning every movie."""
+        query = self._query(query)
+        positions = np.arange(len(self.vectors))
+        return self._top(positions, self.vectors @ query, k, exclude)
+
+
+def recall_at_k(index, queries, k=10, nprobe=None):
+    """Share of the exact top-k that the approximate search finds.
+
+    A movie tied with the k-th exact result counts as found, since either
+    could be returned.
+
+    Parameters
+    ----------
+    index : IVFIndex
+        The index to check.
+    queries : np.ndarray
+        Query vectors, shape (n_queries, dim).
+    k : int
+        Number of neighbours compared.
+    nprobe : int, optional
+        Clusters searched, as for `IVFIndex.search`.
+
+    Returns
+    -------
+    float
+        Mean recall@k over the queries.
+
+    """
+    found = total = 0
+    for query in queries:
+        _, exact = index.exact_search(query, k)
+        _, approx = index.search(query, k, nprobe=nprobe)
+        if len(exact):
+            found += int((approx >= exact[-1] - 1e-6).sum())
+            total += len(exact)
+    return found / total if total else 1.0
+
+
+def tune_nprobe(index, queries, target_recall=0.95, k=10):
+    """Smallest power-of-two `nprobe` reaching `target_recall`.
+
+    The result is stored as the index's default `nprobe`.
+
+    Returns
+    -------
+    dict
+        recall@k measured for each `nprobe` tried.
+
+    """
+    recalls = {}
+    nprobe = 1
+    while True:
+        nprobe = min(nprobe, len(index.centroids))
+        recalls[nprobe] = recall_at_k(index, queries, k, nprobe)
+        if recalls[nprobe] >= target_recall or nprobe == len(index.centroids):
+            break
+        nprobe *= 2
+    index.nprobe = nprobe
+    return recalls
+
+
+def factor_vectors(factors):
+    """Item vectors whose inner product with `factor_query` is the estimate.
+
+    For a biased model the item bias is appended as one more dimension;
+    the user's constant terms do not change the ranking.
+    """
+    qi = np.asarray(factors.qi, dtype=np.float32)
+    if not factors.biased:
+        return qi
+    return np.hstack([qi, np.asarray(factors.bi, dtype=np.float32)[:, None]])
+
+
+def factor_query(factors, user_vector):
+    """Query vector of a user for an index built on `factor_vectors`."""
+    user_vector = np.asarray(user_vector, dtype=np.float32)
+    if not factors.biased:
+        return user_vector
+    return np.append(user_vector, np.float32(1))
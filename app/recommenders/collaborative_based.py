@@ -28,30 +28,42 @@
 """
 
 # Script dependencies
+import os
 import pandas as pd
 import numpy as np
 import pickle
 import copy
 
-from surprise import Reader, Dataset
 from surprise import SVD, NormalPredictor, BaselineOnly, KNNBasic, NMF
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
 
-# Importing data
-movies = pd.read_csv('./resources/data/movies.csv' ,sep = ',')
-ratings_data = pd.read_csv('./resources/data/ratings.csv')
-
-#Drop Timestamp from rating_data
-ratings_data.drop(['timestamp'], axis=1, inplace=True)
-
-#Merge dataframes rating_df and movies
-ratings = ratings_data.merge(movies[['movieId', 'title']], on='movieId')
-
-# We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
-model=pickle.load(open('./resources/models/SVD.pkl', 'rb'))
-
-def prediction_item(item_id):
+from recommenders.ann import factor_query
+from utils import registry
+from utils.instrumentation import count, stage, timed
+from utils.result_cache import cached
+
+# Data and models are loaded lazily, once per process, by utils.registry:
+#  - 'latent_factors': factors of the SVD model in resources/models/SVD.pkl,
+#    trained on a subset of the MovieLens 10k dataset.
+#  - 'item_neighbours': item-item neighbour lists built offline by
+#    resources/models/build_item_index.py. When present they replace the
+#    per-request pivot and correlation in `collab_model`.
+#  - 'factor_ann': optional approximate nearest-neighbour index over the
+#    item factors, built by resources/models/build_ann_index.py. When
+#    present, fold-in searches it instead of scanning every movie.
+#  - 'movie_index' and 'rating_store': the shared movie and rating lookups.
+
+# How `collab_model` finds recommendations:
+#  - 'neighbours': sum the stored neighbours of the chosen movies.
+#  - 'fold_in': fold the chosen movies into a user vector against the
+#    trained item factors and score the whole catalogue with one matmul.
+#  - 'baseline': the original pivot and Pearson correlation.
+#  - 'auto': the first of the above that can answer the request.
+COLLAB_MODE = os.environ.get('FLICK_COLLAB_MODE', 'auto')
+# Regularization of the fold-in user vector, per chosen movie.
+FOLD_IN_REG = 0.1
+
+@timed('collab.prediction_item')
+def prediction_item(item_id, k=10):
     """Map a given favourite movie to users within the
        MovieLens dataset with the same preference.
 
@@ -59,23 +71,19 @@ def prediction_item(item_id):
     ----------
     item_id : int
         A MovieLens Movie ID.
+    k : int
+        Number of users to return.
 
     Returns
     -------
     list
-        User IDs of users with similar high ratings for the given movie.
+        User IDs of the `k` users with the highest predicted rating for
+        the given movie, best first.
 
     """
-    # Data preprosessing
-    reader = Reader(rating_scale=(0, 5))
-    load_df = Dataset.load_from_df(ratings_data,reader)
-    a_train = load_df.build_full_trainset()
-
-    predictions = []
-    for ui in a_train.all_users():
-        predictions.append(model.predict(iid=item_id,uid=ui, verbose = False))
-    return predictions
+    return registry.get('latent_factors').top_users(item_id, k)
 
+@timed('collab.pred_movies')
 def pred_movies(movie_list):
     """Maps the given favourite movies selected within the app to corresponding
     users within the MovieLens dataset.
@@ -91,37 +99,74 @@ def pred_movies(movie_list):
         User-ID's of users with similar high ratings for each movie.
 
     """
+    movie_index = registry.get('movie_index')
     # Store the id of users
     id_store=[]
     # For each movie selected by a user of the app,
     # predict a corresponding user within the dataset with the highest rating
     for i in movie_list:
-        movieid = movies[movies['title'] == i]['movieId'].values[0]
-        predictions = prediction_item(item_id = movieid)
-        predictions.sort(key=lambda x: x.est, reverse=True)
+        movieid = movie_index.movie_id(i)
         # Take the top 10 user id's from each movie with highest rankings
-        for pred in predictions[:10]:
-            id_store.append(pred.uid)
+        id_store.extend(prediction_item(item_id=movieid, k=10))
     # Return a list of user id's
     return id_store
 
 
-def get_user_movies(data, user_list):
+@timed('collab.get_user_movies')
+def get_user_movies(store, user_list):
     """
     Func returns list of movies
-    :param data , user_list:
-    :return: dataframe subset of train data
+    :param store , user_list:
+    :return: dataframe subset of train data, with movie titles
     """
-    temp = pd.DataFrame()
-    for i in user_list:
-        temp_df = data[data['userId'] == i]
-        temp = temp.append(temp_df)
+    movie_index = registry.get('movie_index')
+    temp = store.users_frame(user_list)
+    rows = movie_index.rows(temp['movieId'].values)
+    temp = temp[rows >= 0]
+    temp['title'] = movie_index.title_by_row[rows[rows >= 0]]
     return temp
 
+@timed('collab.fold_in')
+def fold_in_movies(movie_ids, top_n=10, user_rating=5.0):
+    """Movies with the highest estimate for an anonymous app user.
+
+    Parameters
+    ----------
+    movie_ids : list (int)
+        MovieLens Movie IDs of the favourite movies.
+    top_n : int
+        Number of movies to return.
+    user_rating : float
+        Rating assumed for each favourite movie.
+
+    Returns
+    -------
+    list (int)
+        Movie IDs, best first; empty if the model knows none of the
+        favourites.
+
+    """
+    factors = registry.get('latent_factors')
+    if (factors.item_positions(movie_ids) < 0).all():
+        return []
+    user_vector, user_bias = factors.fold_in(movie_ids, user_rating,
+                                             reg=FOLD_IN_REG)
+    factor_ann = registry.get('factor_ann')
+    if factor_ann is not None:
+        recommended_ids, _ = factor_ann.search(
+            factor_query(factors, user_vector), k=top_n, exclude=movie_ids)
+    else:
+        recommended_ids, _ = factors.recommend(user_vector, k=top_n,
+                                               user_bias=user_bias,
+                                               exclude=movie_ids)
+    return recommended_ids
+
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.
 
 
+@timed('collab_model')
+@cached('collab')
 def collab_model(movie_list,top_n=10):
     """Performs Collaborative filtering based upon a list of movies supplied
        by the app user.
@@ -140,33 +185,43 @@ def collab_model(movie_list,top_n=10):
 
     """
 
+    movie_index = registry.get('movie_index')
+    movie_ids = movie_index.movie_ids(movie_list).tolist()
 
-    user_ids = pred_movies(movie_list)
+    if COLLAB_MODE in ('auto', 'neighbours'):
+        item_neighbours = registry.get('item_neighbours')
+        if item_neighbours is not None:
+            with stage('collab.neighbours'):
+                recommended_ids = item_neighbours.recommend(movie_ids, top_n=top_n)
+            # Movies nobody has rated have no neighbours; fall through for them.
+            if recommended_ids:
+                count('collab_answers', method='neighbours')
+                return movie_index.titles(recommended_ids)
 
-    temp = get_user_movies(ratings, user_ids)
+    if COLLAB_MODE in ('auto', 'fold_in'):
+        recommended_ids = fold_in_movies(movie_ids, top_n=top_n)
+        if recommended_ids:
+            count('collab_answers', method='fold_in')
+            return movie_index.titles(recommended_ids)
 
-    movie_ids = []
+    count('collab_answers', method='baseline')
 
-    for i in movie_list:
-        #Get movieId from tittle
-        movieID = movies[movies['title']==i]['movieId'].values[0]
-        movie_ids.append(movieID)
+    user_ids = pred_movies(movie_list)
+
+    temp = get_user_movies(registry.get('rating_store'), user_ids)
 
     # Add new user with ratings to userlist
-    new_user_row1 = {'userId': 1000000, 'movieId': movie_ids[0], 
-            'rating': 5.0, 'title': movie_list[0]}
-    new_user_row2 = {'userId': 1000000, 'movieId': movie_ids[1], 
-            'rating': 5.0, 'title': movie_list[1]}
-    new_user_row3 = {'userId': 1000000, 'movieId': movie_ids[2], 
-            'rating': 5.0, 'title': movie_list[2]}
-    temp = temp.append([new_user_row1, new_user_row2, new_user_row3], 
-            ignore_index=True)
+    new_user = pd.DataFrame({'userId': 1000000, 'movieId': movie_ids,
+            'rating': 5.0, 'title': list(movie_list)})
+    temp = pd.concat([temp, new_user], ignore_index=True)
 
     # create pivot table
-    user_ratings = temp.pivot_table(index='userId', columns='title', 
-            values='rating').fillna(0)
+    with stage('collab.pivot_table'):
+        user_ratings = temp.pivot_table(index='userId', columns='title', 
+                values='rating').fillna(0)
     # compute correlations from pivot table
-    item_similarity_df = user_ratings.corr(method='pearson')
+    with stage('collab.corr'):
+        item_similarity_df = user_ratings.corr(method='pearson')
 
     def get_similar_movies(movie_name, user_rating=5):
         """
@@ -180,19 +235,84 @@ def collab_model(movie_list,top_n=10):
         similar_score = similar_score.sort_values(ascending=False)
         return similar_score
 
-    similar_movies = pd.DataFrame()
-
-    # get similar movies of fav movies
-    for movie in movie_list:
-        similar_movies = similar_movies.append(get_similar_movies(movie, 5), 
-                ignore_index=True)
+    with stage('collab.rank'):
+        # get similar movies of fav movies, one row per favourite
+        similar_movies = pd.DataFrame([get_similar_movies(movie, 5)
+                                       for movie in movie_list])
 
-    recommended_movies = []
-    # sum similarities together append highest values
-    for i in similar_movies.sum().sort_values(ascending=False).index:
-        if i in movie_list:
-            pass
-        else:
-            recommended_movies.append(i)
+        recommended_movies = []
+        # sum similarities together append highest values
+        for i in similar_movies.sum().sort_values(ascending=False).index:
+            if i in movie_list:
+                pass
+            else:
+                recommended_movies.append(i)
 
     return recommended_movies[:10]
+
+@timed('batch_collab_model')
+def batch_collab_model(movie_lists, top_n=10):
+    """`collab_model` for many app users at once.
+
+    Users are answered by the same methods, in the same order, as in
+    `collab_model`, but each method handles the whole batch together:
+    neighbour sums come from one sparse matrix product, and fold-in
+    vectors from one batched solve scored block by block. Only users
+    that neither can answer go through `collab_model` one by one.
+
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favourite movies of each app user.
+    top_n : int
+        Number of top recommendations to return to each user.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n movie recommendations, per user.
+
+    """
+    movie_index = registry.get('movie_index')
+    id_lists = [movie_index.movie_ids(movies).tolist() for movies in movie_lists]
+    recommended = [None] * len(id_lists)
+    pending = list(range(len(id_lists)))
+
+    def answer(users, id_results):
+        for user, ids in zip(users, id_results):
+            if ids:
+                recommended[user] = movie_index.titles(ids)
+        return [user for user in pending if recommended[user] is None]
+
+    item_neighbours = registry.get('item_neighbours')
+    if COLLAB_MODE in ('auto', 'neighbours') and item_neighbours is not None:
+        with stage('collab.batch.neighbours'):
+            pending = answer(pending, item_neighbours.recommend_many(
+                [id_lists[user] for user in pending], top_n=top_n))
+        count('collab_answers', len(id_lists) - len(pending),
+              method='neighbours')
+
+    if COLLAB_MODE in ('auto', 'fold_in') and pending:
+        answered = len(pending)
+        with stage('collab.batch.fold_in'):
+            factors = registry.get('latent_factors')
+            users = [user for user in pending
+                     if (factors.item_positions(id_lists[user]) >= 0).any()]
+            favourites = [id_lists[user] for user in users]
+            user_vectors, user_biases = factors.fold_in_many(favourites, 5.0,
+                                                             reg=FOLD_IN_REG)
+            factor_ann = registry.get('factor_ann')
+            if factor_ann is not None:
+                results = [factor_ann.search(factor_query(factors, vector),
+                                             k=top_n, exclude=ids)[0]
+                           for vector, ids in zip(user_vectors, favourites)]
+            else:
+                results = factors.recommend_many(user_vectors, k=top_n,
+                                                 user_biases=user_biases,
+                                                 exclude=favourites)
+            pending = answer(users, results)
+        count('collab_answers', answered - len(pending), method='fold_in')
+
+    for user in pending:
+        recommended[user] = collab_model(movie_lists[user], top_n)
+    return recommended
@@ -29,35 +29,95 @@
 
 # Script dependencies
 import os
-import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
 
-# Importing data
-movies = pd.read_csv('./resources/data/movies.csv', sep = ',')
-ratings = pd.read_csv('./resources/data/ratings.csv')
-movies.dropna(inplace=True)
+from recommenders.factors import top_k
+from utils import registry
+from utils.instrumentation import stage, timed
+from utils.result_cache import cached
+
+# Data is loaded lazily, once per process, by utils.registry: the shared
+# 'movie_index', 'rating_aggregates' (per-movie rating counts and sums,
+# persisted in resources/models/), and the optional 'tfidf_index' built
+# by resources/models/build_tfidf_index.py.
+
+# How `content_model` finds recommendations:
+#  - 'tfidf': TF-IDF similarity of genres, tags, cast, director and plot
+#    keywords (see recommenders/tfidf.py).
+#  - 'genres': shared genres, then Bayesian-weighted rating.
+#  - 'auto': the first of the above that can answer the request.
+CONTENT_MODE = os.environ.get('FLICK_CONTENT_MODE', 'auto')
+
+def encode_genres(genres):
+    """Encode pipe-separated genre strings as one bitmask per movie.
 
-def data_preprocessing(df):
-    """Prepare data for use within Content filtering algorithm.
     Parameters
     ----------
-    subset_size : int
-        Number of movies to use within the algorithm.
+    genres : Pandas Series
+        Genre strings such as 'Adventure|Children|Fantasy'.
+
     Returns
     -------
-    Pandas Dataframe
-        Subset of movies selected for content-based filtering.
+    tuple (list, np.ndarray)
+        Genre names, and a uint32 mask per movie whose bit `j` is set
+        when the movie has genre `j`.
     """
-    movies = df.copy()
-    # Split genre data into individual words.
-    movies['keyWords'] = movies['genres'].str.replace('|', ' ')
-    movies['genres'] = movies['genres'].apply(str).apply(lambda x: x.split('|'))
-    return movies
+    dummies = genres.astype(object).fillna('').str.get_dummies('|')
+    if dummies.shape[1] > 32:
+        raise ValueError(f"{dummies.shape[1]} genres do not fit in 32 bits")
+    bits = np.left_shift(np.uint32(1), np.arange(dummies.shape[1], dtype=np.uint32))
+    masks = dummies.to_numpy(dtype=np.uint32) @ bits
+    return dummies.columns.tolist(), masks.astype(np.uint32)
+
+def popcount(masks):
+    """Number of set bits in each element of a uint32 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(masks)
+    counts = np.zeros(masks.shape, dtype=np.uint8)
+    for shift in range(0, 32, 8):
+        counts += _BYTE_POPCOUNT[(masks >> shift) & 0xFF]
+    return counts
+
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# Genres are encoded once per process, aligned with the rows of `movie_index`.
+registry.register('genre_index', lambda: encode_genres(
+    registry.get('movie_index').movies['genres']))
+# Movies need at least this many ratings to be recommended.
+MIN_RATINGS = 5
+# Rows of 'tfidf_index' that may be recommended.
+registry.register('tfidf_allowed', lambda: registry.get('rating_aggregates').count(
+    registry.get('tfidf_index').item_ids) >= max(MIN_RATINGS, 1))
+# Bayesian-weighted rating of the rows of 'tfidf_index', which orders
+# movies equally similar to the favourites.
+registry.register('tfidf_rating', lambda: registry.get(
+    'rating_aggregates').weighted_mean(registry.get('tfidf_index').item_ids))
+# `movie_index` rows of the movies the genre path may recommend. Every
+# request scans all of them: a genre bitmask test is cheaper than any
+# index, and keeps the ranking exact.
+registry.register('genre_eligible', lambda: np.flatnonzero(
+    registry.get('rating_aggregates').count(registry.get('movie_index').id_by_row)
+    >= max(MIN_RATINGS, 1)))
+
+@timed('content.rank')
+def _rank_by_overlap(eligible, overlap, score, n_genres, top_n):
+    """Rows of the top_n eligible movies by genre overlap, then by score."""
+    # Tightest overlap that still leaves more than top_n candidates.
+    at_least = np.bincount(overlap, minlength=n_genres + 1)[::-1].cumsum()[::-1]
+    enough = np.flatnonzero(at_least[1:] > top_n)
+    threshold = enough[-1] + 1 if len(enough) else 1
+    keep = overlap >= threshold
+    if not keep.any():
+        return eligible[:0]
+    score = score[keep]
+    # Shared genres rank first; the rating, scaled below 1, breaks ties.
+    best = top_k(overlap[keep] + score / (score.max() + 1), top_n)
+    return eligible[keep][best]
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@timed('content_model')
+@cached('content')
 def content_model(movie_list,top_n=10):
     """Performs Content filtering based upon a list of movies supplied
        by the app user.
@@ -66,31 +126,113 @@ def content_model(movie_list,top_n=10):
     ----------
     movie_list : list (str)
         Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
 
-    """
-    #global movies
-    # removing the favorite movie list
-    nmovies = data_preprocessing(movies)
-    genre_list = []
-    for i in movie_list:
-        genre_list.append(list(nmovies[nmovies['title']==i]['genres'])[0])
-
-
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user, ranked by
+        TF-IDF similarity of their metadata, then by Bayesian-weighted
+        average rating, when the index is available, otherwise by the
+        number of genres shared with the favourites and then by
+        Bayesian-weighted average rating.
 
-    from sklearn.preprocessing import MultiLabelBinarizer
-    mlb2 =  MultiLabelBinarizer()
-    mlb2.fit_transform(genre_list)
-    genre_list = mlb2.classes_
-    nmovies = nmovies[~nmovies['title'].isin(movie_list)]
-    mgen = nmovies
-    for gen in genre_list:
-        mgen = mgen[mgen['keyWords'].str.contains(gen)]
-        if len(mgen)<=top_n:
-            break
+    """
+    movie_index = registry.get('movie_index')
+    movie_ids = movie_index.movie_ids(movie_list)
+
+    if CONTENT_MODE in ('auto', 'tfidf'):
+        tfidf_index = registry.get('tfidf_index')
+        if tfidf_index is not None:
+            with stage('content.tfidf'):
+                recommended_ids = tfidf_index.recommend(
+                    movie_ids, top_n, allowed=registry.get('tfidf_allowed'),
+                    tie_break=registry.get('tfidf_rating'))
+            # Movies without metadata match nothing; fall through for them.
+            if recommended_ids:
+                return movie_index.titles(recommended_ids)
+
+    rating_aggregates = registry.get('rating_aggregates')
+    genre_names, genre_masks = registry.get('genre_index')
+
+    rows = movie_index.rows(movie_ids)
+    # Genres of any of the favourite movies, as one mask.
+    query = np.bitwise_or.reduce(genre_masks[rows])
+    eligible = registry.get('genre_eligible')
+    with stage('content.overlap'):
+        overlap = popcount(genre_masks[eligible] & query).astype(np.int16)
+        overlap[np.isin(eligible, rows)] = 0
+
+    with stage('content.score'):
+        score = rating_aggregates.weighted_mean(movie_index.id_by_row[eligible])
+    best = _rank_by_overlap(eligible, overlap, score, len(genre_names), top_n)
+    return movie_index.title_by_row[best].tolist()
+
+@timed('batch_content_model')
+def batch_content_model(movie_lists, top_n=10, block_bytes=16 << 20):
+    """`content_model` for many app users at once.
+
+    With the TF-IDF index, a block of users is scored with one sparse
+    product. Otherwise the eligible movies and their ratings are looked
+    up once for the whole batch, and genre overlaps are computed for a
+    block of users with one broadcast operation.
 
-        mgen2 = mgen
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favourite movies of each app user.
+    top_n : int
+        Number of top recommendations to return to each user.
+    block_bytes : int
+        Memory budget for one block of genre overlaps.
 
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n movie recommendations, per user.
 
-    asscr = ratings[ratings['movieId'].isin(mgen2['movieId'].values)][['movieId', 'rating']]
-    top_movies = (asscr.groupby(['movieId']).mean().reset_index()).sort_values('rating', ascending =False)[:top_n]
-    return list((nmovies[nmovies['movieId'].isin(top_movies['movieId'].values)]['title']).values)
+    """
+    movie_index = registry.get('movie_index')
+    recommended = [None] * len(movie_lists)
+    tfidf_index = registry.get('tfidf_index')
+    if CONTENT_MODE in ('auto', 'tfidf') and tfidf_index is not None:
+        with stage('content.batch.tfidf'):
+            results = tfidf_index.recommend_many(
+                [movie_index.movie_ids(movies) for movies in movie_lists],
+                top_n, allowed=registry.get('tfidf_allowed'),
+                tie_break=registry.get('tfidf_rating'))
+        for user, ids in enumerate(results):
+            if ids:
+                recommended[user] = movie_index.titles(ids)
+    pending = [user for user in range(len(movie_lists))
+               if recommended[user] is None]
+    if pending:
+        for user, titles in zip(pending, _batch_by_genres(
+                [movie_lists[user] for user in pending], top_n, block_bytes)):
+            recommended[user] = titles
+    return recommended
+
+def _batch_by_genres(movie_lists, top_n, block_bytes):
+    """Genre path of `batch_content_model`."""
+    movie_index = registry.get('movie_index')
+    rating_aggregates = registry.get('rating_aggregates')
+    genre_names, genre_masks = registry.get('genre_index')
+
+    rows = [movie_index.rows(movie_index.movie_ids(movies))
+            for movies in movie_lists]
+    queries = np.array([np.bitwise_or.reduce(genre_masks[r]) for r in rows],
+                       dtype=np.uint32)
+    eligible = registry.get('genre_eligible')
+    masks = genre_masks[eligible]
+    score = rating_aggregates.weighted_mean(movie_index.id_by_row[eligible])
+    block = max(1, block_bytes // (2 * max(len(eligible), 1)))
+    recommended = []
+    for start in range(0, len(queries), block):
+        overlaps = popcount(masks & queries[start:start + block, None]).astype(np.int16)
+        for favourites, overlap in zip(rows[start:start + block], overlaps):
+            overlap[np.isin(eligible, favourites)] = 0
+            best = _rank_by_overlap(eligible, overlap, score,
+                                    len(genre_names), top_n)
+            recommended.append(movie_index.title_by_row[best].tolist())
+    return recommended
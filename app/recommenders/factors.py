@@ -0,0 +1,491 @@
+"""
+
+    Latent factor scoring for collaborative filtering.
+
+    Author: Explore Data Science Academy.
+
+    Description: Holds the factor matrices and biases of a trained
+    matrix factorization model (e.g. a Surprise `SVD`) as plain NumPy
+    arrays, so that every user can be scored against an item with a
+    single matrix-vector product instead of one `predict` call per user.
+
+    Factors are exported as one `.npy` file per array plus a JSON
+    manifest. Loading them memory-maps the arrays, so several worker
+    processes share one copy through the OS page cache. Each export
+    writes new array files and switches to them by replacing the
+    manifest, so processes still mapping the previous arrays are not
+    disturbed.
+
+"""
+
+# Script dependencies
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+
+
+def top_k(scores, k):
+    """Positions of the `k` highest scores, best first.
+
+    Ties are broken by position, which mirrors a stable descending sort
+    of the full score array without paying for it.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        One-dimensional array of scores.
+    k : int
+        Number of positions to return.
+
+    Returns
+    -------
+    np.ndarray
+        Integer positions into `scores`.
+
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    candidates = np.flatnonzero(scores >= kth)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+
+class LatentFactors:
+    """User and item factors of a biased matrix factorization model.
+
+    Parameters
+    ----------
+    pu : np.ndarray
+        User factors, shape (n_users, n_factors).
+    qi : np.ndarray
+        Item factors, shape (n_items, n_factors).
+    bu : np.ndarray
+        User biases, shape (n_users,).
+    bi : np.ndarray
+        Item biases, shape (n_items,).
+    global_mean : float
+        Mean rating of the training data.
+    user_ids : array-like
+        Raw MovieLens user IDs, in factor row order.
+    item_ids : array-like
+        Raw MovieLens movie IDs, in factor row order.
+    rating_scale : tuple, optional
+        (lowest, highest) rating used to clip estimates; None for models
+        whose scores are not ratings, e.g. implicit ALS.
+    biased : bool
+        Whether the biases take part in the estimate.
+    version : str, optional
+        Version of the export the factors were loaded from; None for
+        factors that were never exported.
+
+    """
+
+    def __init__(self, pu, qi, bu, bi, global_mean, user_ids, item_ids,
+                 rating_scale=(0.5, 5.0), biased=True, version=None):
+        self.pu = pu
+        self.qi = qi
+        self.bu = bu
+        self.bi = bi
+        self.global_mean = float(global_mean)
+        self.user_ids = np.asarray(user_ids)
+        self.item_ids = np.asarray(item_ids)
+        self.rating_scale = (None if rating_scale is None else
+                             (float(rating_scale[0]), float(rating_scale[1])))
+        self.biased = bool(biased)
+        self.version = version
+        self._users = pd.Index(self.user_ids)
+        self._items = pd.Index(self.item_ids)
+        self._item_index = {iid: i for i, iid in enumerate(self.item_ids.tolist())}
+
+    @classmethod
+    def from_surprise(cls, model):
+        """Extract the factors of a fitted Surprise `SVD` model.
+
+        Parameters
+        ----------
+        model : surprise.SVD
+            Fitted model, e.g. as unpickled from `SVD.pkl`.
+
+        Returns
+        -------
+        LatentFactors
+            Factors with raw user and movie IDs attached.
+
+        """
+        trainset = model.trainset
+        user_ids = [trainset.to_raw_uid(u) for u in range(trainset.n_users)]
+        item_ids = [trainset.to_raw_iid(i) for i in range(trainset.n_items)]
+        return cls(pu=np.asarray(model.pu), qi=np.asarray(model.qi),
+                   bu=np.asarray(model.bu), bi=np.asarray(model.bi),
+                   global_mean=trainset.global_mean,
+                   user_ids=user_ids, item_ids=item_ids,
+                   rating_scale=trainset.rating_scale,
+                   biased=getattr(model, 'biased', True))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Load factors exported with `save`.
+
+        Parameters
+        ----------
+        directory : str
+            Export folder containing `manifest.json` and the arrays.
+        mmap_mode : str, optional
+            Passed to `np.load`; 'r' maps the arrays read-only instead of
+            copying them into the process, None reads them into memory.
+
+        Returns
+        -------
+        LatentFactors
+            The exported factors.
+
+        """
+        for attempt in range(3):
+            with open(os.path.join(directory, MANIFEST)) as f:
+                manifest = json.load(f)
+            if manifest.get('format_version') != FORMAT_VERSION:
+                raise ValueError(f"Unsupported factor export in {directory}: "
+                                 f"format {manifest.get('format_version')}")
+            files = manifest.get('files') or {name: f'{name}.npy' for name in
+                                              ('pu', 'qi', 'bu', 'bi')}
+            try:
+                arrays = {name: np.load(os.path.join(directory, filename),
+                                        mmap_mode=mmap_mode)
+                          for name, filename in files.items()}
+                break
+            except FileNotFoundError:
+                # Replaced by a newer export since the manifest was read.
+                if attempt == 2:
+                    raise
+        return cls(global_mean=manifest['global_mean'],
+                   user_ids=manifest['user_ids'],
+                   item_ids=manifest['item_ids'],
+                   rating_scale=manifest['rating_scale'],
+                   biased=manifest['biased'],
+                   version=str(manifest.get('version', '')) or None, **arrays)
+
+    def save(self, directory, algorithm='SVD', ratings=None):
+        """Export the factors for `load`.
+
+        The arrays are written to new files first and the manifest is
+        replaced last, so a folder with a manifest always holds a complete
+        export. Array files of earlier exports are then removed.
+
+        Parameters
+        ----------
+        directory : str
+            Export folder, created if needed.
+        algorithm : str
+            Name of the model the factors came from, for reference.
+        ratings : dict, optional
+            How far the ratings file has been folded into the factors
+            (`RatingStream.state`), kept in the manifest as 'ratings'.
+
+        """
+        os.makedirs(directory, exist_ok=True)
+        version = time.time_ns()
+        self.version = str(version)
+        files = {name: f'{name}-{version}.npy' for name in ('pu', 'qi', 'bu', 'bi')}
+        for name, filename in files.items():
+            np.save(os.path.join(directory, filename),
+                    np.ascontiguousarray(getattr(self, name)))
+        manifest = {'format_version': FORMAT_VERSION,
+                    'version': version,
+                    'files': files,
+                    'algorithm': algorithm,
+                    'n_factors': int(self.qi.shape[1]),
+                    'global_mean': self.global_mean,
+                    'rating_scale': (None if self.rating_scale is None
+                                     else list(self.rating_scale)),
+                    'biased': self.biased,
+                    'ratings': ratings,
+                    'user_ids': self.user_ids.tolist(),
+                    'item_ids': self.item_ids.tolist()}
+        tmp = os.path.join(directory, f'{MANIFEST}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(directory, MANIFEST))
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.npy') and entry.name not in files.values():
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    # Still open elsewhere on Windows; removed next time.
+                    pass
+
+    def item_position(self, item_id):
+        """Row of `item_id` in `qi`, or None if the model never saw it."""
+        return self._item_index.get(item_id)
+
+    def user_positions(self, user_ids):
+        """Rows of raw user IDs in `pu`, -1 for unknown users."""
+        return self._users.get_indexer(np.asarray(user_ids).ravel())
+
+    def item_positions(self, item_ids):
+        """Rows of raw movie IDs in `qi`, -1 for unknown movies."""
+        return self._items.get_indexer(np.asarray(item_ids).ravel())
+
+    def _clip(self, est):
+        if self.rating_scale is None:
+            return est
+        return np.clip(est, *self.rating_scale)
+
+    def score(self, user_ids, item_ids):
+        """Estimated ratings of many (user, movie) pairs at once.
+
+        Pairs with an unknown user or movie get the same fallback as
+        `surprise.SVD.estimate`: the biases that are known, or the global
+        mean for an unbiased model.
+
+        Parameters
+        ----------
+        user_ids : array-like
+            Raw user IDs.
+        item_ids : array-like
+            Raw movie IDs, paired element-wise with `user_ids`.
+
+        Returns
+        -------
+        np.ndarray
+            One estimate per pair.
+
+        """
+        u = self.user_positions(user_ids)
+        i = self.item_positions(item_ids)
+        known_u, known_i = u >= 0, i >= 0
+        both = known_u & known_i
+        if self.biased:
+            est = np.full(len(u), self.global_mean)
+            est[known_u] += self.bu[u[known_u]]
+            est[known_i] += self.bi[i[known_i]]
+        else:
+            est = np.where(both, 0.0, self.global_mean)
+        est[both] += np.einsum('ij,ij->i', self.pu[u[both]], self.qi[i[both]])
+        return self._clip(est)
+
+    def fold_in(self, item_ids, ratings, reg=0.1, bias_reg=5.0):
+        """Factors of a new user from a few of their ratings.
+
+        The item factors stay fixed: the user bias is the regularized mean
+        residual of the ratings, and the user vector the ridge regression
+        of what remains on the rated movies' factors. This is one small
+        (n_factors x n_factors) solve, with no retraining.
+
+        Parameters
+        ----------
+        item_ids : array-like
+            Raw movie IDs rated by the user; unknown movies are ignored.
+        ratings : array-like or float
+            The ratings, or one rating given to every movie.
+        reg : float
+            Regularization of the user vector.
+        bias_reg : float
+            Regularization of the user bias.
+
+        Returns
+        -------
+        tuple (np.ndarray, float)
+            The user vector and bias, ready for `recommend`. A zero vector
+            and bias if none of the movies is known.
+
+        """
+        positions = self.item_positions(item_ids)
+        ratings = np.broadcast_to(np.asarray(ratings, dtype=np.float64),
+                                  positions.shape)
+        known = positions >= 0
+        positions, ratings = positions[known], ratings[known]
+        n_factors = self.qi.shape[1]
+        if len(positions) == 0:
+            return np.zeros(n_factors, dtype=self.qi.dtype), 0.0
+
+        Q = np.asarray(self.qi[positions], dtype=np.float64)
+        residual = ratings
+        user_bias = 0.0
+        if self.biased:
+            residual = ratings - self.global_mean - self.bi[positions]
+            user_bias = residual.sum() / (bias_reg + len(residual))
+            residual = residual - user_bias
+        A = Q.T @ Q + reg * len(positions) * np.eye(n_factors)
+        user_vector = np.linalg.solve(A, Q.T @ residual)
+        return user_vector.astype(self.qi.dtype), float(user_bias)
+
+    def fold_in_many(self, item_id_lists, ratings=5.0, reg=0.1, bias_reg=5.0):
+        """`fold_in` for many new users at once, with one batched solve.
+
+        Parameters
+        ----------
+        item_id_lists : list (list)
+            Raw movie IDs rated by each user.
+        ratings : float
+            Rating given to every movie.
+        reg, bias_reg : float
+            As for `fold_in`.
+
+        Returns
+        -------
+        tuple (np.ndarray, np.ndarray)
+            User vectors, shape (n_users, n_factors), and user biases.
+
+        """
+        n_users, n_factors = len(item_id_lists), self.qi.shape[1]
+        width = max([len(ids) for ids in item_id_lists] + [1])
+        positions = np.full((n_users, width), -1, dtype=np.int64)
+        for u, ids in enumerate(item_id_lists):
+            if len(ids):
+                positions[u, :len(ids)] = self.item_positions(ids)
+        known = positions >= 0
+        counts = known.sum(axis=1)
+        Q = np.asarray(self.qi, dtype=np.float64)[positions.clip(0)] * known[..., None]
+
+        residual = np.where(known, float(ratings), 0.0)
+        user_bias = np.zeros(n_users)
+        if self.biased:
+            residual = np.where(known, residual - self.global_mean
+                                - self.bi[positions.clip(0)], 0.0)
+            user_bias = residual.sum(axis=1) / (bias_reg + counts)
+            residual = np.where(known, residual - user_bias[:, None], 0.0)
+        A = np.einsum('ulf,ulg->ufg', Q, Q)
+        # Users with no known movie solve a pure ridge problem, i.e. get 0.
+        A += reg * np.maximum(counts, 1)[:, None, None] * np.eye(n_factors)
+        b = np.einsum('ulf,ul->uf', Q, residual)
+        user_vectors = np.linalg.solve(A, b[..., None])[..., 0]
+        return user_vectors.astype(self.qi.dtype), user_bias
+
+    def recommend_many(self, user_vectors, k=10, user_biases=None,
+                       exclude=None, block_bytes=64 << 20):
+        """`recommend` for many user vectors at once.
+
+        Users are scored block by block with one matrix product each, so
+        at most about `block_bytes` of scores exist at a time.
+
+        Parameters
+        ----------
+        user_vectors : np.ndarray
+            User factors, shape (n_users, n_factors).
+        k : int
+            Number of movies to return per user.
+        user_biases : np.ndarray, optional
+            Each user's rating bias, for biased models.
+        exclude : list (list), optional
+            Raw movie IDs never to return, per user.
+        block_bytes : int
+            Memory budget for one block of scores.
+
+        Returns
+        -------
+        list (list)
+            Movie IDs per user, best first.
+
+        """
+        user_vectors = np.asarray(user_vectors, dtype=self.qi.dtype)
+        n_users, n_items = len(user_vectors), len(self.item_ids)
+        block = max(1, block_bytes // (n_items * self.qi.dtype.itemsize))
+        recommended = []
+        for start in range(0, n_users, block):
+            scores = user_vectors[start:start + block] @ self.qi.T
+            if self.biased:
+                biases = (np.zeros(len(scores)) if user_biases is None
+                          else np.asarray(user_biases)[start:start + block])
+                scores += self.bi
+                scores += (self.global_mean + biases)[:, None].astype(scores.dtype)
+            for row, user_scores in enumerate(scores):
+                excluded = exclude[start + row] if exclude is not None else None
+                if excluded is not None and len(excluded):
+                    positions = self.item_positions(excluded)
+                    user_scores[positions[positions >= 0]] = -np.inf
+                best = top_k(user_scores, k)
+                best = best[np.isfinite(user_scores[best])]
+                recommended.append(self.item_ids[best].tolist())
+        return recommended
+
+    def recommend(self, user_vector, k=10, user_bias=0.0, exclude=None):
+        """Movies with the highest estimate for a user factor vector.
+
+        The vector need not belong to a known user, e.g. it can be folded
+        in from a few ratings.
+
+        Parameters
+        ----------
+        user_vector : np.ndarray
+            User factors, shape (n_factors,).
+        k : int
+            Number of movies to return.
+        user_bias : float
+            The user's rating bias, for biased models.
+        exclude : list, optional
+            Raw movie IDs never to return, e.g. those already rated.
+
+        Returns
+        -------
+        tuple (list, np.ndarray)
+            Movie IDs, best first, and their estimates.
+
+        """
+        scores = self.qi @ np.asarray(user_vector, dtype=self.qi.dtype)
+        if self.biased:
+            scores = scores + self.bi + (self.global_mean + user_bias)
+        if exclude is not None and len(exclude):
+            excluded = self.item_positions(exclude)
+            scores[excluded[excluded >= 0]] = -np.inf
+        best = top_k(scores, k)
+        best = best[np.isfinite(scores[best])]
+        return self.item_ids[best].tolist(), self._clip(scores[best])
+
+    def score_users(self, item_id):
+        """Estimated rating of `item_id` for every known user.
+
+        Follows `surprise.SVD.estimate` followed by the clipping done in
+        `predict`, so the values match `model.predict(uid, item_id).est`.
+
+        Parameters
+        ----------
+        item_id : int
+            A MovieLens Movie ID.
+
+        Returns
+        -------
+        np.ndarray
+            One estimate per user, in `user_ids` order.
+
+        """
+        i = self.item_position(item_id)
+        if self.biased:
+            est = self.global_mean + self.bu
+            if i is not None:
+                est = est + self.bi[i] + self.pu @ self.qi[i]
+        elif i is not None:
+            est = self.pu @ self.qi[i]
+        else:
+            est = np.full(len(self.user_ids), self.global_mean)
+        return self._clip(est)
+
+    def top_users(self, item_id, k=10):
+        """Raw IDs of the `k` users with the highest estimate for an item.
+
+        Parameters
+        ----------
+        item_id : int
+            A MovieLens Movie ID.
+        k : int
+            Number of users to return.
+
+        Returns
+        -------
+        list
+            User IDs, best first.
+
+        """
+        return self.user_ids[top_k(self.score_users(item_id), k)].tolist()
+
+
+def is_export(directory):
+    """Whether `directory` holds a complete `LatentFactors.save` export."""
+    return os.path.exists(os.path.join(directory, MANIFEST))
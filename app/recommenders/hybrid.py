@@ -0,0 +1,249 @@
+"""
+
+    Hybrid content and collaborative recommender.
+
+    Author: Explore Data Science Academy.
+
+    Description: A two-stage recommender. Candidate generation narrows the
+    catalogue to a few hundred movies: the stored neighbours of the
+    favourite movies, and the best-rated movies of the genre combinations
+    closest to the favourites' genres. The re-ranker then scores only those
+    candidates, blending:
+
+      - 'svd': the fold-in SVD estimate for the app user;
+      - 'neighbours': the summed neighbour similarity to the favourites;
+      - 'rating': the Bayesian-weighted average rating;
+      - 'genre': the share of the favourites' genres the movie has.
+
+    Each signal is scaled to [0, 1] over the candidates before weighting,
+    so the weights are comparable. They are set by FLICK_HYBRID_WEIGHTS,
+    e.g. 'svd=0.5,neighbours=0.2,rating=0.2,genre=0.1'; signals left out
+    keep their default weight.
+
+    The cost of a request depends on the number of candidates, not on the
+    size of the catalogue.
+
+"""
+
+# Script dependencies
+import os
+
+import numpy as np
+
+from recommenders.collaborative_based import FOLD_IN_REG
+from recommenders.content_based import popcount
+from recommenders.factors import top_k
+from utils import registry
+from utils.instrumentation import stage, timed
+from utils.result_cache import cached
+
+DEFAULT_WEIGHTS = {'svd': 0.4, 'neighbours': 0.3, 'rating': 0.2, 'genre': 0.1}
+# Movies taken from the genre buckets per request, on top of the neighbours.
+GENRE_CANDIDATES = 300
+
+
+def parse_weights(spec):
+    """Blend weights from a 'name=weight,...' string, over the defaults."""
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, value = item.partition('=')
+        if name not in DEFAULT_WEIGHTS:
+            raise ValueError(f"Unknown hybrid signal {name!r}; expected one "
+                             f"of {list(DEFAULT_WEIGHTS)}")
+        weights[name] = float(value)
+    return weights
+
+
+WEIGHTS = parse_weights(os.environ.get('FLICK_HYBRID_WEIGHTS', ''))
+
+
+class GenreBuckets:
+    """Recommendable movies grouped by genre combination, best rated first.
+
+    Parameters
+    ----------
+    masks : np.ndarray
+        Genre bitmask of each bucket (see `content_based.encode_genres`).
+    starts : np.ndarray
+        Start of each bucket in `rows`, plus the end of the last one.
+    rows : np.ndarray
+        `movie_index` rows of the movies, bucket by bucket.
+    scores : np.ndarray
+        Weighted average rating of each movie in `rows`.
+
+    """
+
+    def __init__(self, masks, starts, rows, scores):
+        self.masks = masks
+        self.starts = starts
+        self.rows = rows
+        self.scores = scores
+
+    @classmethod
+    def build(cls, genre_masks, rows, scores):
+        """Bucket `rows` by their genre mask, sorting each bucket by score."""
+        order = np.lexsort((-scores, genre_masks[rows]))
+        rows, scores = rows[order], scores[order]
+        masks, starts = np.unique(genre_masks[rows], return_index=True)
+        return cls(masks, np.append(starts, len(rows)), rows, scores)
+
+    def candidates(self, query, n):
+        """Rows of the `n` best movies by shared genres, then by rating.
+
+        Only the buckets with the most genres in common with `query` are
+        visited, and at most `n` movies are read from each.
+        """
+        overlap = popcount(self.masks & np.uint32(query)).astype(np.int64)
+        picked, levels, total = [], [], 0
+        for level in range(int(overlap.max(initial=0)), 0, -1):
+            for bucket in np.flatnonzero(overlap == level):
+                start = self.starts[bucket]
+                stop = min(self.starts[bucket + 1], start + n)
+                picked.append(np.arange(start, stop))
+                levels.append(np.full(stop - start, level))
+                total += stop - start
+            if total >= n:
+                break
+        if not picked:
+            return self.rows[:0]
+        picked, levels = np.concatenate(picked), np.concatenate(levels)
+        score = self.scores[picked]
+        # Shared genres rank first; the rating, scaled below 1, breaks ties.
+        best = top_k(levels + score / (np.abs(score).max() + 1), n)
+        return self.rows[picked[best]]
+
+
+@registry.register('genre_buckets')
+def _load_genre_buckets():
+    movie_index = registry.get('movie_index')
+    _, genre_masks = registry.get('genre_index')
+    rows = registry.get('genre_eligible')
+    return GenreBuckets.build(genre_masks, rows, registry.get(
+        'rating_aggregates').weighted_mean(movie_index.id_by_row[rows]))
+
+
+def _scale(values):
+    """Min-max scale to [0, 1]; missing values and constants become 0."""
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values)
+    if not finite.any():
+        return np.zeros(len(values))
+    low, high = values[finite].min(), values[finite].max()
+    scaled = (values - low) / (high - low) if high > low else values * 0.0
+    return np.where(finite, scaled, 0.0)
+
+
+def candidate_rows(movie_ids, n_genre=GENRE_CANDIDATES):
+    """`movie_index` rows of the candidates for some favourite movies.
+
+    Returns
+    -------
+    tuple (np.ndarray, np.ndarray, np.ndarray)
+        Candidate rows (sorted, favourites excluded), the neighbour score
+        of each candidate (0 for genre-only candidates), and the genre
+        mask of the favourites.
+    """
+    movie_index = registry.get('movie_index')
+    _, genre_masks = registry.get('genre_index')
+    favourites = movie_index.rows(movie_ids)
+    favourites = favourites[favourites >= 0]
+    query = np.bitwise_or.reduce(genre_masks[favourites], initial=np.uint32(0))
+
+    item_neighbours = registry.get('item_neighbours')
+    if item_neighbours is not None:
+        neighbour_ids, neighbour_scores = item_neighbours.scores(movie_ids)
+    else:
+        neighbour_ids, neighbour_scores = np.empty(0, np.int64), np.empty(0)
+    neighbour_rows = movie_index.rows(neighbour_ids)
+    genre_rows = registry.get('genre_buckets').candidates(query, n_genre)
+
+    rows = np.union1d(neighbour_rows[neighbour_rows >= 0], genre_rows)
+    rows = rows[~np.isin(rows, favourites)]
+    similarity = np.zeros(len(rows))
+    found = np.isin(neighbour_rows, rows)
+    similarity[np.searchsorted(rows, neighbour_rows[found])] = \
+        neighbour_scores[found]
+    return rows, similarity, query
+
+
+def rank(movie_ids, top_n=10, weights=None, n_genre=GENRE_CANDIDATES):
+    """Movie IDs of the best hybrid recommendations for some favourites.
+
+    Parameters
+    ----------
+    movie_ids : list (int)
+        MovieLens Movie IDs of the favourite movies.
+    top_n : int
+        Number of movies to return.
+    weights : dict, optional
+        Weight of each signal; `WEIGHTS` by default.
+    n_genre : int
+        Candidates taken from the genre buckets.
+
+    Returns
+    -------
+    list (int)
+        Movie IDs, best first.
+
+    """
+    weights = WEIGHTS if weights is None else {**DEFAULT_WEIGHTS, **weights}
+    movie_index = registry.get('movie_index')
+    _, genre_masks = registry.get('genre_index')
+
+    with stage('hybrid.candidates'):
+        rows, similarity, query = candidate_rows(movie_ids, n_genre)
+    if len(rows) == 0:
+        return []
+
+    with stage('hybrid.rerank'):
+        candidate_ids = movie_index.id_by_row[rows]
+        factors = registry.get('latent_factors')
+        user_vector, _ = factors.fold_in(movie_ids, 5.0, reg=FOLD_IN_REG)
+        positions = factors.item_positions(candidate_ids)
+        known = positions >= 0
+        estimate = np.full(len(rows), np.nan)
+        estimate[known] = np.asarray(factors.qi[positions[known]]) @ user_vector
+        if factors.biased:
+            estimate[known] += factors.bi[positions[known]]
+
+        signals = {
+            'svd': estimate,
+            'neighbours': similarity,
+            'rating': registry.get('rating_aggregates').weighted_mean(candidate_ids),
+            'genre': popcount(genre_masks[rows] & query)
+                     / max(int(popcount(np.array([query]))[0]), 1),
+        }
+        blended = sum(weights[name] * _scale(values)
+                      for name, values in signals.items())
+        best = top_k(blended, top_n)
+    return candidate_ids[best].tolist()
+
+
+@timed('hybrid_model')
+@cached('hybrid')
+def hybrid_model(movie_list, top_n=10):
+    """Performs hybrid filtering based upon a list of movies supplied
+       by the app user.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    movie_index = registry.get('movie_index')
+    movie_ids = movie_index.movie_ids(movie_list).tolist()
+    return movie_index.titles(rank(movie_ids, top_n))
+
+
+def batch_hybrid_model(movie_lists, top_n=10):
+    """`hybrid_model` for many app users; each request is already bounded
+    by its candidate count, so users are ranked one by one."""
+    return [hybrid_model(movies, top_n) for movies in movie_lists]
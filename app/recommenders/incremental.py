@@ -0,0 +1,199 @@
+"""
+
+    Incremental model updates.
+
+    Author: Explore Data Science Academy.
+
+    Description: Folds ratings appended to `ratings.csv` into the trained
+    models without retraining them. `RatingStream` hands out the lines
+    appended since the last read, and `sgd_update` runs a few epochs of
+    the SVD gradient steps over the new ratings only, so just the biases
+    and factors of the users and movies they involve move.
+
+    The result drifts from what a full retrain would give as updates pile
+    up; retrain from scratch now and then (train_colbased.py).
+
+"""
+
+# Script dependencies
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from recommenders.factors import LatentFactors
+from utils.files import prefix_digest, read_complete_lines
+from utils.rating_aggregates import RATING_COLUMNS
+
+
+class RatingStream:
+    """Batches of ratings appended to a MovieLens ratings file.
+
+    Parameters
+    ----------
+    path : str
+        The ratings file; only ever appended to.
+    offset : int
+        Bytes of `path` already read. 0 reads the whole file, skipping
+        the header.
+    digest : str, optional
+        `files.prefix_digest` of `path` at `offset`, as saved in `state`.
+        If the bytes before `offset` no longer match it, the file was
+        rewritten and reading fails rather than skip or repeat ratings.
+
+    """
+
+    def __init__(self, path, offset=0, digest=None):
+        self.path = os.path.abspath(path)
+        self.offset = int(offset)
+        self.digest = digest
+
+    @classmethod
+    def from_end(cls, path):
+        """A stream of the ratings appended from now on."""
+        offset = os.path.getsize(path)
+        return cls(path, offset, prefix_digest(path, offset))
+
+    @property
+    def state(self):
+        """What to save to resume the stream later with `RatingStream(**state)`."""
+        return {'path': self.path, 'offset': self.offset, 'digest': self.digest}
+
+    def read(self, end=None):
+        """The complete lines appended since the last read.
+
+        Parameters
+        ----------
+        end : int, optional
+            Byte to stop at, to read the same lines as an earlier stream;
+            the end of the file by default.
+
+        Returns
+        -------
+        Pandas Dataframe
+            Columns 'userId', 'movieId' and 'rating'; empty if nothing
+            was appended.
+
+        Raises
+        ------
+        ValueError
+            If the file shrank or the bytes already read changed.
+
+        """
+        if (os.path.getsize(self.path) < self.offset or self.digest is not None
+                and prefix_digest(self.path, self.offset) != self.digest):
+            raise ValueError(f"{self.path} was rewritten after byte "
+                             f"{self.offset}; rebuild the models from it.")
+        chunk, offset = read_complete_lines(self.path, self.offset, end)
+        header = self.offset == 0
+        self.offset, self.digest = offset, prefix_digest(self.path, offset)
+        if not chunk.strip():
+            return pd.DataFrame({'userId': np.empty(0, np.int64),
+                                 'movieId': np.empty(0, np.int64),
+                                 'rating': np.empty(0, np.float64)})
+        return pd.read_csv(io.BytesIO(chunk),
+                           header=0 if header else None,
+                           names=None if header else RATING_COLUMNS,
+                           usecols=['userId', 'movieId', 'rating'],
+                           dtype={'userId': np.int64, 'movieId': np.int64,
+                                  'rating': np.float64})
+
+
+def _grow(ids, new_ids, arrays, init_std, rng):
+    """Append rows for IDs not yet in `ids`: random factors, zero biases."""
+    new_ids = pd.unique(np.asarray(new_ids))
+    new_ids = new_ids[~np.isin(new_ids, ids)]
+    if len(new_ids) == 0:
+        return ids, [np.array(a) for a in arrays]
+    grown = []
+    for array in arrays:
+        shape = (len(new_ids),) + array.shape[1:]
+        rows = (rng.normal(0.0, init_std, shape) if array.ndim > 1
+                else np.zeros(shape))
+        grown.append(np.concatenate([array, rows.astype(array.dtype)]))
+    return np.concatenate([ids, new_ids]), grown
+
+
+def sgd_update(factors, user_ids, item_ids, ratings, n_epochs=5, lr=0.005,
+               reg=0.02, batch_size=1024, init_std=0.05, seed=0):
+    """Fit a trained model to new ratings with the SVD gradient steps.
+
+    Each epoch visits the new ratings in a random order, in mini-batches;
+    every batch moves the biases and factors of its users and movies
+    against the error of their current estimate, as `surprise.SVD` does
+    per rating. Users and movies seen for the first time are added with
+    small random factors. The other rows are left untouched.
+
+    Parameters
+    ----------
+    factors : LatentFactors
+        The model to update; not modified.
+    user_ids : array-like
+        User ID of each new rating.
+    item_ids : array-like
+        Movie ID of each new rating.
+    ratings : array-like
+        The new rating values.
+    n_epochs : int
+        Passes over the new ratings.
+    lr : float
+        Learning rate, as `SVD(lr_all=...)`.
+    reg : float
+        Regularization, as `SVD(reg_all=...)`.
+    batch_size : int
+        Ratings per gradient step. Steps of one user or movie within a
+        batch are averaged, so a movie rated many times in a burst moves
+        by one step rather than by one per rating.
+    init_std : float
+        Standard deviation of the factors of new users and movies, as
+        `SVD(init_std_dev=...)`.
+    seed : int
+        Seed of the shuffling and of the new factors.
+
+    Returns
+    -------
+    LatentFactors
+        The updated model, held in memory.
+
+    Raises
+    ------
+    ValueError
+        If the model's scores are not ratings (e.g. implicit ALS).
+
+    """
+    if factors.rating_scale is None:
+        raise ValueError("Only rating models can be updated with new ratings.")
+    rng = np.random.default_rng(seed)
+    user_ids, item_ids = np.asarray(user_ids), np.asarray(item_ids)
+    ratings = np.asarray(ratings, dtype=np.float64)
+    all_users, (pu, bu) = _grow(factors.user_ids, user_ids,
+                                [factors.pu, factors.bu], init_std, rng)
+    all_items, (qi, bi) = _grow(factors.item_ids, item_ids,
+                                [factors.qi, factors.bi], init_std, rng)
+    u = pd.Index(all_users).get_indexer(user_ids)
+    i = pd.Index(all_items).get_indexer(item_ids)
+    mean = factors.global_mean
+
+    for _ in range(n_epochs):
+        order = rng.permutation(len(ratings))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            users, items = u[batch], i[batch]
+            p, q = pu[users], qi[items]
+            est = np.einsum('ij,ij->i', p, q)
+            if factors.biased:
+                est += mean + bu[users] + bi[items]
+            err = (ratings[batch] - est)[:, None]
+            # Step sizes that average the steps of repeated rows.
+            lr_u = (lr / np.bincount(users)[users])[:, None]
+            lr_i = (lr / np.bincount(items)[items])[:, None]
+            if factors.biased:
+                np.add.at(bu, users, lr_u[:, 0] * (err[:, 0] - reg * bu[users]))
+                np.add.at(bi, items, lr_i[:, 0] * (err[:, 0] - reg * bi[items]))
+            np.add.at(pu, users, lr_u * (err * q - reg * p))
+            np.add.at(qi, items, lr_i * (err * p - reg * q))
+
+    return LatentFactors(pu, qi, bu, bi, mean, all_users, all_items,
+                         rating_scale=factors.rating_scale,
+                         biased=factors.biased)
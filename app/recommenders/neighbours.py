@@ -0,0 +1,329 @@
+"""
+
+    Precomputed item-item neighbour index.
+
+    Author: Explore Data Science Academy.
+
+    Description: Builds a sparse, top-K pruned item-item similarity index
+    from MovieLens ratings offline, and answers "movies similar to these"
+    queries by summing the stored neighbour lists of the chosen movies.
+    Query cost depends on K rather than on the size of the catalogue.
+
+"""
+
+# Script dependencies
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+from recommenders.factors import top_k
+
+
+def _item_matrix(user_ids, item_ids, ratings, similarity):
+    """Sorted item IDs, and the user-by-item ratings matrix with every
+    column centred (for 'pearson') and scaled to unit length, as CSC and
+    as its CSR transpose."""
+    if similarity not in ('pearson', 'cosine'):
+        raise ValueError(f"Unknown similarity: {similarity!r}")
+    users, u_idx = np.unique(np.asarray(user_ids), return_inverse=True)
+    items, i_idx = np.unique(np.asarray(item_ids), return_inverse=True)
+    values = np.asarray(ratings, dtype=np.float64)
+    n_items = len(items)
+    if similarity == 'pearson':
+        sums = np.bincount(i_idx, weights=values, minlength=n_items)
+        counts = np.bincount(i_idx, minlength=n_items)
+        values = values - (sums / counts)[i_idx]
+
+    X = sparse.csc_matrix((values, (u_idx, i_idx)),
+                          shape=(len(users), n_items))
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    X = (X @ sparse.diags(1.0 / norms)).tocsc()
+    return items, X, X.T.tocsr()
+
+
+def _top_neighbours(block, k):
+    """Columns and values of the `k` largest entries of each row, best first."""
+    top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    sims = np.take_along_axis(block, top, axis=1)
+    order = np.argsort(-sims, axis=1, kind='stable')
+    return (np.take_along_axis(top, order, axis=1),
+            np.take_along_axis(sims, order, axis=1))
+
+
+def build_item_neighbours(user_ids, item_ids, ratings, k=50,
+                          similarity='pearson', block_size=1024):
+    """Compute the `k` most similar items of every rated item.
+
+    Parameters
+    ----------
+    user_ids : array-like
+        User ID of each rating.
+    item_ids : array-like
+        Movie ID of each rating.
+    ratings : array-like
+        Rating values.
+    k : int
+        Number of neighbours kept per item.
+    similarity : str
+        'pearson' centres each item on its mean rating before taking the
+        cosine, 'cosine' uses the raw ratings.
+    block_size : int
+        Number of items whose similarity rows are materialised at once.
+
+    Returns
+    -------
+    dict
+        Arrays `item_ids`, `neighbours` (row positions into `item_ids`)
+        and `similarities`, ready for `save_item_neighbours`.
+
+    """
+    items, X, Xt = _item_matrix(user_ids, item_ids, ratings, similarity)
+    n_items = len(items)
+    k = max(0, min(k, n_items - 1))
+    neighbours = np.zeros((n_items, k), dtype=np.int32)
+    similarities = np.zeros((n_items, k), dtype=np.float32)
+    for start in range(0, n_items, block_size):
+        stop = min(start + block_size, n_items)
+        block = (Xt[start:stop] @ X).toarray()
+        # An item is not its own neighbour.
+        block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        if k == 0:
+            continue
+        neighbours[start:stop], similarities[start:stop] = \
+            _top_neighbours(block, k)
+    return {'item_ids': items, 'neighbours': neighbours,
+            'similarities': similarities}
+
+
+def update_item_neighbours(index, user_ids, item_ids, ratings, touched,
+                           similarity='pearson', block_bytes=256 << 20):
+    """Refresh a neighbour index after new ratings of some movies.
+
+    Only the similarities involving a touched movie change. The lists of
+    the touched movies are recomputed in full; in every other list the
+    similarities to touched movies are replaced, so they may enter or
+    leave it. A movie that a touched one had pushed out of a list is not
+    brought back until the next full build.
+
+    Parameters
+    ----------
+    index : dict or ItemNeighbours
+        Index from `build_item_neighbours`, or a loaded one.
+    user_ids, item_ids, ratings : array-like
+        All ratings, the new ones included.
+    touched : array-like
+        Movie IDs with new ratings.
+    similarity : str
+        As passed to `build_item_neighbours`.
+    block_bytes : int
+        Memory budget for one block of similarity rows.
+
+    Returns
+    -------
+    dict
+        The refreshed index, ready for `save_item_neighbours`, with a
+        list for every movie rated for the first time.
+
+    """
+    if isinstance(index, ItemNeighbours):
+        index = {'item_ids': index.item_ids, 'neighbours': index.neighbours,
+                 'similarities': index.similarities}
+    items, X, Xt = _item_matrix(user_ids, item_ids, ratings, similarity)
+    n_items, k = len(items), index['neighbours'].shape[1]
+    k = max(0, min(k, n_items - 1))
+
+    # Earlier lists, moved to the positions of the current item IDs.
+    moved = np.searchsorted(items, index['item_ids'])
+    neighbours = np.zeros((n_items, k), dtype=np.int32)
+    similarities = np.full((n_items, k), -np.inf, dtype=np.float32)
+    neighbours[moved] = moved[index['neighbours'][:, :k]]
+    similarities[moved] = index['similarities'][:, :k]
+
+    touched = np.searchsorted(items, np.unique(np.asarray(touched)))
+    touched = touched[touched < n_items]
+    is_touched = np.zeros(n_items, dtype=bool)
+    is_touched[touched] = True
+    # Old similarities to touched movies are stale.
+    similarities[is_touched[neighbours]] = -np.inf
+    if k == 0:
+        return {'item_ids': items, 'neighbours': neighbours,
+                'similarities': similarities}
+
+    block_size = max(1, block_bytes // (12 * n_items) - k)
+    others = np.flatnonzero(~is_touched)
+    for start in range(0, len(touched), block_size):
+        rows = touched[start:start + block_size]
+        block = (Xt[rows] @ X).toarray()
+        block[np.arange(len(rows)), rows] = -np.inf
+        neighbours[rows], similarities[rows] = _top_neighbours(block, k)
+
+        # Lists of other movies that a touched movie now gets into.
+        best = block[:, others].max(axis=0)
+        better = others[best > similarities[others].min(axis=1)]
+        if len(better) == 0:
+            continue
+        merged_sims = np.hstack([similarities[better], block[:, better].T])
+        merged = np.hstack([neighbours[better],
+                            np.broadcast_to(rows, (len(better), len(rows)))])
+        top, sims = _top_neighbours(merged_sims, k)
+        neighbours[better] = np.take_along_axis(merged, top, axis=1)
+        similarities[better] = sims
+    return {'item_ids': items, 'neighbours': neighbours,
+            'similarities': similarities}
+
+
+def save_item_neighbours(path, index):
+    """Write an index produced by `build_item_neighbours` to `path`.
+
+    An optional 'ratings' entry of `index`, how far the ratings file has
+    been folded into it (`RatingStream.state`), is saved along. The file
+    is replaced in one step, so readers never see half of it.
+    """
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        np.savez(f, item_ids=index['item_ids'],
+                 neighbours=index['neighbours'],
+                 similarities=index['similarities'],
+                 ratings=np.array(json.dumps(index.get('ratings'))))
+    os.replace(tmp, path)
+
+
+class ItemNeighbours:
+    """Read-only item-item neighbour index.
+
+    Parameters
+    ----------
+    item_ids : np.ndarray
+        Movie IDs, one per row of `neighbours`.
+    neighbours : np.ndarray
+        Row positions of each item's neighbours, most similar first.
+    similarities : np.ndarray
+        Similarity of each stored neighbour.
+    ratings : dict, optional
+        How far the ratings file has been folded into the index, as
+        saved by `save_item_neighbours`.
+
+    """
+
+    def __init__(self, item_ids, neighbours, similarities, ratings=None):
+        self.item_ids = np.asarray(item_ids)
+        self.neighbours = np.asarray(neighbours)
+        self.similarities = np.asarray(similarities)
+        self.ratings = ratings
+        self._index = {iid: i for i, iid in enumerate(self.item_ids.tolist())}
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with `save_item_neighbours`."""
+        with np.load(path) as data:
+            ratings = (json.loads(str(data['ratings']))
+                       if 'ratings' in data.files else None)
+            return cls(data['item_ids'], data['neighbours'],
+                       data['similarities'], ratings)
+
+    def scores(self, movie_ids, user_rating=5.0):
+        """Summed neighbour similarity of the movies near some favourites.
+
+        Each favourite contributes its stored neighbours weighted by
+        `user_rating`; the contributions are summed per movie and the
+        favourites themselves are left out.
+
+        Parameters
+        ----------
+        movie_ids : list (int)
+            MovieLens Movie IDs of the favourite movies.
+        user_rating : float
+            Rating assumed for each favourite movie.
+
+        Returns
+        -------
+        tuple (np.ndarray, np.ndarray)
+            Movie IDs and their scores. Only positive scores are kept:
+            padding entries and favourites without similar movies (e.g.
+            rated once, under 'pearson') contribute none, so the result is
+            empty when nothing is similar.
+
+        """
+        rows = [self._index[m] for m in movie_ids if m in self._index]
+        if not rows:
+            return self.item_ids[:0], np.empty(0)
+        candidates = self.neighbours[rows].ravel()
+        weights = self.similarities[rows].ravel() * user_rating
+        positions, inverse = np.unique(candidates, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        keep = ~np.isin(positions, rows) & np.isfinite(scores) & (scores > 0)
+        return self.item_ids[positions[keep]], scores[keep]
+
+    def recommend(self, movie_ids, top_n=10, user_rating=5.0):
+        """Movies most similar to a set of favourite movies.
+
+        Movies are ranked by their `scores`.
+
+        Parameters
+        ----------
+        movie_ids : list (int)
+            MovieLens Movie IDs of the favourite movies.
+        top_n : int
+            Number of movies to return.
+        user_rating : float
+            Rating assumed for each favourite movie.
+
+        Returns
+        -------
+        list (int)
+            Movie IDs, best first.
+
+        """
+        item_ids, scores = self.scores(movie_ids, user_rating)
+        return item_ids[top_k(scores, top_n)].tolist()
+
+    def recommend_many(self, movie_id_lists, top_n=10, user_rating=5.0):
+        """`recommend` for many sets of favourite movies at once.
+
+        The neighbour contributions of every set are summed together, with
+        one `np.unique` and `np.bincount` over the whole batch, instead of
+        one `recommend` call each.
+
+        Parameters
+        ----------
+        movie_id_lists : list (list (int))
+            MovieLens Movie IDs of each set of favourite movies.
+        top_n : int
+            Number of movies to return per set.
+        user_rating : float
+            Rating assumed for each favourite movie.
+
+        Returns
+        -------
+        list (list (int))
+            Movie IDs per set, best first.
+
+        """
+        rows = [[self._index[m] for m in movie_ids if m in self._index]
+                for movie_ids in movie_id_lists]
+        sets = np.repeat(np.arange(len(rows)), [len(r) for r in rows])
+        favourites = np.fromiter((r for rs in rows for r in rs),
+                                 dtype=np.int64, count=len(sets))
+        if len(sets) == 0:
+            return [[] for _ in rows]
+        n_items, k = len(self.item_ids), self.neighbours.shape[1]
+        # One key per (set, candidate), so sorting groups candidates by set.
+        keys = (np.repeat(sets, k) * n_items
+                + self.neighbours[favourites].ravel())
+        weights = self.similarities[favourites].ravel() * user_rating
+        keys, inverse = np.unique(keys, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        scores[np.isin(keys, sets * n_items + favourites)] = -np.inf
+        bounds = np.searchsorted(keys, np.arange(len(rows) + 1) * n_items)
+
+        recommended = []
+        for b in range(len(rows)):
+            positions = keys[bounds[b]:bounds[b + 1]] % n_items
+            values = scores[bounds[b]:bounds[b + 1]]
+            best = top_k(values, top_n)
+            best = best[np.isfinite(values[best]) & (values[best] > 0)]
+            recommended.append(self.item_ids[positions[best]].tolist())
+        return recommended
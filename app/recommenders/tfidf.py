@@ -0,0 +1,242 @@
+"""
+
+    TF-IDF content index.
+
+    Author: Explore Data Science Academy.
+
+    Description: Describes every movie by the terms of its genres, tags,
+    cast, director and plot keywords, weighted by TF-IDF and L2-normalized,
+    in one sparse movie-by-term matrix. It is built offline by
+    resources/models/build_tfidf_index.py and saved as a single `.npz` file.
+
+    A query sums the rows of the favourite movies into a profile and scores
+    every movie with one sparse matrix-vector product; the best are picked
+    with `argpartition` (see `factors.top_k`). No dense movie-by-movie
+    similarity matrix is ever formed. Movies of equal similarity, common
+    when only genres are known, are ordered by a second score such as
+    their Bayesian-weighted rating.
+
+"""
+
+# Script dependencies
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfTransformer
+
+from recommenders.factors import top_k
+from utils.files import write_atomic
+
+# Field: (dataset, column, separator of multiple values or None).
+FIELDS = {
+    'genre': ('movies', 'genres', '|'),
+    'tag': ('tags', 'tag', None),
+    'cast': ('imdb_data', 'title_cast', '|'),
+    'director': ('imdb_data', 'director', None),
+    'keyword': ('imdb_data', 'plot_keywords', '|'),
+}
+# Fields of free text, whose stop words are left out as in the Insights
+# tag words (see `insights.count_words`).
+FREE_TEXT = {'tag'}
+
+
+def field_terms(movie_ids, values, field, sep=None, stopwords=None):
+    """(movie ID, term) pairs of one metadata column.
+
+    Terms are lowercased values prefixed by the field, with spaces
+    replaced, e.g. 'director:john_lasseter', so equal words in different
+    fields stay different terms.
+
+    Parameters
+    ----------
+    movie_ids : array-like
+        Movie ID of each value.
+    values : Pandas Series
+        The column; missing values are ignored.
+    field : str
+        Prefix of the terms.
+    sep : str, optional
+        Separator of several values in one cell.
+    stopwords : set (str), optional
+        Values to leave out, along with values of one character.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Columns 'movieId' and 'term', one row per occurrence.
+
+    """
+    terms = pd.DataFrame({'movieId': np.asarray(movie_ids),
+                          'term': pd.Series(values).astype(object).values})
+    terms = terms.dropna()
+    terms['term'] = terms['term'].astype(str)
+    if sep:
+        terms['term'] = terms['term'].str.split(sep, regex=False)
+        terms = terms.explode('term')
+    terms['term'] = terms['term'].str.strip().str.lower()
+    terms = terms[(terms['term'] != '') & (terms['term'] != '(no genres listed)')]
+    if stopwords is not None:
+        terms = terms[(terms['term'].str.len() > 1)
+                      & ~terms['term'].isin(list(stopwords))]
+    terms['term'] = field + ':' + terms['term'].str.replace(r'\s+', '_', regex=True)
+    return terms
+
+
+def build_tfidf(item_ids, terms, min_df=2):
+    """TF-IDF matrix of movies from their (movie ID, term) pairs.
+
+    Parameters
+    ----------
+    item_ids : array-like
+        Movie IDs, one per row of the matrix.
+    terms : Pandas Dataframe
+        Columns 'movieId' and 'term', one row per occurrence, e.g. from
+        `field_terms`. Repeated terms (a tag given by many users) count
+        more, with sublinear term frequency.
+    min_df : int
+        Terms found in fewer movies are dropped; they cannot make two
+        movies similar.
+
+    Returns
+    -------
+    TfidfIndex
+
+    """
+    item_ids = np.asarray(item_ids)
+    rows = pd.Index(item_ids).get_indexer(terms['movieId'].values)
+    known = rows >= 0
+    codes, vocabulary = pd.factorize(terms['term'].values[known])
+    counts = sparse.csr_matrix(
+        (np.ones(len(codes), dtype=np.float32), (rows[known], codes)),
+        shape=(len(item_ids), len(vocabulary)))
+    counts.sum_duplicates()
+    document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+    keep = np.flatnonzero(document_frequency >= min_df)
+    counts = counts[:, keep]
+    matrix = TfidfTransformer(sublinear_tf=True).fit_transform(counts)
+    return TfidfIndex(item_ids, matrix.astype(np.float32).tocsr(),
+                      np.asarray(vocabulary)[keep])
+
+
+class TfidfIndex:
+    """L2-normalized TF-IDF rows of movies.
+
+    Parameters
+    ----------
+    item_ids : np.ndarray
+        Movie IDs, one per row of `matrix`.
+    matrix : scipy.sparse.csr_matrix
+        Movie-by-term TF-IDF weights, each row of unit length (or empty).
+    terms : np.ndarray, optional
+        Term of each column.
+
+    """
+
+    def __init__(self, item_ids, matrix, terms=None):
+        self.item_ids = np.asarray(item_ids)
+        self.matrix = sparse.csr_matrix(matrix)
+        self.terms = terms
+        self._items = pd.Index(self.item_ids)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by `save`."""
+        with np.load(path, allow_pickle=False) as data:
+            matrix = sparse.csr_matrix(
+                (data['data'], data['indices'], data['indptr']),
+                shape=tuple(data['shape']))
+            terms = data['terms'] if 'terms' in data else None
+            return cls(data['item_ids'], matrix, terms)
+
+    def save(self, path):
+        """Write the index to one `.npz` file, replacing it in one step."""
+        arrays = {'item_ids': self.item_ids, 'data': self.matrix.data,
+                  'indices': self.matrix.indices, 'indptr': self.matrix.indptr,
+                  'shape': np.array(self.matrix.shape)}
+        if self.terms is not None:
+            arrays['terms'] = np.asarray(self.terms, dtype=str)
+
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                np.savez(f, **arrays)
+        write_atomic(path, write)
+
+    def item_positions(self, item_ids):
+        """Rows of movie IDs, -1 for movies not in the index."""
+        return self._items.get_indexer(np.asarray(item_ids).ravel())
+
+    def _profiles(self, position_lists):
+        """Summed rows of each list of positions, as a sparse matrix."""
+        sets = np.repeat(np.arange(len(position_lists)),
+                         [len(p) for p in position_lists])
+        positions = np.fromiter((p for ps in position_lists for p in ps),
+                                dtype=np.int64, count=len(sets))
+        selector = sparse.csr_matrix(
+            (np.ones(len(sets), dtype=np.float32), (sets, positions)),
+            shape=(len(position_lists), len(self.item_ids)))
+        return selector @ self.matrix
+
+    def recommend(self, movie_ids, top_n=10, allowed=None, tie_break=None):
+        """Movies most similar in content to a set of favourite movies.
+
+        Parameters
+        ----------
+        movie_ids : list (int)
+            MovieLens Movie IDs of the favourite movies.
+        top_n : int
+            Number of movies to return.
+        allowed : np.ndarray, optional
+            Boolean mask over the rows of the index of the movies that
+            may be recommended.
+        tie_break : np.ndarray, optional
+            Score of every row, e.g. the Bayesian-weighted rating, that
+            orders movies of equal similarity; by row otherwise.
+
+        Returns
+        -------
+        list (int)
+            Movie IDs, best first; only movies sharing at least one term
+            with the favourites.
+
+        """
+        return self.recommend_many([movie_ids], top_n, allowed, tie_break)[0]
+
+    def recommend_many(self, movie_id_lists, top_n=10, allowed=None,
+                       tie_break=None, block_bytes=32 << 20):
+        """`recommend` for many sets of favourite movies.
+
+        The profiles of a block of sets are scored with one sparse product,
+        whose dense result fits in `block_bytes`.
+        """
+        position_lists = []
+        for movie_ids in movie_id_lists:
+            positions = self.item_positions(movie_ids)
+            position_lists.append(positions[positions >= 0])
+        block = max(1, block_bytes // (8 * max(len(self.item_ids), 1)))
+        recommended = []
+        for start in range(0, len(position_lists), block):
+            favourites = position_lists[start:start + block]
+            scores = (self._profiles(favourites) @ self.matrix.T).toarray()
+            for positions, row in zip(favourites, scores):
+                row[positions] = 0.0
+                if allowed is not None:
+                    row[~allowed] = 0.0
+                best = _top_positive(row, top_n, tie_break)
+                recommended.append(self.item_ids[best].tolist())
+        return recommended
+
+
+def _top_positive(scores, top_n, tie_break=None):
+    """Positions of the `top_n` highest positive scores, best first.
+
+    Every position tied with the last one kept is a candidate, and equal
+    scores are ordered by `tie_break`.
+    """
+    best = top_k(scores, top_n)
+    best = best[scores[best] > 0]
+    if tie_break is None or len(best) == 0:
+        return best
+    candidates = np.flatnonzero(scores >= scores[best[-1]])
+    order = np.lexsort((-np.nan_to_num(tie_break[candidates], nan=-np.inf),
+                        -scores[candidates]))
+    return candidates[order[:top_n]]
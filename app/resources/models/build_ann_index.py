@@ -0,0 +1,73 @@
+"""
+
+    Approximate nearest-neighbour index builder.
+
+    Author: Explore Data Science Academy.
+
+    Description: Simple script to cluster the trained item factors and
+    biases into an IVF index (recommenders/ann.py), queried by
+    `collab_model` with a folded-in user vector, and save it next to the
+    model. It is tied to the version of the factors it was built from;
+    rebuild it whenever the model is retrained or updated.
+
+    The default `nprobe` stored in the index is the smallest that reaches
+    `--target-recall` recall@10 against exact search on sample queries.
+
+"""
+# Script dependencies
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, APP_DIR)
+
+from recommenders.ann import (IVFIndex, factor_query, factor_vectors,
+                              recall_at_k, tune_nprobe)
+from utils import registry
+
+
+def embeddings(n_queries=200, seed=0):
+    """Movie vectors, their IDs, the metric and sample queries."""
+    rng = np.random.default_rng(seed)
+    factors = registry.get('latent_factors')
+    users = rng.choice(len(factors.user_ids),
+                       min(n_queries, len(factors.user_ids)), replace=False)
+    queries = np.stack([factor_query(factors, factors.pu[u]) for u in users])
+    return factor_vectors(factors), factors.item_ids, 'ip', queries
+
+
+def build_index(save_path, n_lists=None, target_recall=0.95):
+    vectors, item_ids, metric, queries = embeddings()
+    start = time.perf_counter()
+    index = IVFIndex.build(vectors, item_ids, metric=metric, n_lists=n_lists)
+    index.version = registry.get('latent_factors').version
+    print(f"Clustered {len(item_ids)} movies into {len(index.centroids)} "
+          f"lists in {time.perf_counter() - start:.1f}s.")
+    for nprobe, recall in tune_nprobe(index, queries, target_recall).items():
+        print(f"  nprobe={nprobe}: recall@10={recall:.3f}")
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query, 10)
+    per_query = (time.perf_counter() - start) / len(queries) * 1000
+    recall = recall_at_k(index, queries, 10)
+    if recall < target_recall:
+        raise SystemExit(f"recall@10={recall:.3f} is below the target of "
+                         f"{target_recall}; the index was not saved.")
+    print(f"nprobe={index.nprobe}: recall@10={recall:.3f}, "
+          f"{per_query:.3f} ms/query. Saving to: {save_path}")
+    index.save(save_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--output', default=registry.model_path('factor_ann.npz'))
+    parser.add_argument('--n-lists', type=int,
+                        help='Clusters (default: 4 * sqrt(movies)).')
+    parser.add_argument('--target-recall', type=float, default=0.95)
+    args = parser.parse_args()
+    build_index(args.output, n_lists=args.n_lists,
+                target_recall=args.target_recall)
@@ -0,0 +1,40 @@
+"""
+
+    Insights aggregation job.
+
+    Author: Explore Data Science Academy.
+
+    Description: Simple script to compute or refresh the count tables
+    behind the Insights page (utils/insights.py). Unchanged sources are
+    skipped and rows appended to a source are added to the saved counts,
+    so it is cheap to run on a schedule.
+
+"""
+# Script dependencies
+import argparse
+import os
+import sys
+import time
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, APP_DIR)
+
+from utils.insights import INSIGHTS_DIR, TABLES, refresh_insights
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('tables', nargs='*',
+                        help=f"Tables to refresh, of {', '.join(TABLES)} "
+                             f"(default: all).")
+    parser.add_argument('--output-dir', default=INSIGHTS_DIR)
+    args = parser.parse_args()
+    unknown = set(args.tables) - set(TABLES)
+    if unknown:
+        parser.error(f"unknown tables: {', '.join(sorted(unknown))}")
+    start = time.perf_counter()
+    for name, action in refresh_insights(args.tables or None,
+                                         args.output_dir).items():
+        print(f"{name}: {action}")
+    print(f"Insights refreshed in {time.perf_counter() - start:.1f}s. "
+          f"Saved to: {args.output_dir}")
@@ -0,0 +1,47 @@
+"""
+
+    Item-item neighbour index builder.
+
+    Author: Explore Data Science Academy.
+
+    Description: Simple script to precompute the top-K most similar
+    movies of every rated movie from MovieLens ratings, and save them for
+    use by `collab_model`.
+
+"""
+# Script dependencies
+import argparse
+import os
+import sys
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, APP_DIR)
+
+from recommenders.neighbours import build_item_neighbours, save_item_neighbours
+from utils.rating_store import RatingStore
+
+
+def build_index(ratings_path, save_path, k=50, similarity='pearson'):
+    ratings = RatingStore.from_csv(ratings_path).to_frame()
+    index = build_item_neighbours(ratings['userId'].values,
+                                  ratings['movieId'].values,
+                                  ratings['rating'].values,
+                                  k=k, similarity=similarity)
+    print(f"Index built for {len(index['item_ids'])} movies. "
+          f"Saving to: {save_path}")
+    save_item_neighbours(save_path, index)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--ratings', default=os.path.join(
+        APP_DIR, 'resources', 'data', 'ratings.csv'))
+    parser.add_argument('--output', default=os.path.join(
+        APP_DIR, 'resources', 'models', 'item_neighbours.npz'))
+    parser.add_argument('-k', type=int, default=50,
+                        help='Neighbours kept per movie.')
+    parser.add_argument('--similarity', choices=['pearson', 'cosine'],
+                        default='pearson')
+    args = parser.parse_args()
+    build_index(args.ratings, args.output, k=args.k,
+                similarity=args.similarity)
@@ -0,0 +1,38 @@
+"""
+
+    Rating aggregates builder.
+
+    Author: Explore Data Science Academy.
+
+    Description: Simple script to count the ratings of every movie in
+    `ratings.csv` and save the table loaded by `content_model` and the
+    hybrid recommender. An existing table is only brought up to date with
+    the lines appended since it was saved.
+
+"""
+# Script dependencies
+import argparse
+import os
+import sys
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, APP_DIR)
+
+from utils import registry
+from utils.rating_aggregates import load_rating_aggregates
+
+
+def build_aggregates(ratings_path, save_path):
+    aggregates = load_rating_aggregates(ratings_path, save_path, save=True)
+    print(f"{int(aggregates.counts.sum())} ratings of "
+          f"{int((aggregates.counts > 0).sum())} movies counted. "
+          f"Saved to: {save_path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--ratings', default=registry.data_path('ratings.csv'))
+    parser.add_argument('--output',
+                        default=registry.model_path('rating_aggregates.npz'))
+    args = parser.parse_args()
+    build_aggregates(args.ratings, args.output)
@@ -0,0 +1,62 @@
+"""
+
+    TF-IDF content index builder.
+
+    Author: Explore Data Science Academy.
+
+    Description: Simple script to describe every movie by the TF-IDF
+    weights of its genres, tags, cast, director and plot keywords, and save
+    the sparse matrix for use by `content_model`. Datasets that are missing
+    are skipped, and tags lose the stop words the Insights tag words leave
+    out.
+
+"""
+# Script dependencies
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, APP_DIR)
+
+from recommenders.tfidf import FIELDS, FREE_TEXT, build_tfidf, field_terms
+from utils import registry
+from utils.insights import STOPWORDS
+
+
+def build_index(save_path, fields=None, min_df=2):
+    movies = registry.read_csv('movies')
+    terms, datasets = [], {}
+    for field in fields or list(FIELDS):
+        dataset, column, sep = FIELDS[field]
+        if dataset not in datasets:
+            if not os.path.exists(registry.data_path(f'{dataset}.csv')):
+                print(f"No {dataset}.csv; skipping {field}.")
+                continue
+            datasets[dataset] = registry.read_csv(dataset)
+        data = datasets[dataset]
+        terms.append(field_terms(data['movieId'].values, data[column], field,
+                                 sep, STOPWORDS if field in FREE_TEXT else None))
+    if not terms:
+        raise SystemExit("None of the metadata datasets were found; the "
+                         "index was not built.")
+    index = build_tfidf(movies['movieId'].values, pd.concat(terms), min_df)
+    print(f"Index built for {index.matrix.shape[0]} movies and "
+          f"{index.matrix.shape[1]} terms. Saving to: {save_path}")
+    index.save(save_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--output', default=registry.model_path('tfidf_index.npz'))
+    parser.add_argument('--fields', nargs='+', choices=list(FIELDS),
+                        help='Metadata to describe movies by (default: all).')
+    parser.add_argument('--min-df', type=int, default=2,
+                        help='Fewest movies a term must describe to be kept.')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    build_index(args.output, args.fields, args.min_df)
+    print(f"Done in {time.perf_counter() - start:.1f}s.")
@@ -0,0 +1,39 @@
+"""
+
+    SVD factor export.
+
+    Author: Explore Data Science Academy.
+
+    Description: Simple script to convert an existing pickled Surprise
+    model (e.g. `SVD.pkl`) into the memory-mappable `.npy` + manifest
+    export loaded by the app.
+
+"""
+# Script dependencies
+import argparse
+import os
+import pickle
+import sys
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, APP_DIR)
+
+from recommenders.factors import LatentFactors
+
+
+def export_factors(model_path, export_dir):
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    print(f"Exporting factors of {model_path} to: {export_dir}")
+    LatentFactors.from_surprise(model).save(export_dir,
+                                            algorithm=type(model).__name__)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--model', default=os.path.join(
+        APP_DIR, 'resources', 'models', 'SVD.pkl'))
+    parser.add_argument('--output', default=os.path.join(
+        APP_DIR, 'resources', 'models', 'svd_factors'))
+    args = parser.parse_args()
+    export_factors(args.model, args.output)
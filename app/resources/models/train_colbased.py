@@ -7,33 +7,298 @@
     Description: Simple script to train and save an instance of the
     SVDpp algorithm on MovieLens data.
 
+    With `--search grid` or `--search random` it instead cross-validates
+    SVD, SVD++, NMF and BaselineOnly configurations in parallel across
+    cores, checkpointing each finished trial so an interrupted search
+    resumes where it stopped, and then saves the best model together
+    with a metrics report. The best model is written next to the served
+    one (`search_best.pkl`, `search_best_factors`), never over it.
+
+    With `--engine als` the factors are trained by the in-repo ALS engine
+    (recommenders/als.py) across all cores instead, and exported straight
+    to `svd_factors` for serving.
+
+    Usage:
+        python train_colbased.py
+        python train_colbased.py --search random --n-trials 20 --n-jobs 8
+        python train_colbased.py --engine als --n-factors 100 --implicit
+
 """
 # Script dependencies
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
-import pandas as pd
-from surprise import SVD
+from surprise import SVD, SVDpp, NMF, BaselineOnly
+from surprise.model_selection import KFold, cross_validate
 import surprise
 import pickle
 
-# Importing datasets
-ratings = pd.read_csv('ratings.csv')
-ratings.drop('timestamp',axis=1,inplace=True)
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, APP_DIR)
+
+from recommenders.als import ALS
+from recommenders.factors import LatentFactors
+from utils.rating_store import RatingStore
+
+RATINGS_PATH = os.path.join(APP_DIR, 'resources', 'data', 'ratings.csv')
+MODELS_DIR = os.path.join(APP_DIR, 'resources', 'models')
+
+ALGORITHMS = {'SVD': SVD, 'SVDpp': SVDpp, 'NMF': NMF,
+              'BaselineOnly': BaselineOnly}
+
+# Hyperparameter values tried for each algorithm.
+SEARCH_SPACE = {
+    'SVD': {'n_factors': [50, 100, 200], 'n_epochs': [20, 40],
+            'lr_all': [0.005, 0.01], 'reg_all': [0.02, 0.05]},
+    'SVDpp': {'n_factors': [20, 50], 'n_epochs': [20],
+              'lr_all': [0.007], 'reg_all': [0.02, 0.05]},
+    'NMF': {'n_factors': [15, 50], 'n_epochs': [50],
+            'reg_pu': [0.06, 0.1], 'reg_qi': [0.06, 0.1]},
+    'BaselineOnly': {'bsl_options': [{'method': 'als', 'n_epochs': 10},
+                                     {'method': 'sgd', 'n_epochs': 20}]},
+}
+
 
-def svd_pp(save_path):
+def load_dataset(ratings_path=RATINGS_PATH):
+    """Surprise dataset of the ratings in `ratings_path`."""
+    ratings = RatingStore.from_csv(ratings_path).to_frame()
     # Check the range of the rating
     min_rat = ratings['rating'].min()
     max_rat = ratings['rating'].max()
     # Changing ratings to their standard form
-    reader = surprise.Reader(rating_scale = (min_rat,max_rat))
+    reader = surprise.Reader(rating_scale = (float(min_rat), float(max_rat)))
     # Loading the data frame using surprice
-    data_load = surprise.Dataset.load_from_df(ratings, reader)
+    return surprise.Dataset.load_from_df(ratings, reader)
+
+def svd_pp(save_path, ratings_path=RATINGS_PATH):
+    data_load = load_dataset(ratings_path)
     # Insatntiating surpricce
     method = SVD(n_factors = 200 , lr_all = 0.005 , reg_all = 0.02 , n_epochs = 40 , init_std_dev = 0.05)
     # Loading a trainset into the model
     model = method.fit(data_load.build_full_trainset())
     print (f"Training completed. Saving model to: {save_path}")
+    pickle.dump(model, open(save_path,'wb'))
+
+    # Memory-mappable copy of the factors for serving (recommenders/factors.py)
+    export_dir = os.path.join(os.path.dirname(os.path.abspath(save_path)), 'svd_factors')
+    print (f"Exporting factors to: {export_dir}")
+    LatentFactors.from_surprise(model).save(export_dir)
+
+def als(export_dir, ratings_path=RATINGS_PATH, n_jobs=None, **params):
+    """Train factors with the in-repo ALS engine and export them.
+
+    Parameters
+    ----------
+    export_dir : str
+        Folder the factors are exported to, see `LatentFactors.save`.
+    ratings_path : str
+        Ratings CSV file.
+    n_jobs : int, optional
+        Threads used by the solver; defaults to the CPU count.
+    **params
+        Passed on to `recommenders.als.ALS`.
+    """
+    ratings = RatingStore.from_csv(ratings_path).to_frame()
+    model = ALS(n_threads=n_jobs, verbose=True, **params)
+    factors = model.fit(ratings['userId'].values, ratings['movieId'].values,
+                        ratings['rating'].values)
+    print (f"Training completed. Exporting factors to: {export_dir}")
+    factors.save(export_dir, algorithm='ALS-implicit' if model.implicit else 'ALS')
+
+def trial_configs(algorithms, search='grid', n_trials=None, seed=0):
+    """Configurations to evaluate.
+
+    Parameters
+    ----------
+    algorithms : list (str)
+        Keys of `ALGORITHMS` to include.
+    search : str
+        'grid' for every combination in `SEARCH_SPACE`, 'random' for a
+        random sample of `n_trials` of them.
+    n_trials : int, optional
+        Sample size for random search.
+    seed : int
+        Seed of the random sample.
+
+    Returns
+    -------
+    list (dict)
+        Configurations with keys `algorithm` and `params`.
+    """
+    configs = []
+    for algorithm in algorithms:
+        space = SEARCH_SPACE[algorithm]
+        for values in itertools.product(*space.values()):
+            configs.append({'algorithm': algorithm,
+                            'params': dict(zip(space.keys(), values))})
+    if search == 'random' and n_trials is not None:
+        configs = random.Random(seed).sample(configs, min(n_trials, len(configs)))
+    return configs
 
-    return pickle.dump(model, open(save_path,'wb'))
+def trial_key(config, folds, seed, ratings_path):
+    """Stable identifier of a trial, used for checkpointing.
+
+    Scores are only reused for the same configuration cross-validated
+    the same way on the same ratings file.
+    """
+    return json.dumps({'config': config, 'folds': folds, 'seed': seed,
+                       'ratings': os.path.abspath(ratings_path)},
+                      sort_keys=True)
+
+def load_checkpoint(path):
+    """Finished trials recorded in a checkpoint file, by `trial_key`.
+
+    A line cut short by an interruption is ignored, so that trial runs
+    again.
+    """
+    finished = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if {'folds', 'seed', 'ratings'} <= result.keys():
+                    finished[trial_key(result['config'], result['folds'],
+                                       result['seed'], result['ratings'])] = result
+    return finished
+
+def _append_checkpoint(path, result):
+    with open(path, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+# Dataset of each worker process, loaded once by `_init_worker`.
+_worker_data = None
+
+def _init_worker(ratings_path):
+    global _worker_data
+    _worker_data = load_dataset(ratings_path)
+
+def run_trial(config, folds=3, seed=0):
+    """Cross-validate one configuration on the worker's dataset."""
+    algo = ALGORITHMS[config['algorithm']](**config['params'])
+    start = time.perf_counter()
+    scores = cross_validate(algo, _worker_data, measures=['rmse', 'mae'],
+                            cv=KFold(n_splits=folds, random_state=seed),
+                            n_jobs=1)
+    return {'config': config, 'folds': folds, 'seed': seed,
+            'rmse': float(np.mean(scores['test_rmse'])),
+            'mae': float(np.mean(scores['test_mae'])),
+            'seconds': time.perf_counter() - start}
+
+def search(algorithms, search='grid', n_trials=None, folds=3, n_jobs=None,
+           seed=0, ratings_path=RATINGS_PATH, output_dir=MODELS_DIR,
+           checkpoint=None):
+    """Run a hyperparameter search and save the best model.
+
+    Trials run in a process pool of `n_jobs` workers. Each finished trial
+    is appended to `checkpoint` straight away, and trials already in it
+    are skipped, so rerunning the same command resumes an interrupted
+    search.
+
+    Returns
+    -------
+    dict
+        The metrics report, also written to `search_report.json`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint = checkpoint or os.path.join(output_dir, 'search_trials.jsonl')
+    configs = trial_configs(algorithms, search, n_trials, seed)
+    finished = load_checkpoint(checkpoint)
+    key = lambda config: trial_key(config, folds, seed, ratings_path)
+    pending = [c for c in configs if key(c) not in finished]
+    print(f"{len(configs)} trials, {len(configs) - len(pending)} already "
+          f"in {checkpoint}, running {len(pending)}.", flush=True)
+
+    start = time.perf_counter()
+    if pending:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                 initargs=(ratings_path,)) as pool:
+            futures = [pool.submit(run_trial, c, folds, seed) for c in pending]
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                result['ratings'] = os.path.abspath(ratings_path)
+                _append_checkpoint(checkpoint, result)
+                finished[key(result['config'])] = result
+                elapsed = time.perf_counter() - start
+                eta = elapsed / done * (len(pending) - done)
+                print(f"[{done}/{len(pending)}] {result['config']['algorithm']} "
+                      f"{result['config']['params']} rmse={result['rmse']:.4f} "
+                      f"mae={result['mae']:.4f} ({elapsed:.0f}s elapsed, "
+                      f"~{eta:.0f}s left)", flush=True)
+
+    trials = sorted((finished[key(c)] for c in configs),
+                    key=lambda r: r['rmse'])
+    best = trials[0]
+    print(f"Best: {best['config']} rmse={best['rmse']:.4f}. Refitting on "
+          f"all ratings.", flush=True)
+    model = ALGORITHMS[best['config']['algorithm']](**best['config']['params'])
+    model.fit(load_dataset(ratings_path).build_full_trainset())
+
+    # Kept apart from the served SVD.pkl and svd_factors; deploy by hand.
+    model_path = os.path.join(output_dir, 'search_best.pkl')
+    with open(model_path, 'wb') as f:
+        pickle.dump(model, f)
+    if isinstance(model, SVD):
+        LatentFactors.from_surprise(model).save(
+            os.path.join(output_dir, 'search_best_factors'),
+            algorithm=best['config']['algorithm'])
+
+    report = {'search': search, 'folds': folds, 'seed': seed,
+              'ratings': ratings_path, 'best': best, 'model': model_path,
+              'trials': trials}
+    with open(os.path.join(output_dir, 'search_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved best model to: {model_path}")
+    return report
 
 if __name__ == '__main__':
-    svd_pp('SVD.pkl')
+    parser = argparse.ArgumentParser(
+        description='Train collaborative filtering models on MovieLens data.')
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--output-dir', default=MODELS_DIR)
+    parser.add_argument('--engine', choices=['surprise', 'als'],
+                        default='surprise',
+                        help='Library that trains the default model.')
+    parser.add_argument('--n-factors', type=int, default=50,
+                        help='Latent factors of the ALS engine.')
+    parser.add_argument('--n-epochs', type=int, default=15,
+                        help='Epochs of the ALS engine.')
+    parser.add_argument('--reg', type=float, default=0.05,
+                        help='Factor regularization of the ALS engine.')
+    parser.add_argument('--implicit', action='store_true',
+                        help='Fit implicit-feedback ALS.')
+    parser.add_argument('--search', choices=['grid', 'random'],
+                        help='Run a hyperparameter search instead of '
+                             'training the default SVD.')
+    parser.add_argument('--algorithms', nargs='+', choices=list(ALGORITHMS),
+                        default=list(ALGORITHMS))
+    parser.add_argument('--n-trials', type=int, default=10,
+                        help='Trials sampled by random search.')
+    parser.add_argument('--folds', type=int, default=3)
+    parser.add_argument('--n-jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--checkpoint',
+                        help='Trial log used to resume (default: '
+                             'search_trials.jsonl in the output folder).')
+    args = parser.parse_args()
+
+    if args.search:
+        search(args.algorithms, args.search, args.n_trials, args.folds,
+               args.n_jobs, args.seed, args.ratings, args.output_dir,
+               args.checkpoint)
+    elif args.engine == 'als':
+        als(os.path.join(args.output_dir, 'svd_factors'), args.ratings,
+            args.n_jobs, n_factors=args.n_factors, n_epochs=args.n_epochs,
+            reg=args.reg, implicit=args.implicit, seed=args.seed)
+    else:
+        svd_pp(os.path.join(args.output_dir, 'SVD.pkl'), args.ratings)
@@ -0,0 +1,162 @@
+"""
+
+    Incremental model updater.
+
+    Author: Explore Data Science Academy.
+
+    Description: Simple script to fold the ratings appended to
+    `ratings.csv` since its last run into the deployed models, without
+    retraining them:
+
+      - the SVD factors of the users and movies rated are moved by a few
+        epochs of gradient steps (`incremental.sgd_update`) and exported
+        to `svd_factors`;
+      - the per-movie rating aggregates are brought up to date;
+      - the neighbour lists involving the rated movies are recomputed, if
+        there is a neighbour index.
+
+    Each file is replaced in one step, and running apps and API workers
+    switch to the new versions on their next request. How far the
+    ratings file has been read is kept in `resources/updates.json`,
+    outside the model folder so that polling does not change the models'
+    version; the first run only records the current end of the file.
+    The factors and neighbours record how far they have been updated as
+    well, so a run that failed part way is finished by the next one
+    without applying the same ratings twice. With `--follow` the script
+    keeps polling for new ratings.
+
+"""
+# Script dependencies
+import argparse
+import json
+import os
+import sys
+import time
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, APP_DIR)
+
+from recommenders.factors import MANIFEST, LatentFactors, is_export
+from recommenders.incremental import RatingStream, sgd_update
+from recommenders.neighbours import (ItemNeighbours, save_item_neighbours,
+                                     update_item_neighbours)
+from utils import registry
+from utils.files import write_atomic, write_json
+from utils.rating_aggregates import load_rating_aggregates
+from utils.rating_store import RatingStore
+
+
+def load_state(state_path, ratings_path):
+    """The ratings stream, and the end of the batch being applied if any."""
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        pending = state.pop('pending', None)
+        return RatingStream(**state), pending
+    print(f"No {state_path}; reading ratings appended from now on.")
+    return RatingStream.from_end(ratings_path), None
+
+
+def save_state(state_path, state, pending=None):
+    if pending is not None:
+        state = dict(state, pending=pending)
+    write_atomic(state_path, lambda p: write_json(p, state))
+
+
+def update_factors(new_ratings, export_dir, position, **sgd_params):
+    algorithm = 'SVD'
+    if is_export(export_dir):
+        with open(os.path.join(export_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get('ratings') == position:
+            print("Factors already include these ratings.")
+            return
+        factors = LatentFactors.load(export_dir, mmap_mode=None)
+        algorithm = manifest['algorithm']
+    else:
+        # First update: start from SVD.pkl.
+        factors = registry.get('latent_factors')
+    updated = sgd_update(factors, new_ratings['userId'].values,
+                         new_ratings['movieId'].values,
+                         new_ratings['rating'].values, **sgd_params)
+    print(f"Factors updated: {len(updated.user_ids) - len(factors.user_ids)} "
+          f"new users, {len(updated.item_ids) - len(factors.item_ids)} new "
+          f"movies. Saving to: {export_dir}")
+    updated.save(export_dir, algorithm=algorithm, ratings=position)
+    if os.path.exists(registry.model_path('factor_ann.npz')):
+        print("factor_ann.npz was built for the previous factors and is no "
+              "longer used; rebuild it with build_ann_index.py.")
+
+
+def update_neighbours(new_ratings, ratings_path, index_path, position,
+                      similarity):
+    index = ItemNeighbours.load(index_path)
+    if index.ratings == position:
+        print("Neighbours already include these ratings.")
+        return
+    # A movie rated again by the same user counts with its latest rating.
+    ratings = RatingStore.from_csv(ratings_path).to_frame()
+    index = update_item_neighbours(index, ratings['userId'].values,
+                                   ratings['movieId'].values,
+                                   ratings['rating'].values,
+                                   new_ratings['movieId'].unique(),
+                                   similarity=similarity)
+    index['ratings'] = position
+    print(f"Neighbours of {new_ratings['movieId'].nunique()} movies "
+          f"updated. Saving to: {index_path}")
+    save_item_neighbours(index_path, index)
+
+
+def update_models(ratings_path, state_path, similarity='pearson',
+                  **sgd_params):
+    stream, pending = load_state(state_path, ratings_path)
+    start = stream.state
+    # A batch left pending by a failed run is read again as it was.
+    new_ratings = stream.read(end=pending)
+    if len(new_ratings):
+        print(f"{len(new_ratings)} new ratings.")
+        if pending is None:
+            save_state(state_path, start, pending=stream.offset)
+        # Models stamped with this position already include the batch.
+        position = stream.state
+        update_factors(new_ratings, registry.model_path('svd_factors'),
+                       position, **sgd_params)
+        # The aggregates keep their own position in the ratings file.
+        load_rating_aggregates(ratings_path,
+                               registry.model_path('rating_aggregates.npz'),
+                               save=True)
+        index_path = registry.model_path('item_neighbours.npz')
+        if os.path.exists(index_path):
+            update_neighbours(new_ratings, ratings_path, index_path,
+                              position, similarity)
+    # Recorded last, and only when it moved: if an update fails, its
+    # ratings are read again.
+    if stream.state != start or pending is not None or not os.path.exists(
+            state_path):
+        save_state(state_path, stream.state)
+    return len(new_ratings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--ratings', default=registry.data_path('ratings.csv'))
+    parser.add_argument('--state', default=registry.UPDATES_STATE)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--lr', type=float, default=0.005)
+    parser.add_argument('--reg', type=float, default=0.02)
+    parser.add_argument('--similarity', choices=['pearson', 'cosine'],
+                        default='pearson',
+                        help='Similarity the neighbour index was built with.')
+    parser.add_argument('--follow', action='store_true',
+                        help='Keep polling the ratings file for new lines.')
+    parser.add_argument('--interval', type=float, default=30.0,
+                        help='Seconds between polls with --follow.')
+    args = parser.parse_args()
+    while True:
+        start = time.perf_counter()
+        if update_models(args.ratings, args.state, args.similarity,
+                         n_epochs=args.epochs, lr=args.lr, reg=args.reg):
+            print(f"Done in {time.perf_counter() - start:.1f}s.")
+        if not args.follow:
+            break
+        time.sleep(args.interval)
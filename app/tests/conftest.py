@@ -0,0 +1,45 @@
+"""
+
+    Shared pytest fixtures.
+
+    Author: Explore Data Science Academy.
+
+    Description: Puts the app folder on the import path, as the app and
+    the scripts in resources/models do, and lets tests serve small
+    in-memory datasets and models through `utils.registry`.
+
+"""
+# Test dependencies
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, APP_DIR)
+
+from utils import registry
+
+
+@pytest.fixture
+def resources():
+    """Register in-memory resources: `resources(name=value, ...)`.
+
+    The registry's own loaders and loaded resources are restored after
+    the test.
+    """
+    loaders = dict(registry._loaders)
+    files = dict(registry._files)
+    registry.reset()
+
+    def provide(**values):
+        for name, value in values.items():
+            registry.register(name, lambda value=value: value)
+        registry.reset(*values)
+
+    yield provide
+    registry._loaders.clear()
+    registry._loaders.update(loaders)
+    registry._files.clear()
+    registry._files.update(files)
+    registry.reset()
@@ -0,0 +1,51 @@
+# Test dependencies
+import numpy as np
+
+from recommenders.ann import IVFIndex, recall_at_k, tune_nprobe
+
+
+def test_tuned_nprobe_reaches_target_recall():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(2000, 16)).astype(np.float32)
+    index = IVFIndex.build(vectors, np.arange(2000) * 3 + 1, n_lists=40)
+    queries = rng.normal(size=(50, 16))
+    recalls = tune_nprobe(index, queries, target_recall=0.95)
+    assert recalls[index.nprobe] >= 0.95
+    assert recall_at_k(index, queries, 10) >= 0.95
+
+
+def test_search_with_every_list_is_exact():
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(500, 8)).astype(np.float32)
+    index = IVFIndex.build(vectors, np.arange(500), n_lists=10)
+    for query in rng.normal(size=(20, 8)):
+        approx, _ = index.search(query, 10, nprobe=10)
+        exact, _ = index.exact_search(query, 10)
+        assert approx == exact
+
+
+def test_index_of_earlier_factors_is_not_used(tmp_path, monkeypatch,
+                                              resources):
+    from recommenders.ann import factor_vectors
+    from recommenders.factors import LatentFactors
+    from utils import registry
+
+    rng = np.random.default_rng(2)
+    factors = LatentFactors(rng.normal(size=(30, 4)), rng.normal(size=(60, 4)),
+                            np.zeros(30), np.zeros(60), 3.5, np.arange(30),
+                            np.arange(60))
+    export = str(tmp_path / 'svd_factors')
+    factors.save(export)
+    factors = LatentFactors.load(export)
+    index = IVFIndex.build(factor_vectors(factors), factors.item_ids,
+                           n_lists=4)
+    index.version = factors.version
+    monkeypatch.setattr(registry, 'MODELS_DIR', str(tmp_path))
+    index.save(registry.model_path('factor_ann.npz'))
+
+    resources(latent_factors=factors)
+    assert registry.get('factor_ann').version == factors.version
+    # Same users and movies, new values: only the version tells them apart.
+    factors.save(export)
+    resources(latent_factors=LatentFactors.load(export))
+    assert registry.get('factor_ann') is None
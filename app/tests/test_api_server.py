@@ -0,0 +1,85 @@
+# Test dependencies
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import api_server
+from utils.movie_index import MovieIndex
+
+
+class BrokenPool:
+    def submit(self, *args, **kwargs):
+        raise BrokenExecutor('a worker died')
+
+
+def test_batcher_survives_a_broken_pool(monkeypatch):
+    monkeypatch.setattr(api_server, '_recommend_batch',
+                        lambda algorithm, movie_lists, top_n: (
+                            [movies[:top_n] for movies in movie_lists], {}))
+    failed = []
+
+    def replace(pool, error):
+        failed.append(error)
+        batcher.pool = ThreadPoolExecutor(1)
+
+    batcher = api_server.MicroBatcher(BrokenPool(), 'collab', max_wait=0.0,
+                                      on_error=replace)
+    with pytest.raises(BrokenExecutor):
+        batcher.submit(['A'], 1).result(timeout=5)
+    assert batcher.submit(['A', 'B'], 1).result(timeout=5) == ['A']
+    assert len(failed) == 1
+
+
+class StubService:
+    def __init__(self, error):
+        self.error = error
+
+    def recommend(self, algorithm, movies, top_n=10):
+        api_server.RecommenderService._check(self, algorithm, [], top_n)
+        raise self.error
+
+
+@pytest.mark.parametrize('algorithm, error, status', [
+    ('nope', None, 404),
+    ('collab', api_server.BadRequest('bad'), 400),
+    ('collab', KeyError('rating_store'), 500),
+    ('collab', ValueError('shapes do not match'), 500),
+])
+def test_only_client_errors_are_4xx(algorithm, error, status):
+    api_server.RequestHandler.service = StubService(error)
+    server = api_server.RecommendationServer(('127.0.0.1', 0),
+                                             api_server.RequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{server.server_port}/recommend/{algorithm}',
+            data=json.dumps({'movies': ['A']}).encode())
+        with pytest.raises(urllib.error.HTTPError) as raised:
+            urllib.request.urlopen(request, timeout=5)
+        assert raised.value.code == status
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('movies, top_n', [
+    ([['Toy Story (1995)']], 10),
+    ([{'title': 'Toy Story (1995)'}], 10),
+    (['Toy Story (1995)', 3], 10),
+    ('Toy Story (1995)', 10),
+    (['Toy Story (1995)'], True),
+    (['Toy Story (1995)'], 2.0),
+])
+def test_malformed_requests_are_bad_requests(movies, top_n, resources):
+    resources(movie_index=MovieIndex(pd.DataFrame(
+        {'movieId': [1], 'title': ['Toy Story (1995)'],
+         'genres': ['Animation']})))
+    service = api_server.RecommenderService.__new__(
+        api_server.RecommenderService)
+    with pytest.raises(api_server.BadRequest):
+        service._check('collab', [movies], top_n)
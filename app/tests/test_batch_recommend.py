@@ -0,0 +1,41 @@
+# Test dependencies
+import json
+
+import pytest
+
+from batch_recommend import part_path, prepare_output
+
+MANIFEST = {'model': 'collab', 'top_n': 10, 'chunk_size': 100,
+            'input': 'abc', 'version': '123'}
+
+
+def test_parts_of_the_same_run_are_kept(tmp_path):
+    prepare_output(str(tmp_path), MANIFEST)
+    with open(part_path(str(tmp_path), 0), 'w') as f:
+        f.write('{}\n')
+    prepare_output(str(tmp_path), dict(MANIFEST))
+    assert (tmp_path / 'part-00000.jsonl').exists()
+    assert json.loads((tmp_path / 'manifest.json').read_text()) == MANIFEST
+
+
+@pytest.mark.parametrize('key, value', [('model', 'content'), ('top_n', 5),
+                                        ('chunk_size', 50), ('input', 'abd'),
+                                        ('version', '124')])
+def test_parts_of_another_run_are_refused_or_replaced(tmp_path, key, value):
+    prepare_output(str(tmp_path), MANIFEST)
+    with open(part_path(str(tmp_path), 0), 'w') as f:
+        f.write('{}\n')
+    other = dict(MANIFEST, **{key: value})
+    with pytest.raises(SystemExit, match=key):
+        prepare_output(str(tmp_path), other)
+    assert (tmp_path / 'part-00000.jsonl').exists()
+    prepare_output(str(tmp_path), other, restart=True)
+    assert not (tmp_path / 'part-00000.jsonl').exists()
+    assert json.loads((tmp_path / 'manifest.json').read_text()) == other
+
+
+def test_parts_without_a_manifest_are_refused(tmp_path):
+    with open(part_path(str(tmp_path), 0), 'w') as f:
+        f.write('{}\n')
+    with pytest.raises(SystemExit):
+        prepare_output(str(tmp_path), MANIFEST)
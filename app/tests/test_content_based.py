@@ -0,0 +1,40 @@
+# Test dependencies
+import numpy as np
+import pandas as pd
+
+from recommenders.content_based import MIN_RATINGS, content_model
+from utils.rating_aggregates import RatingAggregates
+
+GENRES = ['Action', 'Comedy', 'Drama', 'Horror', 'Romance']
+
+
+def _catalogue(n_movies=400, seed=0):
+    rng = np.random.default_rng(seed)
+    movie_ids = np.arange(1, n_movies + 1) * 2
+    # Few genre sets, so many movies share each one.
+    genres = ['|'.join(rng.choice(GENRES, rng.integers(1, 3), replace=False))
+              for _ in range(n_movies)]
+    movies = pd.DataFrame({'movieId': movie_ids, 'genres': genres,
+                           'title': [f'Movie {i}' for i in movie_ids]})
+    rated = rng.choice(movie_ids, 6000)
+    ratings = rng.integers(1, 11, len(rated)) / 2
+    return movies, RatingAggregates.from_ratings(rated, ratings)
+
+
+def test_genre_path_matches_exhaustive_ranking(resources):
+    movies, aggregates = _catalogue()
+    resources(movies=movies, rating_aggregates=aggregates, tfidf_index=None,
+              result_cache=None)
+    weighted = aggregates.weighted_mean(movies['movieId'].values)
+    counts = aggregates.count(movies['movieId'].values)
+    genre_sets = movies['genres'].str.split('|').apply(set)
+    for favourites in ([0, 1, 2], [5, 17, 300], [42, 42, 99]):
+        query = set().union(*genre_sets.iloc[favourites])
+        overlap = genre_sets.apply(lambda g: len(g & query)).values
+        eligible = ((counts >= MIN_RATINGS) & (overlap > 0)
+                    & ~np.isin(np.arange(len(movies)), favourites))
+        rows = np.flatnonzero(eligible)
+        order = np.lexsort((rows, -weighted[rows], -overlap[rows]))
+        expected = movies['title'].values[rows[order[:10]]].tolist()
+        titles = movies['title'].values[favourites].tolist()
+        assert content_model(titles, 10) == expected
@@ -0,0 +1,39 @@
+# Test dependencies
+import threading
+
+import numpy as np
+
+from recommenders.factors import LatentFactors
+
+
+def _factors(value, n_users=50, n_items=80):
+    return LatentFactors(np.full((n_users, 8), value),
+                         np.full((n_items, 8), value), np.full(n_users, value),
+                         np.full(n_items, value), 3.5, np.arange(n_users),
+                         np.arange(n_items))
+
+
+def test_load_during_re_exports_sees_whole_exports(tmp_path):
+    export = str(tmp_path / 'svd_factors')
+    _factors(0.0).save(export)
+    stop = threading.Event()
+
+    def re_export():
+        value = 0.0
+        while not stop.is_set():
+            value += 1.0
+            _factors(value).save(export)
+            stop.wait(0.001)
+
+    writer = threading.Thread(target=re_export)
+    writer.start()
+    try:
+        for _ in range(200):
+            factors = LatentFactors.load(export)
+            value = factors.pu[0, 0]
+            # Mapped arrays stay readable after their files are removed.
+            for array in (factors.pu, factors.qi, factors.bu, factors.bi):
+                assert (np.asarray(array) == value).all()
+    finally:
+        stop.set()
+        writer.join()
@@ -0,0 +1,103 @@
+# Test dependencies
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from recommenders.factors import LatentFactors
+from recommenders.incremental import RatingStream, sgd_update
+
+HEADER = 'userId,movieId,rating,timestamp\n'
+
+
+def _ratings(path, n):
+    path.write_text(HEADER + ''.join(f'{u},{10 + u % 7},{1 + u % 5}.0,{u}\n'
+                                     for u in range(n)))
+
+
+def test_stream_reads_appended_lines(tmp_path):
+    path = tmp_path / 'ratings.csv'
+    _ratings(path, 100)
+    stream = RatingStream.from_end(path)
+    with open(path, 'a') as f:
+        f.write('500,10,4.5,1\n501,11,3.0')
+    assert stream.read()['userId'].tolist() == [500]
+    with open(path, 'a') as f:
+        f.write(',2\n')
+    resumed = RatingStream(**stream.state)
+    assert resumed.read()['userId'].tolist() == [501]
+    assert resumed.read().empty
+
+
+@pytest.mark.parametrize('rewrite', [
+    lambda text: text.replace('timestamp', 'Timestamp'),
+    lambda text: text.replace('\n40,', '\n41,'),
+    lambda text: text.replace('\n98,', '\n9,'),
+])
+def test_stream_detects_earlier_edits(tmp_path, rewrite):
+    path = tmp_path / 'ratings.csv'
+    _ratings(path, 100)
+    stream = RatingStream.from_end(path)
+    with open(path, 'r+') as f:
+        text = rewrite(f.read())
+        f.seek(0)
+        f.write(text + '600,10,5.0,3\n')
+    with pytest.raises(ValueError, match='rewritten'):
+        stream.read()
+
+
+def test_stream_detects_a_replaced_file(tmp_path):
+    path = tmp_path / 'ratings.csv'
+    _ratings(path, 100)
+    stream = RatingStream.from_end(path)
+    shutil.copy(path, tmp_path / 'copy.csv')
+    os.replace(tmp_path / 'copy.csv', path)
+    with pytest.raises(ValueError, match='rewritten'):
+        stream.read()
+
+
+def test_sgd_update_adds_new_users_and_movies():
+    rng = np.random.default_rng(0)
+    factors = LatentFactors(rng.normal(0, 0.1, (10, 4)),
+                            rng.normal(0, 0.1, (20, 4)), np.zeros(10),
+                            np.zeros(20), 3.5, np.arange(10), np.arange(20))
+    # User 100 and movie 50 are new; user 1 and movie 5 are known.
+    users, items = np.array([100, 100, 1, 1]), np.array([5, 50, 50, 5])
+    ratings = np.array([5.0, 4.5, 1.0, 2.0])
+    updated = sgd_update(factors, users, items, ratings, n_epochs=50, lr=0.05)
+
+    np.testing.assert_array_equal(updated.user_ids, list(range(10)) + [100])
+    np.testing.assert_array_equal(updated.item_ids, list(range(20)) + [50])
+    assert len(factors.user_ids) == 10 and len(factors.item_ids) == 20
+    # Users and movies without new ratings keep their factors.
+    others = np.setdiff1d(np.arange(10), [1])
+    np.testing.assert_array_equal(updated.pu[others], factors.pu[others])
+    np.testing.assert_array_equal(updated.qi[:5], factors.qi[:5])
+    # The estimates moved toward the new ratings.
+    before = np.abs(factors.score(users, items) - ratings)
+    after = np.abs(updated.score(users, items) - ratings)
+    assert (after < before).all()
+
+
+def test_sgd_update_needs_a_rating_model():
+    factors = LatentFactors(np.zeros((1, 2)), np.zeros((1, 2)), np.zeros(1),
+                            np.zeros(1), 0.0, [1], [1], rating_scale=None)
+    with pytest.raises(ValueError):
+        sgd_update(factors, [1], [1], [1.0])
+
+
+def test_sgd_update_averages_repeated_movies_in_a_batch():
+    rng = np.random.default_rng(1)
+    factors = LatentFactors(rng.normal(0, 0.1, (10, 4)),
+                            rng.normal(0, 0.1, (20, 4)), np.zeros(10),
+                            np.zeros(20), 3.0, np.arange(10), np.arange(20))
+    # A burst of 1000 ratings of one movie, within one mini-batch.
+    users = np.arange(1000) + 100
+    ratings = np.full(1000, 5.0)
+    updated = sgd_update(factors, users, np.zeros(1000, int), ratings,
+                         n_epochs=20, lr=0.05)
+    assert np.isfinite(updated.bi).all() and np.isfinite(updated.qi).all()
+    # One step per epoch: toward the ratings, without overshooting them.
+    assert 0 < updated.bi[0] < 2.0
+    np.testing.assert_array_equal(updated.bi[1:], 0.0)
@@ -0,0 +1,29 @@
+# Test dependencies
+import pandas as pd
+
+from utils import insights, registry
+
+
+def test_appended_rows_are_counted_like_a_rebuild(tmp_path, monkeypatch):
+    data = tmp_path / 'data'
+    data.mkdir()
+    monkeypatch.setattr(registry, 'DATA_DIR', str(data))
+    monkeypatch.setattr(registry, 'CACHE_DIR', str(tmp_path / 'cache'))
+    tags = data / 'tags.csv'
+    tags.write_text('userId,movieId,tag,timestamp\n'
+                    '1,10,funny,100\n2,10,1984,101\n')
+    directory = str(tmp_path / 'insights')
+    assert insights.refresh_insights(['tags'], directory) == {'tags': 'rebuilt'}
+
+    with open(tags, 'a') as f:
+        f.write('3,11,1984,102\n4,12,NA,103\n')
+    offset = insights._read_manifest(directory)['tags']['offset']
+    rows, _ = insights._read_appended(str(tags), offset,
+                                      registry.DTYPES['tags'])
+    assert rows['userId'].dtype == 'int32'
+    assert insights.refresh_insights(['tags'], directory) == {'tags': 'appended'}
+    appended = insights.load_insight('tags', directory=directory)
+
+    insights.refresh_insights(['tags'], str(tmp_path / 'rebuilt'))
+    rebuilt = insights.load_insight('tags', directory=str(tmp_path / 'rebuilt'))
+    pd.testing.assert_frame_equal(appended, rebuilt)
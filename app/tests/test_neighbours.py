@@ -0,0 +1,63 @@
+# Test dependencies
+import numpy as np
+
+from recommenders.neighbours import (ItemNeighbours, _item_matrix,
+                                     build_item_neighbours,
+                                     update_item_neighbours)
+
+K = 20
+
+
+def _ratings(seed, n_users=300, n_items=200, n=6000):
+    rng = np.random.default_rng(seed)
+    users = rng.integers(0, n_users, n)
+    items = rng.integers(0, n_items, n)
+    ratings = rng.integers(1, 11, n) / 2.0
+    once = np.unique(users * n_items + items, return_index=True)[1]
+    return users[once], items[once], ratings[once]
+
+
+def test_update_matches_a_full_rebuild():
+    users, items, ratings = _ratings(0)
+    rng = np.random.default_rng(1)
+    # New users rating known movies and a few movies never rated before.
+    new_users = rng.integers(300, 330, 200)
+    new_items = rng.integers(0, 220, 200)
+    new_ratings = rng.integers(1, 11, 200) / 2.0
+    all_users = np.concatenate([users, new_users])
+    all_items = np.concatenate([items, new_items])
+    all_ratings = np.concatenate([ratings, new_ratings])
+
+    index = build_item_neighbours(users, items, ratings, k=K)
+    updated = update_item_neighbours(index, all_users, all_items, all_ratings,
+                                     new_items)
+    rebuilt = build_item_neighbours(all_users, all_items, all_ratings, k=K)
+    np.testing.assert_array_equal(updated['item_ids'], rebuilt['item_ids'])
+
+    # Lists of the movies with new ratings are recomputed in full.
+    touched = np.searchsorted(rebuilt['item_ids'], np.unique(new_items))
+    np.testing.assert_allclose(updated['similarities'][touched],
+                               rebuilt['similarities'][touched], atol=1e-6)
+    # Every stored similarity is the current one.
+    _, X, Xt = _item_matrix(all_users, all_items, all_ratings, 'pearson')
+    similarity = (Xt @ X).toarray()
+    rows = np.arange(len(updated['item_ids']))[:, None]
+    np.testing.assert_allclose(
+        updated['similarities'],
+        similarity[rows, updated['neighbours']], atol=1e-6)
+    # Other lists only miss movies pushed out before the update.
+    overlap = np.mean([len(set(a) & set(b)) / K for a, b in
+                       zip(updated['neighbours'], rebuilt['neighbours'])])
+    assert overlap > 0.95
+
+
+def test_movies_without_similar_movies_get_no_recommendations():
+    # Movie 30 has a single rating: its centred column is all zeros.
+    users = np.array([1, 2, 3, 1, 2, 3, 1])
+    items = np.array([10, 10, 10, 20, 20, 20, 30])
+    ratings = np.array([5.0, 3.0, 1.0, 4.0, 3.0, 2.0, 4.0])
+    index = ItemNeighbours(**build_item_neighbours(users, items, ratings, k=2))
+    assert index.recommend([30]) == []
+    assert index.recommend_many([[30], [10]]) == [[], [20]]
+    assert index.recommend([10]) == [20]
+    assert len(index.scores([30])[0]) == 0
@@ -0,0 +1,34 @@
+# Test dependencies
+import numpy as np
+
+from utils.rating_aggregates import RatingAggregates, load_rating_aggregates
+from utils.rating_store import RatingStore
+
+
+def _means(store, movie_ids):
+    return np.array([store.item_ratings(m)[1].mean() for m in movie_ids])
+
+
+def test_re_ratings_replace_earlier_ratings(tmp_path):
+    ratings = tmp_path / 'ratings.csv'
+    ratings.write_text('userId,movieId,rating,timestamp\n'
+                       '1,10,3.0,100\n2,10,5.0,101\n1,11,2.0,102\n'
+                       '1,10,4.0,103\n')
+    cache = str(tmp_path / 'rating_aggregates.npz')
+    aggregates = load_rating_aggregates(str(ratings), cache, save=True)
+    np.testing.assert_array_equal(aggregates.count([10, 11]), [2, 1])
+
+    # Re-ratings in the appended lines, one of them twice.
+    with open(ratings, 'a') as f:
+        f.write('2,10,1.0,104\n3,11,4.0,105\n1,11,5.0,106\n1,11,3.0,107\n')
+    refreshed = load_rating_aggregates(str(ratings), cache, save=True)
+    store = RatingStore.from_csv(ratings)
+    np.testing.assert_array_equal(refreshed.count([10, 11]), [2, 2])
+    np.testing.assert_allclose(refreshed.mean([10, 11]),
+                               _means(store, [10, 11]))
+    rebuilt = RatingAggregates.from_csv(str(ratings))
+    np.testing.assert_array_equal(refreshed.counts, rebuilt.counts)
+    np.testing.assert_allclose(refreshed.sums, rebuilt.sums)
+
+    # Without appended lines the pairs are not read at all.
+    assert load_rating_aggregates(str(ratings), cache).latest is None
@@ -0,0 +1,18 @@
+# Test dependencies
+import numpy as np
+
+from utils.rating_store import RatingStore
+
+
+def test_rerated_movies_keep_the_last_rating(tmp_path):
+    path = tmp_path / 'ratings.csv'
+    path.write_text('userId,movieId,rating,timestamp\n'
+                    '1,10,3.0,100\n2,10,5.0,101\n1,11,2.0,102\n'
+                    '1,10,4.0,103\n')
+    store = RatingStore.from_csv(path)
+    assert store.n_ratings == 3
+    movie_ids, ratings = store.user_ratings(1)
+    np.testing.assert_array_equal(movie_ids, [10, 11])
+    np.testing.assert_array_equal(ratings, [4.0, 2.0])
+    frame = store.to_frame()
+    assert frame['rating'].sum() == 11.0
@@ -0,0 +1,52 @@
+# Test dependencies
+import json
+
+from recommenders.incremental import RatingStream
+from utils import registry
+
+
+def use_folder(tmp_path, monkeypatch):
+    (tmp_path / 'data').mkdir()
+    monkeypatch.setattr(registry, 'DATA_DIR', str(tmp_path / 'data'))
+    monkeypatch.setattr(registry, 'MODELS_DIR', str(tmp_path))
+    monkeypatch.setattr(registry, 'UPDATES_STATE', str(tmp_path / 'u.json'))
+    monkeypatch.setattr(registry, 'VERSION_INTERVAL', 0.0)
+
+
+def test_only_resources_read_from_changed_files_are_reloaded(
+        tmp_path, monkeypatch, resources):
+    use_folder(tmp_path, monkeypatch)
+    index, movies = tmp_path / 'index.txt', tmp_path / 'data' / 'movies.txt'
+    index.write_text('old')
+    movies.write_text('movies')
+    registry.register('index', lambda: index.read_text(),
+                      files=lambda: [str(index)])
+    registry.register('movie_list', lambda: movies.read_text(),
+                      files=lambda: [registry.DATA_DIR])
+    registry.register('ranked', lambda: registry.get('index').upper())
+    resources()
+
+    assert registry.get('ranked') == 'OLD'
+    movie_list = registry.get('movie_list')
+    index.write_text('newer')
+    registry.reload_if_changed()
+    assert not registry.is_loaded('index')
+    assert not registry.is_loaded('ranked')
+    assert registry.get('movie_list') is movie_list
+    assert registry.get('ranked') == 'NEWER'
+
+
+def test_appended_ratings_count_once_applied(tmp_path, monkeypatch):
+    use_folder(tmp_path, monkeypatch)
+    ratings = tmp_path / 'data' / 'ratings.csv'
+    ratings.write_text('userId,movieId,rating,timestamp\n1,1,4.0,0\n')
+    stream = RatingStream.from_end(str(ratings))
+    (tmp_path / 'u.json').write_text(json.dumps(stream.state))
+    before = registry.version()
+
+    with open(ratings, 'a') as f:
+        f.write('2,1,3.0,0\n')
+    assert registry.version() == before
+    stream.read()
+    (tmp_path / 'u.json').write_text(json.dumps(stream.state))
+    assert registry.version() != before
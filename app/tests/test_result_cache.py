@@ -0,0 +1,31 @@
+# Test dependencies
+import pandas as pd
+
+from utils import registry
+from utils.movie_index import MovieIndex
+from utils.result_cache import MemoryBackend, ResultCache, cached
+
+
+def test_changed_files_are_reloaded_before_results_are_cached(
+        tmp_path, monkeypatch, resources):
+    monkeypatch.setattr(registry, 'DATA_DIR', str(tmp_path / 'data'))
+    monkeypatch.setattr(registry, 'MODELS_DIR', str(tmp_path))
+    monkeypatch.setattr(registry, 'VERSION_INTERVAL', 0.0)
+    model = tmp_path / 'model.txt'
+    model.write_text('old')
+    movies = pd.DataFrame({'movieId': [1, 2], 'title': ['A', 'B'],
+                           'genres': ['Drama', 'Comedy']})
+    resources(movie_index=MovieIndex(movies),
+              result_cache=ResultCache(MemoryBackend()))
+    registry.register('model', lambda: model.read_text(),
+                      files=lambda: [str(model)])
+
+    @cached('test')
+    def recommend(movie_list, top_n=10):
+        return [registry.get('model')]
+
+    assert recommend(['A']) == ['old']
+    model.write_text('newer')
+    assert recommend(['A']) == ['newer']
+    assert recommend(['A']) == ['newer']
+    assert registry.get('result_cache').hits == 1
@@ -0,0 +1,42 @@
+# Test dependencies
+import numpy as np
+import pandas as pd
+
+from recommenders.tfidf import TfidfIndex, build_tfidf, field_terms
+
+GENRES = ['Comedy', 'Comedy|Romance', 'Horror', 'Horror|Thriller', 'Drama']
+
+
+def _index(n_per_genre=20):
+    movie_ids = np.arange(len(GENRES) * n_per_genre)
+    genres = pd.Series(np.repeat(GENRES, n_per_genre))
+    return build_tfidf(movie_ids, field_terms(movie_ids, genres, 'genre'))
+
+
+def test_equal_similarities_are_ordered_by_rating():
+    index = _index()
+    rating = np.random.default_rng(0).uniform(1, 5, len(index.item_ids))
+    comedy = index.recommend([0], 5, tie_break=rating)
+    horror = index.recommend([40], 5, tie_break=rating)
+    assert not set(comedy) & set(horror)
+    # Other comedies match exactly and come first, best rated first.
+    comedies = np.arange(1, 20)
+    expected = comedies[np.argsort(-rating[comedies], kind='stable')][:5]
+    assert comedy == expected.tolist()
+    assert index.recommend_many([[0], [40]], 5, tie_break=rating) == [
+        comedy, horror]
+
+
+def test_stop_words_are_left_out_of_tags():
+    terms = field_terms([1, 2, 3, 4], pd.Series(['The', 'a', 'dark', None]),
+                        'tag', stopwords={'the'})
+    assert terms['term'].tolist() == ['tag:dark']
+
+
+def test_save_replaces_the_index(tmp_path):
+    path = str(tmp_path / 'tfidf_index.npz')
+    index = _index()
+    index.save(path)
+    loaded = TfidfIndex.load(path)
+    assert (loaded.matrix != index.matrix).nnz == 0
+    assert [p.name for p in tmp_path.iterdir()] == ['tfidf_index.npz']
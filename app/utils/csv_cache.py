@@ -0,0 +1,127 @@
+"""
+
+    Columnar binary cache for the CSV resources.
+
+    Author: Explore Data Science Academy.
+
+    Description: The first time a CSV resource is read it is parsed with
+    compact dtypes (int32 IDs, float32 ratings, categorical genres) and
+    written to a binary copy: Parquet when `pyarrow` is installed, a
+    pandas pickle otherwise. Later reads load the binary copy for as long
+    as the source file is unchanged, which skips CSV parsing on cold starts.
+
+"""
+# Data handling dependencies
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    CACHE_FORMAT = 'parquet'
+except ImportError:
+    CACHE_FORMAT = 'pickle'
+
+from utils.files import write_atomic, write_json
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-1 of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_signature(path, validate='mtime'):
+    """What the cache of `path` must match to still be valid.
+
+    Parameters
+    ----------
+    path : str
+        Source CSV file.
+    validate : str
+        'mtime' compares modification time and size; 'hash' compares
+        size and the SHA-1 of the contents instead, which survives copies
+        that reset the modification time.
+
+    """
+    stat = os.stat(path)
+    signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if validate == 'hash':
+        signature = {'size': stat.st_size, 'sha1': file_digest(path)}
+    return signature
+
+
+def _cache_paths(path, cache_dir):
+    name = os.path.splitext(os.path.basename(path))[0]
+    extension = 'parquet' if CACHE_FORMAT == 'parquet' else 'pkl'
+    return (os.path.join(cache_dir, f'{name}.{extension}'),
+            os.path.join(cache_dir, f'{name}.json'))
+
+
+def downcast(df, dtype=None):
+    """Apply `dtype` and shrink any remaining numeric columns."""
+    if dtype:
+        df = df.astype({c: t for c, t in dtype.items() if c in df.columns})
+    for column in df.columns:
+        if column in (dtype or {}):
+            continue
+        if pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast='float')
+    return df
+
+
+def read_csv_cached(path, dtype=None, cache_dir=None, validate='mtime'):
+    """Read a CSV file through its binary cache.
+
+    Parameters
+    ----------
+    path : str
+        Source CSV file.
+    dtype : dict, optional
+        Column dtypes, as for `pd.read_csv`; 'category' is allowed.
+    cache_dir : str, optional
+        Folder for the binary copies; defaults to a `cache` folder next to
+        the source file.
+    validate : str
+        How to check the cache against the source, see `source_signature`.
+
+    Returns
+    -------
+    Pandas Dataframe
+        The file's contents with compact dtypes.
+
+    """
+    cache_dir = cache_dir or os.path.join(os.path.dirname(path), 'cache')
+    data_path, meta_path = _cache_paths(path, cache_dir)
+    signature = source_signature(path, validate)
+    expected = {'source': signature, 'format': CACHE_FORMAT,
+                'dtype': {c: str(t) for c, t in (dtype or {}).items()}}
+
+    if os.path.exists(data_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == expected:
+                if CACHE_FORMAT == 'parquet':
+                    return pd.read_parquet(data_path)
+                return pd.read_pickle(data_path)
+
+    parse_dtype = {c: t for c, t in (dtype or {}).items() if t != 'category'}
+    df = pd.read_csv(path, dtype=parse_dtype or None)
+    df = downcast(df, dtype)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        if CACHE_FORMAT == 'parquet':
+            write_atomic(data_path, lambda p: df.to_parquet(p, index=False))
+        else:
+            write_atomic(data_path, lambda p: df.to_pickle(p))
+        write_atomic(meta_path, lambda p: write_json(p, expected))
+    except OSError:
+        # A read-only deployment still works, it just parses every time.
+        pass
+    return df
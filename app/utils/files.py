@@ -0,0 +1,85 @@
+"""
+
+    File helpers.
+
+    Author: Explore Data Science Academy.
+
+    Description: Resources that running apps may read at any moment are
+    written to a temporary file next to their final path and moved into
+    place in one step, so a reader sees either the old or the new file.
+
+    Files that only grow, such as `ratings.csv`, are read incrementally:
+    `read_complete_lines` returns what was appended after a byte offset,
+    and `prefix_digest` tells whether the bytes before that offset are
+    still the ones read, or the file was rewritten.
+
+"""
+# Script dependencies
+import hashlib
+import json
+import os
+
+# Bytes hashed by `prefix_digest`: the start of the file, `SAMPLES` evenly
+# spaced blocks of `SAMPLE_BYTES`, and the block just before the offset.
+HEAD_BYTES = 4096
+SAMPLES = 16
+SAMPLE_BYTES = 256
+
+
+def write_atomic(path, write):
+    """Replace `path` in one step with what `write(tmp_path)` writes."""
+    tmp = f'{path}.tmp{os.getpid()}'
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def write_json(path, obj):
+    with open(path, 'w') as f:
+        json.dump(obj, f)
+
+
+def read_complete_lines(path, offset, end=None):
+    """Bytes of `path` from `offset` up to the last complete line.
+
+    Parameters
+    ----------
+    path : str
+        The file.
+    offset : int
+        Byte to start from.
+    end : int, optional
+        Byte to stop at; the end of the file by default.
+
+    Returns
+    -------
+    tuple (bytes, int)
+        The lines, and the offset just past them.
+
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        chunk = f.read(-1 if end is None else max(0, end - offset))
+    end = chunk.rfind(b'\n') + 1
+    return chunk[:end], offset + end
+
+
+def prefix_digest(path, offset):
+    """Digest of the first `offset` bytes of `path`, to detect rewrites.
+
+    It covers the file's inode, its first `HEAD_BYTES`, `SAMPLES` blocks
+    spread over the rest and the `SAMPLE_BYTES` before `offset`, so a
+    file replaced by another, a changed header or an edit that moves
+    later lines is caught without reading the whole file again. An edit
+    that keeps every line's length and misses the sampled blocks goes
+    unnoticed; rebuild from scratch after editing a file in place.
+    """
+    digest = hashlib.sha1(str(os.stat(path).st_ino).encode())
+    blocks = [(0, HEAD_BYTES)]
+    blocks += [(offset * n // (SAMPLES + 1), SAMPLE_BYTES)
+               for n in range(1, SAMPLES + 1)]
+    blocks.append((max(0, offset - SAMPLE_BYTES), SAMPLE_BYTES))
+    with open(path, 'rb') as f:
+        for start, size in blocks:
+            f.seek(start)
+            digest.update(f.read(max(0, min(size, offset - start))))
+    return digest.hexdigest()
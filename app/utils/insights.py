@@ -0,0 +1,276 @@
+"""
+
+    Precomputed aggregates for the Insights page.
+
+    Author: Explore Data Science Academy.
+
+    Description: The Insights plots only need small count tables (movies
+    per genre, per actor, per director, per plot keyword, and tag and
+    tag-word frequencies). They are computed offline with vectorized pandas string
+    operations, split, explode and value_counts, and saved as one CSV per
+    table under `resources/insights/`, sorted by count, so the app only
+    reads and plots them.
+
+    `refresh_insights` keeps the tables in step with their source CSVs:
+    an unchanged source is skipped, rows appended to a source are counted
+    and added to the saved counts, and a rewritten source is recounted
+    from scratch.
+
+    Rendered plots can be kept next to the tables with `cached_image`,
+    one PNG per plot and dataset version.
+
+"""
+# Data handling dependencies
+import io
+import json
+import os
+
+import pandas as pd
+
+try:
+    from wordcloud import STOPWORDS
+except ImportError:
+    STOPWORDS = frozenset()
+
+from utils import registry
+from utils.files import (prefix_digest, read_complete_lines, write_atomic,
+                         write_json)
+
+INSIGHTS_DIR = os.path.join(registry.RESOURCES_DIR, 'insights')
+MANIFEST = 'manifest.json'
+
+# Splits a column into lowercase words, as `WordCloud` does with text.
+WORDS = 'words'
+WORD_PATTERN = r"\w[\w']+"
+
+# Table name: (source dataset, column counted, separator of multiple values
+# or WORDS).
+TABLES = {
+    'genres': ('movies', 'genres', '|'),
+    'actors': ('imdb_data', 'title_cast', '|'),
+    'directors': ('imdb_data', 'director', None),
+    'plot_keywords': ('imdb_data', 'plot_keywords', '|'),
+    'tags': ('tags', 'tag', None),
+    'tag_words': ('tags', 'tag', WORDS),
+}
+
+
+def count_values(values, sep=None):
+    """Occurrences of each value in a column, most frequent first.
+
+    Parameters
+    ----------
+    values : Pandas Series
+        Column to count; missing values are ignored.
+    sep : str, optional
+        Separator of several values in one cell, e.g. '|' for genres, or
+        `WORDS` to count the words of free text (see `count_words`).
+
+    Returns
+    -------
+    Pandas Series
+        Count per value, indexed by value.
+
+    """
+    values = values.dropna().astype(str)
+    if sep == WORDS:
+        return count_words(values)
+    if sep:
+        values = values.str.split(sep, regex=False).explode()
+    return values.value_counts().rename_axis('value').rename('count')
+
+
+def count_words(values, stopwords=STOPWORDS):
+    """Occurrences of each word in a column of free text.
+
+    Words are lowercased, a trailing "'s" is dropped, and words of one
+    character or in `stopwords` (WordCloud's list when installed) are
+    left out.
+
+    Returns
+    -------
+    Pandas Series
+        Count per word, indexed by word, most frequent first.
+
+    """
+    words = values.str.lower().str.findall(WORD_PATTERN).explode().dropna()
+    words = words.str.replace(r"'s$", '', regex=True)
+    words = words[(words.str.len() > 1) & ~words.isin(list(stopwords))]
+    return words.value_counts().rename_axis('value').rename('count')
+
+
+def _table_path(directory, name):
+    return os.path.join(directory, f'{name}.csv')
+
+
+def _read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_table(directory, name, counts):
+    counts = counts[counts > 0].sort_values(ascending=False, kind='stable')
+    write_atomic(_table_path(directory, name),
+                  lambda p: counts.reset_index().to_csv(p, index=False))
+
+
+def _load_counts(directory, name):
+    table = pd.read_csv(_table_path(directory, name), dtype={'value': str},
+                        keep_default_na=False)
+    return table.set_index('value')['count']
+
+
+def _write_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _complete_size(path, block_size=1 << 16):
+    """Bytes of `path` up to the end of its last complete line."""
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+def _source_state(path, offset):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'offset': offset, 'digest': prefix_digest(path, offset)}
+
+
+def _read_appended(path, offset, dtype=None):
+    """Rows appended to a CSV file after byte `offset`, and the new offset.
+
+    The rows are parsed with `dtype`, as the whole file is by
+    `registry.read_csv`.
+    """
+    chunk, end = read_complete_lines(path, offset)
+    columns = pd.read_csv(path, nrows=0).columns
+    dtype = {c: t for c, t in (dtype or {}).items() if c in columns}
+    if not chunk.strip():
+        return pd.DataFrame(columns=columns).astype(dtype), end
+    return pd.read_csv(io.BytesIO(chunk), header=None, names=columns,
+                       dtype=dtype), end
+
+
+def refresh_insights(names=None, directory=INSIGHTS_DIR):
+    """Bring the Insights tables up to date with their sources.
+
+    Parameters
+    ----------
+    names : list (str), optional
+        Tables to refresh; all of `TABLES` by default.
+    directory : str
+        Folder of the tables.
+
+    Returns
+    -------
+    dict
+        What happened to each table: 'unchanged', 'appended' or 'rebuilt'.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = _read_manifest(directory)
+    appended_rows = {}
+    actions = {}
+    for name in names or list(TABLES):
+        dataset, column, sep = TABLES[name]
+        path = registry.data_path(f'{dataset}.csv')
+        state = manifest.get(name)
+        stat = os.stat(path)
+        saved = os.path.exists(_table_path(directory, name))
+
+        if (saved and state and state['size'] == stat.st_size
+                and state['mtime_ns'] == stat.st_mtime_ns):
+            actions[name] = 'unchanged'
+            continue
+        if (saved and state and stat.st_size >= state['offset']
+                and prefix_digest(path, state['offset']) == state['digest']):
+            # Only new rows at the end: count them and add them on.
+            if (dataset, state['offset']) not in appended_rows:
+                appended_rows[dataset, state['offset']] = _read_appended(
+                    path, state['offset'], registry.DTYPES.get(dataset))
+            rows, offset = appended_rows[dataset, state['offset']]
+            counts = _load_counts(directory, name).add(
+                count_values(rows[column], sep), fill_value=0).astype('int64')
+            actions[name] = 'appended'
+        else:
+            counts = count_values(registry.read_csv(dataset)[column], sep)
+            offset = _complete_size(path)
+            actions[name] = 'rebuilt'
+        _save_table(directory, name, counts)
+        manifest[name] = _source_state(path, offset)
+
+    write_atomic(os.path.join(directory, MANIFEST),
+                  lambda p: write_json(p, manifest))
+    return actions
+
+
+def load_insight(name, top=None, directory=INSIGHTS_DIR):
+    """An Insights table, most frequent values first.
+
+    The table is built first if the offline job has not produced it yet.
+
+    Parameters
+    ----------
+    name : str
+        One of `TABLES`.
+    top : int, optional
+        Number of rows to read; all of them by default.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Columns 'value' and 'count'.
+
+    """
+    path = _table_path(directory, name)
+    if not os.path.exists(path):
+        refresh_insights([name], directory)
+    return pd.read_csv(path, nrows=top, dtype={'value': str},
+                       keep_default_na=False)
+
+
+def cached_image(name, version, render, directory=INSIGHTS_DIR):
+    """PNG bytes of a plot, rendered once per dataset version.
+
+    The image is kept as `images/<name>-<version>.png` under `directory`,
+    so every worker and restart reuses it; images of older versions are
+    removed when a new one is written.
+
+    Parameters
+    ----------
+    name : str
+        Name of the plot.
+    version : str
+        Dataset version, e.g. `registry.version()`.
+    render : callable
+        Returns the PNG bytes when the image is not cached yet.
+
+    """
+    images = os.path.join(directory, 'images')
+    path = os.path.join(images, f'{name}-{version}.png')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    image = render()
+    try:
+        os.makedirs(images, exist_ok=True)
+        write_atomic(path, lambda p: _write_bytes(p, image))
+        for old in os.listdir(images):
+            if old.startswith(f'{name}-') and old != os.path.basename(path):
+                os.remove(os.path.join(images, old))
+    except OSError:
+        # Read-only deployments render every time.
+        pass
+    return image
@@ -0,0 +1,254 @@
+"""
+
+    Latency instrumentation and profiling hooks.
+
+    Author: Explore Data Science Academy.
+
+    Description: Recommenders mark their stages with `stage` blocks and
+    `timed` functions, and count events with `count`. Stage times are
+    kept in per-process histograms and counters, exported in the
+    Prometheus text format by `prometheus_text`. A request is the
+    outermost timed call; its stage breakdown can be logged as one JSON
+    line, and it can be captured with cProfile or tracemalloc.
+
+    Everything is off unless enabled by environment variables, and then
+    `timed` leaves functions undecorated and `stage` is an empty block:
+
+      - FLICK_METRICS=1: keep stage histograms and counters.
+      - FLICK_METRICS_LOG=1: also log each request to the
+        'flick.instrumentation' logger (stderr unless configured).
+      - FLICK_PROFILE=cprofile,tracemalloc: also capture each request;
+        cProfile stats are written to FLICK_PROFILE_DIR and the largest
+        tracemalloc allocations are added to the request log.
+
+"""
+# Script dependencies
+import bisect
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROFILE = {mode.strip() for mode in
+           os.environ.get('FLICK_PROFILE', '').split(',') if mode.strip()}
+LOG_REQUESTS = os.environ.get('FLICK_METRICS_LOG', '0') == '1'
+ENABLED = (os.environ.get('FLICK_METRICS', '0') == '1' or LOG_REQUESTS
+           or bool(PROFILE))
+PROFILE_DIR = os.environ.get('FLICK_PROFILE_DIR', os.path.join(
+    tempfile.gettempdir(), 'flick-profiles'))
+# Upper bounds, in seconds, of the stage histogram buckets.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger('flick.instrumentation')
+if LOG_REQUESTS and not logger.handlers and not logging.getLogger().handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+_lock = threading.Lock()
+_local = threading.local()
+_profiling = threading.Lock()
+_histograms = {}
+_counters = {}
+_null = contextlib.nullcontext()
+
+
+def _observe(name, seconds):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = [[0] * (len(BUCKETS) + 1), 0.0]
+        histogram[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[1] += seconds
+
+
+def count(name, value=1, **labels):
+    """Add `value` to the counter `name` with the given labels."""
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+@contextlib.contextmanager
+def _stage(name):
+    stages = getattr(_local, 'stages', None)
+    root = stages is None
+    if root:
+        stages = _local.stages = []
+        profile = _start_profile()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _observe(name, seconds)
+        stages.append((name, seconds))
+        if root:
+            _local.stages = None
+            _end_request(name, seconds, stages, error, profile)
+
+
+def stage(name):
+    """Time the enclosed block as stage `name`."""
+    return _stage(name) if ENABLED else _null
+
+
+def timed(name):
+    """Time each call of the decorated function as stage `name`."""
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _start_profile():
+    if not PROFILE or not _profiling.acquire(blocking=False):
+        # One capture at a time; concurrent requests are only timed.
+        return None
+    profile = {}
+    if 'tracemalloc' in PROFILE:
+        profile['tracing'] = tracemalloc.is_tracing()
+        if not profile['tracing']:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profile['snapshot'] = tracemalloc.take_snapshot()
+    if 'cprofile' in PROFILE:
+        profile['cprofile'] = cProfile.Profile()
+        profile['cprofile'].enable()
+    return profile
+
+
+def _stop_profile(name, profile, record):
+    try:
+        if 'cprofile' in profile:
+            profile['cprofile'].disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f'{name}-{time.time_ns()}-'
+                                             f'{os.getpid()}.prof')
+            profile['cprofile'].dump_stats(path)
+            record['profile'] = path
+        if 'snapshot' in profile:
+            record['alloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            # Leave out the profiler's own allocations.
+            ignore = [tracemalloc.Filter(False, cProfile.__file__),
+                      tracemalloc.Filter(False, tracemalloc.__file__)]
+            top = tracemalloc.take_snapshot().filter_traces(ignore).compare_to(
+                profile['snapshot'].filter_traces(ignore), 'lineno')[:5]
+            record['top_allocations'] = [
+                {'line': str(stat.traceback), 'bytes': stat.size_diff,
+                 'blocks': stat.count_diff} for stat in top]
+            if not profile['tracing']:
+                tracemalloc.stop()
+    finally:
+        _profiling.release()
+
+
+def _end_request(name, seconds, stages, error, profile):
+    record = {'event': 'request', 'name': name, 'ms': seconds * 1e3,
+              'stages': {}}
+    for stage_name, stage_seconds in stages[:-1]:
+        record['stages'][stage_name] = (record['stages'].get(stage_name, 0.0)
+                                        + stage_seconds * 1e3)
+    if error is not None:
+        record['error'] = repr(error)
+        count('errors', stage=name, error=type(error).__name__)
+    if profile is not None:
+        _stop_profile(name, profile, record)
+    if error is not None:
+        # Failures are logged even when callers swallow them.
+        logger.error(json.dumps(record))
+    elif LOG_REQUESTS:
+        logger.info(json.dumps(record))
+
+
+def drain():
+    """Return and reset this process's metrics, for `merge` elsewhere."""
+    global _histograms, _counters
+    with _lock:
+        state = {'histograms': _histograms, 'counters': _counters}
+        _histograms, _counters = {}, {}
+    return state
+
+
+def merge(state):
+    """Add metrics taken by `drain`, e.g. in a worker process."""
+    if not state:
+        return
+    with _lock:
+        for name, (buckets, total) in state['histograms'].items():
+            histogram = _histograms.setdefault(
+                name, [[0] * (len(BUCKETS) + 1), 0.0])
+            histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+            histogram[1] += total
+        for key, value in state['counters'].items():
+            _counters[key] = _counters.get(key, 0) + value
+
+
+def _labels(pairs):
+    return ','.join(f'{key}="{str(value)}"'.replace('\n', ' ')
+                    for key, value in pairs)
+
+
+def prometheus_text():
+    """The metrics of this process in the Prometheus text format."""
+    with _lock:
+        histograms = {name: (list(b), total)
+                      for name, (b, total) in _histograms.items()}
+        counters = dict(_counters)
+    lines = ['# HELP flick_stage_seconds Time spent in recommender stages.',
+             '# TYPE flick_stage_seconds histogram']
+    for name, (buckets, total) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS + ('+Inf',), buckets):
+            cumulative += n
+            lines.append(f'flick_stage_seconds_bucket{{stage="{name}",'
+                         f'le="{bound}"}} {cumulative}')
+        lines.append(f'flick_stage_seconds_sum{{stage="{name}"}} {total}')
+        lines.append(f'flick_stage_seconds_count{{stage="{name}"}} {cumulative}')
+    names = sorted({name for name, _ in counters})
+    for name in names:
+        lines.append(f'# TYPE flick_{name}_total counter')
+        for (counter, labels), value in sorted(counters.items()):
+            if counter == name:
+                lines.append(f'flick_{name}_total{{{_labels(labels)}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host='0.0.0.0'):
+    """Serve `prometheus_text` on `port` from a background thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
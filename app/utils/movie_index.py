@@ -0,0 +1,105 @@
+"""
+
+    Title and movie ID lookups shared by the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: Builds a title -> movieId dictionary and a movieId ->
+    row position array once, so resolving the movies picked in the app
+    no longer scans the whole movies table per title.
+
+"""
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+
+
+class UnknownTitleError(KeyError):
+    """Raised when a movie title is not in the movies database."""
+
+    def __init__(self, titles):
+        self.titles = list(titles)
+        super().__init__(f"Unknown movie title(s): {self.titles}")
+
+    def __str__(self):
+        return self.args[0]
+
+
+class MovieIndex:
+    """Lookups between movie titles, movie IDs and table rows.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie records with at least `movieId` and `title` columns. Where
+        a title occurs more than once, its first row wins.
+
+    """
+
+    def __init__(self, movies):
+        self.movies = movies.reset_index(drop=True)
+        self.id_by_row = self.movies['movieId'].to_numpy(dtype=np.int64)
+        self.title_by_row = self.movies['title'].to_numpy(dtype=object)
+        first = ~self.movies['title'].duplicated()
+        self._by_title = pd.Index(self.title_by_row[first.values])
+        self._title_ids = self.id_by_row[first.values]
+        self.id_by_title = dict(zip(self._by_title, self._title_ids.tolist()))
+        self.row_by_id = np.full(int(self.id_by_row.max()) + 1, -1,
+                                 dtype=np.int32)
+        self.row_by_id[self.id_by_row] = np.arange(len(self.id_by_row),
+                                                   dtype=np.int32)
+
+    def __contains__(self, title):
+        return title in self.id_by_title
+
+    def movie_id(self, title):
+        """MovieLens Movie ID of a title.
+
+        Raises
+        ------
+        UnknownTitleError
+            If the title is not in the movies database.
+
+        """
+        try:
+            return self.id_by_title[title]
+        except KeyError:
+            raise UnknownTitleError([title]) from None
+
+    def movie_ids(self, titles, errors='raise'):
+        """Movie IDs of many titles at once.
+
+        Parameters
+        ----------
+        titles : list (str)
+            Movie titles.
+        errors : str
+            'raise' to fail on unknown titles, 'ignore' to return -1 for
+            them.
+
+        Returns
+        -------
+        np.ndarray
+            Movie IDs, in the order of `titles`.
+
+        """
+        positions = self._by_title.get_indexer(list(titles))
+        missing = positions < 0
+        if missing.any() and errors == 'raise':
+            raise UnknownTitleError(np.asarray(titles, dtype=object)[missing])
+        ids = self._title_ids[positions]
+        ids[missing] = -1
+        return ids
+
+    def rows(self, movie_ids):
+        """Row positions of movie IDs in `movies`, -1 for unknown IDs."""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        found = (movie_ids >= 0) & (movie_ids < len(self.row_by_id))
+        rows = np.full(movie_ids.shape, -1, dtype=np.int32)
+        rows[found] = self.row_by_id[movie_ids[found]]
+        return rows
+
+    def titles(self, movie_ids):
+        """Titles of movie IDs; unknown IDs are dropped."""
+        rows = self.rows(movie_ids)
+        return self.title_by_row[rows[rows >= 0]].tolist()
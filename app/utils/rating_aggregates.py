@@ -0,0 +1,311 @@
+"""
+
+    Per-movie rating aggregates.
+
+    Author: Explore Data Science Academy.
+
+    Description: Keeps the number and sum of ratings of every movie in
+    NumPy arrays indexed by movieId, from which plain and Bayesian-weighted
+    means are gathered without grouping the ratings table. The table is
+    persisted next to the models and can be brought up to date from rows
+    appended to `ratings.csv` without rescanning the file.
+
+    As in `RatingStore`, a user who rates a movie again replaces their
+    earlier rating: it is counted once, with its latest value.
+
+"""
+# Data handling dependencies
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.files import prefix_digest, read_complete_lines
+
+RATING_COLUMNS = ['userId', 'movieId', 'rating', 'timestamp']
+
+
+def _parse_ratings(chunk, header):
+    """User IDs, movie IDs and ratings from a chunk of `ratings.csv`."""
+    if not chunk.strip():
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.float64))
+    df = pd.read_csv(io.BytesIO(chunk), header=0 if header else None,
+                     names=None if header else RATING_COLUMNS,
+                     usecols=['userId', 'movieId', 'rating'],
+                     dtype={'userId': np.int64, 'movieId': np.int64,
+                            'rating': np.float64})
+    return df['userId'].values, df['movieId'].values, df['rating'].values
+
+
+def _pair_keys(user_ids, movie_ids):
+    """One int64 key per (user, movie) pair."""
+    return ((np.asarray(user_ids, dtype=np.int64) << 32)
+            | np.asarray(movie_ids, dtype=np.int64))
+
+
+def _last_positions(keys):
+    """Positions of the last occurrence of each key, in key order."""
+    order = np.argsort(keys, kind='stable')
+    ordered = keys[order]
+    return order[np.append(ordered[1:] != ordered[:-1], True)]
+
+
+class RatingAggregates:
+    """Count and sum of ratings per movieId.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        Number of ratings, indexed by movieId.
+    sums : np.ndarray
+        Sum of ratings, indexed by movieId.
+    source : str, optional
+        Ratings file the aggregates were built from.
+    offset : int
+        Bytes of `source` already counted.
+    digest : str, optional
+        `files.prefix_digest` of `source` at `offset`.
+    latest : tuple (np.ndarray, np.ndarray), optional
+        Sorted keys of the (user, movie) pairs counted and the latest
+        rating of each, with which `update` replaces re-ratings. None
+        counts every rating.
+
+    """
+
+    def __init__(self, counts, sums, source=None, offset=0, digest='',
+                 latest=None):
+        self.counts = np.asarray(counts, dtype=np.int32)
+        self.sums = np.asarray(sums, dtype=np.float64)
+        self.source = source
+        self.offset = int(offset)
+        self.digest = digest
+        self.latest = latest
+
+    @classmethod
+    def from_ratings(cls, movie_ids, ratings, user_ids=None):
+        """Aggregate arrays of movie IDs and ratings.
+
+        With `user_ids`, only the last rating of each user and movie
+        counts.
+        """
+        latest = None
+        if user_ids is not None:
+            latest = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        aggregates = cls(np.zeros(0), np.zeros(0), latest=latest)
+        aggregates.update(movie_ids, ratings, user_ids)
+        return aggregates
+
+    @classmethod
+    def from_csv(cls, path):
+        """Aggregate every complete line of a MovieLens ratings file."""
+        chunk, offset = read_complete_lines(path, 0)
+        user_ids, movie_ids, ratings = _parse_ratings(chunk, header=True)
+        aggregates = cls.from_ratings(movie_ids, ratings, user_ids)
+        aggregates.source = os.path.abspath(path)
+        aggregates.offset = offset
+        aggregates.digest = prefix_digest(path, offset)
+        return aggregates
+
+    @classmethod
+    def load(cls, path, latest=True):
+        """Load aggregates saved with `save`.
+
+        `latest=False` leaves out the latest rating of every pair, which
+        only `refresh` needs and which is as large as the ratings.
+        """
+        with np.load(path) as data:
+            source = str(data['source']) or None
+            pairs = None
+            if latest and 'latest_keys' in data.files:
+                pairs = (data['latest_keys'], data['latest_ratings'])
+            return cls(data['counts'], data['sums'], source=source,
+                       offset=int(data['offset']), digest=str(data['digest']),
+                       latest=pairs)
+
+    def save(self, path):
+        """Write the table to `path`, replacing it in one step."""
+        arrays = {}
+        if self.latest is not None:
+            arrays = {'latest_keys': self.latest[0],
+                      'latest_ratings': self.latest[1]}
+        tmp = f'{path}.tmp{os.getpid()}'
+        with open(tmp, 'wb') as f:
+            np.savez(f, counts=self.counts, sums=self.sums,
+                     source=np.array(self.source or ''),
+                     offset=np.array(self.offset),
+                     digest=np.array(self.digest), **arrays)
+        os.replace(tmp, path)
+
+    def update(self, movie_ids, ratings, user_ids=None):
+        """Add new ratings to the table.
+
+        Parameters
+        ----------
+        movie_ids : array-like
+            Movie ID of each new rating.
+        ratings : array-like
+            The new rating values.
+        user_ids : array-like, optional
+            User ID of each new rating; needed when `latest` is kept. A
+            rating of a pair already counted replaces the earlier one.
+
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        if len(movie_ids) == 0:
+            return
+        added = np.ones(len(movie_ids))
+        if self.latest is not None:
+            if user_ids is None:
+                raise ValueError("User IDs are needed to replace re-ratings.")
+            added, ratings = self._replace(_pair_keys(user_ids, movie_ids),
+                                           ratings)
+        size = max(len(self.counts), int(movie_ids.max()) + 1)
+        counts = np.bincount(movie_ids, weights=added, minlength=size)
+        sums = np.bincount(movie_ids, weights=ratings, minlength=size)
+        counts[:len(self.counts)] += self.counts
+        sums[:len(self.sums)] += self.sums
+        self.counts = np.rint(counts).astype(np.int32)
+        self.sums = sums
+
+    def _replace(self, keys, ratings):
+        """Record the latest rating of each pair in `latest`.
+
+        Returns
+        -------
+        tuple (np.ndarray, np.ndarray)
+            Per new rating, what it adds to its movie's count (1 for a
+            pair not counted yet, once) and to its sum (the change from
+            the pair's earlier rating).
+
+        """
+        last = _last_positions(keys)
+        keys, new = keys[last], ratings[last]
+        known_keys, known_ratings = self.latest
+        at = np.searchsorted(known_keys, keys)
+        found = at < len(known_keys)
+        found[found] = known_keys[at[found]] == keys[found]
+        added = np.zeros(len(ratings))
+        added[last[~found]] = 1
+        change = np.zeros(len(ratings))
+        change[last] = new
+        change[last[found]] -= known_ratings[at[found]]
+        known_ratings = known_ratings.copy()
+        known_ratings[at[found]] = new[found]
+        self.latest = (np.insert(known_keys, at[~found], keys[~found]),
+                       np.insert(known_ratings, at[~found],
+                                 new[~found].astype(known_ratings.dtype)))
+        return added, change
+
+    def refresh(self, path=None):
+        """Count the lines appended to the ratings file since the last read.
+
+        If the file is a different one, or the bytes already counted have
+        changed (it was rewritten rather than appended to), the table is
+        rebuilt from scratch; so it is when `latest` was not loaded, as
+        re-ratings could not be told apart.
+
+        Returns
+        -------
+        int
+            Number of new ratings counted.
+
+        """
+        path = os.path.abspath(path or self.source)
+        if (path != self.source or self.latest is None
+                or os.path.getsize(path) < self.offset
+                or prefix_digest(path, self.offset) != self.digest):
+            rebuilt = RatingAggregates.from_csv(path)
+            self.__dict__.update(rebuilt.__dict__)
+            return int(self.counts.sum())
+        chunk, self.offset = read_complete_lines(path, self.offset)
+        user_ids, movie_ids, ratings = _parse_ratings(chunk, header=False)
+        self.update(movie_ids, ratings, user_ids)
+        self.digest = prefix_digest(path, self.offset)
+        return len(movie_ids)
+
+    @property
+    def global_mean(self):
+        total = self.counts.sum()
+        return self.sums.sum() / total if total else 0.0
+
+    def mean(self, movie_ids=None):
+        """Average rating per movie, NaN for unrated movies."""
+        counts, sums = self._gather(movie_ids)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
+
+    def weighted_mean(self, movie_ids=None, prior_count=None):
+        """Bayesian-weighted average rating per movie.
+
+        Each movie's mean is shrunk toward the global mean as if it had
+        `prior_count` extra ratings at that mean, so movies with one or two
+        ratings no longer outrank well-established ones.
+
+        Parameters
+        ----------
+        movie_ids : array-like, optional
+            Movies to return; all movie IDs if omitted.
+        prior_count : float, optional
+            Weight of the prior; defaults to the mean number of ratings
+            per rated movie.
+
+        """
+        if prior_count is None:
+            rated = self.counts > 0
+            prior_count = self.counts[rated].mean() if rated.any() else 0.0
+        counts, sums = self._gather(movie_ids)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return ((prior_count * self.global_mean + sums)
+                    / (prior_count + counts))
+
+    def count(self, movie_ids=None):
+        """Number of ratings per movie."""
+        return self._gather(movie_ids)[0]
+
+    def _gather(self, movie_ids):
+        if movie_ids is None:
+            return self.counts, self.sums
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        known = (movie_ids >= 0) & (movie_ids < len(self.counts))
+        counts = np.zeros(movie_ids.shape, dtype=np.int32)
+        sums = np.zeros(movie_ids.shape, dtype=np.float64)
+        counts[known] = self.counts[movie_ids[known]]
+        sums[known] = self.sums[movie_ids[known]]
+        return counts, sums
+
+
+def load_rating_aggregates(path, cache_path=None, save=False):
+    """`RatingAggregates` for the ratings file `path`.
+
+    The table is loaded from `cache_path` and refreshed with any lines
+    appended to `path` since it was saved; if there is no usable cache it
+    is built from the whole file.
+
+    Parameters
+    ----------
+    path : str
+        The ratings file.
+    cache_path : str, optional
+        Table saved by an earlier call with `save`.
+    save : bool
+        Write the refreshed table back to `cache_path`. Only offline jobs
+        do; the app refreshes its copy in memory and leaves the file as
+        it is.
+
+    """
+    if cache_path and os.path.exists(cache_path):
+        aggregates = RatingAggregates.load(cache_path, latest=False)
+        changed = os.path.getsize(path) != aggregates.offset
+        if changed:
+            # Appended lines need the latest rating of every pair.
+            aggregates = RatingAggregates.load(cache_path)
+            changed = aggregates.refresh(path) > 0
+    else:
+        aggregates = RatingAggregates.from_csv(path)
+        changed = True
+    if cache_path and save and changed:
+        aggregates.save(cache_path)
+    return aggregates
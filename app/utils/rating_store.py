@@ -0,0 +1,195 @@
+"""
+
+    Shared in-memory store of MovieLens ratings.
+
+    Author: Explore Data Science Academy.
+
+    Description: Holds the ratings as a user-major CSR matrix and an
+    item-major CSC matrix over densely remapped user and movie IDs, so
+    "ratings by user" and "ratings for movie" are slices of the matrix
+    rather than boolean scans of a DataFrame. The app shares one store per
+    process through `utils.registry`.
+
+"""
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def _dense_lookup(ids):
+    """Array mapping each raw ID to its position in sorted `ids`, else -1."""
+    table = np.full(int(ids.max()) + 1 if len(ids) else 0, -1, dtype=np.int32)
+    table[ids] = np.arange(len(ids), dtype=np.int32)
+    return table
+
+
+def _positions(table, ids):
+    """Positions of raw `ids` in a `_dense_lookup` table, -1 if unknown."""
+    ids = np.asarray(ids, dtype=np.int64).ravel()
+    found = (ids >= 0) & (ids < len(table))
+    positions = np.full(len(ids), -1, dtype=np.int32)
+    positions[found] = table[ids[found]]
+    return positions
+
+
+def _gather(matrix, positions):
+    """Concatenate the stored entries of several CSR rows / CSC columns.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix or scipy.sparse.csc_matrix
+        Matrix whose compressed axis is indexed by `positions`.
+    positions : np.ndarray
+        Rows (CSR) or columns (CSC) to gather, in output order.
+
+    Returns
+    -------
+    tuple (np.ndarray, np.ndarray, np.ndarray)
+        Owning position, other-axis index and value of each entry.
+
+    """
+    starts = matrix.indptr[positions]
+    lengths = matrix.indptr[positions + 1] - starts
+    offsets = np.cumsum(lengths) - lengths
+    entries = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    return (np.repeat(positions, lengths), matrix.indices[entries],
+            matrix.data[entries])
+
+
+def _latest(keys):
+    """Positions of the last occurrence of each key, None if all are unique.
+
+    The sparse matrices would otherwise sum the ratings of a repeated
+    (user, movie) pair.
+    """
+    order = np.argsort(keys, kind='stable')
+    last = np.append(keys[order][1:] != keys[order][:-1], True)
+    return None if last.all() else np.sort(order[last])
+
+
+class RatingStore:
+    """Ratings as sparse user x movie matrices.
+
+    Parameters
+    ----------
+    user_ids : array-like
+        User ID of each rating.
+    movie_ids : array-like
+        Movie ID of each rating.
+    ratings : array-like
+        Rating values. A user who rated a movie more than once keeps the
+        last of those ratings, as ratings are appended in the order they
+        were given.
+
+    """
+
+    def __init__(self, user_ids, movie_ids, ratings):
+        self.user_ids, rows = np.unique(np.asarray(user_ids, dtype=np.int32),
+                                        return_inverse=True)
+        self.movie_ids, cols = np.unique(np.asarray(movie_ids, dtype=np.int32),
+                                         return_inverse=True)
+        ratings = np.asarray(ratings, dtype=np.float32)
+        latest = _latest(rows.astype(np.int64) * len(self.movie_ids) + cols)
+        if latest is not None:
+            rows, cols, ratings = rows[latest], cols[latest], ratings[latest]
+        self.by_user = sparse.csr_matrix(
+            (ratings, (rows, cols)),
+            shape=(len(self.user_ids), len(self.movie_ids)))
+        self.by_item = self.by_user.tocsc()
+        self._user_row = _dense_lookup(self.user_ids)
+        self._movie_col = _dense_lookup(self.movie_ids)
+
+    @classmethod
+    def from_csv(cls, path):
+        """Build a store from a MovieLens `ratings.csv` file."""
+        df = pd.read_csv(path, usecols=['userId', 'movieId', 'rating'],
+                         dtype={'userId': np.int32, 'movieId': np.int32,
+                                'rating': np.float32})
+        return cls(df['userId'].values, df['movieId'].values,
+                   df['rating'].values)
+
+    @property
+    def n_ratings(self):
+        return self.by_user.nnz
+
+    def user_rows(self, user_ids):
+        """CSR rows of raw user IDs, -1 for unknown users."""
+        return _positions(self._user_row, user_ids)
+
+    def movie_columns(self, movie_ids):
+        """CSC columns of raw movie IDs, -1 for unknown movies."""
+        return _positions(self._movie_col, movie_ids)
+
+    def user_ratings(self, user_id):
+        """Movies rated by one user.
+
+        Returns
+        -------
+        tuple (np.ndarray, np.ndarray)
+            Movie IDs and the user's ratings for them.
+
+        """
+        row = self.user_rows([user_id])[0]
+        if row < 0:
+            return self.movie_ids[:0], self.by_user.data[:0]
+        start, stop = self.by_user.indptr[row], self.by_user.indptr[row + 1]
+        return (self.movie_ids[self.by_user.indices[start:stop]],
+                self.by_user.data[start:stop])
+
+    def item_ratings(self, movie_id):
+        """Users who rated one movie.
+
+        Returns
+        -------
+        tuple (np.ndarray, np.ndarray)
+            User IDs and their ratings of the movie.
+
+        """
+        col = self.movie_columns([movie_id])[0]
+        if col < 0:
+            return self.user_ids[:0], self.by_item.data[:0]
+        start, stop = self.by_item.indptr[col], self.by_item.indptr[col + 1]
+        return (self.user_ids[self.by_item.indices[start:stop]],
+                self.by_item.data[start:stop])
+
+    def users_frame(self, user_ids):
+        """All ratings of several users as one long-format DataFrame.
+
+        Users are gathered in the given order (repeats included) with a
+        single allocation; unknown users are skipped.
+
+        Returns
+        -------
+        Pandas Dataframe
+            Columns `userId`, `movieId` and `rating`.
+
+        """
+        rows = self.user_rows(user_ids)
+        rows, cols, values = _gather(self.by_user, rows[rows >= 0])
+        return pd.DataFrame({'userId': self.user_ids[rows],
+                             'movieId': self.movie_ids[cols],
+                             'rating': values})
+
+    def items_frame(self, movie_ids):
+        """All ratings of several movies as one long-format DataFrame.
+
+        Returns
+        -------
+        Pandas Dataframe
+            Columns `userId`, `movieId` and `rating`.
+
+        """
+        cols = self.movie_columns(movie_ids)
+        cols, rows, values = _gather(self.by_item, cols[cols >= 0])
+        return pd.DataFrame({'userId': self.user_ids[rows],
+                             'movieId': self.movie_ids[cols],
+                             'rating': values})
+
+    def to_frame(self):
+        """Every rating as a long-format DataFrame, ordered by user."""
+        counts = np.diff(self.by_user.indptr)
+        return pd.DataFrame({
+            'userId': np.repeat(self.user_ids, counts),
+            'movieId': self.movie_ids[self.by_user.indices],
+            'rating': self.by_user.data})
@@ -0,0 +1,396 @@
+"""
+
+    Process-wide registry of datasets and models.
+
+    Author: Explore Data Science Academy.
+
+    Description: Every dataset and model used by the app is declared here
+    once, with explicit dtypes, and loaded lazily on first use. Each is
+    loaded at most once per process, however many modules or Streamlit
+    sessions ask for it. `warm_up` loads a set of resources ahead of the
+    first request, and `reload_if_changed` drops the resources read from
+    a data or model file that has changed, e.g. after
+    resources/models/update_models.py, along with the resources built
+    from them.
+
+    Ratings appended to `ratings.csv` while update_models.py runs count as
+    a change once it has folded them into the models and recorded how far
+    it read in `UPDATES_STATE`, so every append does not reload the app.
+
+"""
+# Data handling dependencies
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+
+from utils.csv_cache import read_csv_cached
+from utils.instrumentation import stage
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESOURCES_DIR = os.environ.get('FLICK_RESOURCES_DIR',
+                               os.path.join(APP_DIR, 'resources'))
+DATA_DIR = os.path.join(RESOURCES_DIR, 'data')
+MODELS_DIR = os.path.join(RESOURCES_DIR, 'models')
+# How far update_models.py has read ratings.csv.
+UPDATES_STATE = os.path.join(RESOURCES_DIR, 'updates.json')
+# Binary copies of the CSV resources, see utils.csv_cache.
+CACHE_DIR = os.environ.get('FLICK_CACHE_DIR',
+                           os.path.join(RESOURCES_DIR, 'cache'))
+# How cached copies are checked against their CSV: 'mtime' or 'hash'.
+CACHE_VALIDATE = os.environ.get('FLICK_CACHE_VALIDATE', 'mtime')
+
+# Column dtypes of the CSV resources.
+DTYPES = {
+    'movies': {'movieId': np.int32, 'title': str, 'genres': 'category'},
+    'ratings': {'userId': np.int32, 'movieId': np.int32,
+                'rating': np.float32, 'timestamp': np.int64},
+    'imdb_data': {'movieId': np.int32, 'title_cast': str, 'director': str,
+                  'runtime': np.float32, 'budget': str, 'plot_keywords': str},
+    'tags': {'userId': np.int32, 'movieId': np.int32, 'tag': str,
+             'timestamp': np.int64},
+}
+
+# Resources loaded by `warm_up` when no names are given: everything a
+# recommendation request needs.
+RECOMMENDER_RESOURCES = ['movie_index', 'rating_store', 'rating_aggregates',
+                         'latent_factors', 'item_neighbours', 'factor_ann',
+                         'tfidf_index']
+
+# Seconds `version` reuses its last answer before checking the files again.
+VERSION_INTERVAL = 2.0
+
+_loaders = {}
+_files = {}
+_resources = {}
+# Resources read by the loader of each resource, which depend on them.
+_dependents = {}
+_lock = threading.RLock()
+_loading = threading.local()
+_version = (float('-inf'), None, {})
+# `version` of the files the loaded resources were read from, and their
+# signatures.
+_loaded_version = None
+_loaded_files = {}
+
+
+def data_path(filename):
+    """Path of a file in the data resources folder."""
+    return os.path.join(DATA_DIR, filename)
+
+
+def model_path(filename):
+    """Path of a file in the model resources folder."""
+    return os.path.join(MODELS_DIR, filename)
+
+
+def register(name, loader=None, files=None):
+    """Declare how to load the resource `name`.
+
+    Can be used directly, `register('x', load_x)`, or as a decorator.
+    Modules outside this one register their own derived resources the
+    same way.
+
+    Parameters
+    ----------
+    name : str
+        Name passed to `get`.
+    loader : callable, optional
+        Returns the resource.
+    files : callable, optional
+        Returns the paths of the files or folders the resource is read
+        from; `reload_if_changed` drops it when one of them changes.
+        Resources the loader gets from the registry are tracked without
+        being declared.
+    """
+    def decorator(func):
+        _loaders[name] = func
+        if files is not None:
+            _files[name] = files
+        else:
+            _files.pop(name, None)
+        return func
+    return decorator(loader) if loader is not None else decorator
+
+
+def get(name):
+    """The resource `name`, loading it on first use.
+
+    Raises
+    ------
+    KeyError
+        If no loader is registered for `name`.
+    """
+    loading = getattr(_loading, 'names', None)
+    if loading:
+        # Called by the loader of another resource, built from this one.
+        _dependents.setdefault(name, set()).add(loading[-1])
+    try:
+        return _resources[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _resources:
+            if _loaded_version is None:
+                _mark_loaded()
+            _loading.names = (loading or []) + [name]
+            try:
+                with stage(f'registry.load.{name}'):
+                    _resources[name] = _loaders[name]()
+            finally:
+                _loading.names = loading
+        return _resources[name]
+
+
+def is_loaded(name):
+    return name in _resources
+
+
+def reset(*names):
+    """Forget loaded resources (all of them if no names are given).
+
+    Resources built from a forgotten one are forgotten with it.
+    """
+    global _loaded_version
+    with _lock:
+        pending = list(names or _resources)
+        while pending:
+            name = pending.pop()
+            _resources.pop(name, None)
+            pending.extend(_dependents.pop(name, ()))
+        if not names:
+            _dependents.clear()
+        if not _resources:
+            _loaded_version = None
+
+
+def warm_up(names=None):
+    """Load resources ahead of the first request.
+
+    Parameters
+    ----------
+    names : list (str), optional
+        Resources to load; defaults to `RECOMMENDER_RESOURCES`.
+
+    Returns
+    -------
+    dict
+        Seconds spent loading each resource (0 if it was already loaded).
+    """
+    timings = {}
+    for name in names or RECOMMENDER_RESOURCES:
+        start = time.perf_counter()
+        get(name)
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def _committed_ratings():
+    """Path and `RatingStream.state` of the ratings file update_models.py
+    has read, if it runs."""
+    try:
+        with open(UPDATES_STATE) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None, None
+    return state.get('path'), state
+
+
+def _scan():
+    """`version` and the signature of every data and model file, at most
+    once every `VERSION_INTERVAL` seconds."""
+    global _version
+    checked_at, fingerprint, files = _version
+    now = time.monotonic()
+    if now - checked_at < VERSION_INTERVAL:
+        return fingerprint, files
+    committed_path, committed = _committed_ratings()
+    files = {}
+    for directory in (DATA_DIR, MODELS_DIR, model_path('svd_factors')):
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                if (committed_path == os.path.abspath(entry.path)
+                        and stat.st_size >= committed['offset']):
+                    # Ratings count once update_models.py has applied them.
+                    files[entry.path] = (committed['offset'],
+                                         committed.get('digest'))
+    fingerprint = hashlib.sha1(
+        repr(sorted(files.items())).encode()).hexdigest()[:12]
+    _version = (now, fingerprint, files)
+    return fingerprint, files
+
+
+def version():
+    """Fingerprint of the data and model files.
+
+    It changes whenever a file in the data or model folders (or the
+    factor export) is added, removed or rewritten, so results derived
+    from them can be tied to the version they came from. Ratings
+    appended to the file update_models.py follows only count once it
+    has applied them.
+    """
+    return _scan()[0]
+
+
+def _mark_loaded():
+    global _loaded_version, _loaded_files
+    _loaded_version, _loaded_files = _scan()
+
+
+def _changed(paths, files):
+    """Whether a file at or under one of `paths` differs from when the
+    resources were loaded."""
+    paths = [os.path.abspath(p) for p in paths]
+    for path in files.keys() | _loaded_files.keys():
+        if files.get(path) == _loaded_files.get(path):
+            continue
+        path = os.path.abspath(path)
+        if any(path == p or path.startswith(p + os.sep) for p in paths):
+            return True
+    return False
+
+
+def reload_if_changed():
+    """Forget the loaded resources read from a data or model file that
+    changed since, and those built from them, so the next `get` loads
+    the new version.
+
+    Requests already holding a resource finish with the old version.
+
+    Returns
+    -------
+    str
+        The `version` the resources belong to from now on; results
+        computed from them are stored under it.
+    """
+    global _loaded_version, _loaded_files
+    current, files = _scan()
+    if current == _loaded_version:
+        return current
+    with _lock:
+        if _loaded_version not in (None, current):
+            reset(*[name for name in list(_resources) if name in _files
+                    and _changed(_files[name](), files)])
+        _loaded_version, _loaded_files = current, files
+    return current
+
+
+def read_csv(name):
+    """Read the CSV resource `name` with its declared dtypes.
+
+    The parsed table is kept in a binary cache under `CACHE_DIR` and
+    reloaded from there while the CSV is unchanged.
+    """
+    return read_csv_cached(data_path(f'{name}.csv'), dtype=DTYPES.get(name),
+                           cache_dir=CACHE_DIR, validate=CACHE_VALIDATE)
+
+
+@register('movies', files=lambda: [data_path('movies.csv')])
+def _load_movies():
+    return read_csv('movies')
+
+
+@register('ratings', files=lambda: [data_path('ratings.csv')])
+def _load_ratings():
+    return read_csv('ratings')
+
+
+@register('imdb_data', files=lambda: [data_path('imdb_data.csv')])
+def _load_imdb_data():
+    return read_csv('imdb_data')
+
+
+@register('tags', files=lambda: [data_path('tags.csv')])
+def _load_tags():
+    return read_csv('tags')
+
+
+@register('title_list')
+def _load_title_list():
+    return get('movies').dropna()['title'].to_list()
+
+
+@register('movie_index')
+def _load_movie_index():
+    from utils.movie_index import MovieIndex
+    return MovieIndex(get('movies'))
+
+
+@register('rating_store')
+def _load_rating_store():
+    from utils.rating_store import RatingStore
+    ratings = get('ratings')
+    return RatingStore(ratings['userId'].values, ratings['movieId'].values,
+                       ratings['rating'].values)
+
+
+@register('rating_aggregates', files=lambda: [data_path('ratings.csv'),
+                                 model_path('rating_aggregates.npz')])
+def _load_rating_aggregates():
+    from utils.rating_aggregates import load_rating_aggregates
+    return load_rating_aggregates(data_path('ratings.csv'),
+                                  model_path('rating_aggregates.npz'))
+
+
+@register('svd_model', files=lambda: [model_path('SVD.pkl')])
+def _load_svd_model():
+    with open(model_path('SVD.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+@register('latent_factors', files=lambda: [model_path('svd_factors'),
+                              model_path('SVD.pkl')])
+def _load_latent_factors():
+    from recommenders.factors import LatentFactors, is_export
+    # Memory-mapped export written by train_colbased.py; SVD.pkl otherwise.
+    if is_export(model_path('svd_factors')):
+        return LatentFactors.load(model_path('svd_factors'))
+    # Only the factors are kept; the model's trainset is not needed.
+    if is_loaded('svd_model'):
+        return LatentFactors.from_surprise(get('svd_model'))
+    with open(model_path('SVD.pkl'), 'rb') as f:
+        return LatentFactors.from_surprise(pickle.load(f))
+
+
+@register('item_neighbours',
+          files=lambda: [model_path('item_neighbours.npz')])
+def _load_item_neighbours():
+    from recommenders.neighbours import ItemNeighbours
+    path = model_path('item_neighbours.npz')
+    return ItemNeighbours.load(path) if os.path.exists(path) else None
+
+
+def _load_ann(filename):
+    from recommenders.ann import IVFIndex
+    path = model_path(filename)
+    return IVFIndex.load(path) if os.path.exists(path) else None
+
+
+@register('factor_ann', files=lambda: [model_path('factor_ann.npz')])
+def _load_factor_ann():
+    index = _load_ann('factor_ann.npz')
+    factors = get('latent_factors')
+    # An index built for other factors (e.g. before retraining or an
+    # incremental update) is ignored.
+    expected = factors.qi.shape[1] + int(factors.biased)
+    if (index is None or index.dim != expected
+            or index.version != factors.version):
+        return None
+    return index if len(index.item_ids) == len(factors.item_ids) else None
+
+
+@register('tfidf_index', files=lambda: [model_path('tfidf_index.npz')])
+def _load_tfidf_index():
+    from recommenders.tfidf import TfidfIndex
+    path = model_path('tfidf_index.npz')
+    return TfidfIndex.load(path) if os.path.exists(path) else None
@@ -0,0 +1,237 @@
+"""
+
+    Result cache for recommendation requests.
+
+    Author: Explore Data Science Academy.
+
+    Description: Recommendations are cached by algorithm, `top_n` and the
+    sorted IDs of the favourite movies, so the same three movies picked in
+    any order are answered from the cache. Entries expire after a TTL and
+    belong to one version of the data and models (`registry.version`);
+    retraining a model or changing a dataset makes them unreachable, and
+    the registry reloads the changed files before new entries are stored.
+
+    Two backends are provided: an in-process LRU dictionary, and a SQLite
+    file that several worker processes share. The cache is configured by
+    environment variables:
+
+      - FLICK_RESULT_CACHE: 'memory' (default), 'sqlite' for a database
+        in the resources cache folder, 'sqlite:<path>', or 'off'.
+      - FLICK_RESULT_CACHE_SIZE: entries kept (default 1024).
+      - FLICK_RESULT_CACHE_TTL: seconds an entry stays valid (default
+        3600; 0 to never expire).
+
+"""
+# Data handling dependencies
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from utils import registry
+from utils.instrumentation import count
+
+CACHE_SPEC = os.environ.get('FLICK_RESULT_CACHE', 'memory')
+CACHE_SIZE = int(os.environ.get('FLICK_RESULT_CACHE_SIZE', 1024))
+CACHE_TTL = float(os.environ.get('FLICK_RESULT_CACHE_TTL', 3600))
+
+
+class MemoryBackend:
+    """In-process LRU store of at most `max_size` entries."""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(value, stored_at) for `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """LRU store in a SQLite file, shared by every process that opens it.
+
+    Values must be JSON-serialisable. Each thread uses its own connection.
+    """
+
+    def __init__(self, path, max_size=100000, timeout=5.0):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY,'
+                       ' value TEXT, stored_at REAL, used_at REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS results_used_at'
+                       ' ON results (used_at)')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def get(self, key):
+        """(value, stored_at) for `key`, or None."""
+        with self._connection() as db:
+            row = db.execute('SELECT value, stored_at FROM results WHERE key = ?',
+                             (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE results SET used_at = ? WHERE key = ?',
+                       (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at):
+        with self._connection() as db:
+            db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                       (key, json.dumps(value), stored_at, time.time()))
+            db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results'
+                       ' ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                       (self.max_size,))
+
+    def delete(self, key):
+        with self._connection() as db:
+            db.execute('DELETE FROM results WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._connection() as db:
+            db.execute('DELETE FROM results')
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM results').fetchone()[0]
+
+
+class ResultCache:
+    """Recommendation results by algorithm, `top_n` and favourite movies.
+
+    Parameters
+    ----------
+    backend : MemoryBackend or SQLiteBackend
+        Where entries are stored.
+    ttl : float, optional
+        Seconds an entry stays valid; None or 0 to never expire.
+    version : callable
+        Returns the current data and model version; entries stored under
+        another version are never returned.
+
+    """
+
+    def __init__(self, backend, ttl=None, version=registry.version):
+        self.backend = backend
+        self.ttl = ttl or None
+        self.version = version
+        self.hits = self.misses = self.expired = 0
+
+    def key(self, algorithm, movie_ids, top_n, version=None):
+        """Key of a result; `version` defaults to the current one."""
+        ids = ','.join(str(int(m)) for m in sorted(movie_ids))
+        return f'{algorithm}|{version or self.version()}|{top_n}|{ids}'
+
+    def get(self, key):
+        """The cached value of `key`, or None."""
+        entry = self.backend.get(key)
+        if entry is not None and self.ttl and time.time() - entry[1] > self.ttl:
+            self.backend.delete(key)
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            count('result_cache_lookups', result='miss')
+            return None
+        self.hits += 1
+        count('result_cache_lookups', result='hit')
+        return entry[0]
+
+    def set(self, key, value):
+        self.backend.set(key, value, time.time())
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        """Hit and miss counts of this process, and the number of entries."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'expired': self.expired,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.backend)}
+
+
+def make_cache(spec=CACHE_SPEC, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+    """Build a `ResultCache` from a FLICK_RESULT_CACHE specification."""
+    if spec == 'off':
+        return None
+    if spec == 'memory':
+        return ResultCache(MemoryBackend(max_size), ttl)
+    if spec == 'sqlite' or spec.startswith('sqlite:'):
+        path = spec.partition(':')[2] or os.path.join(registry.CACHE_DIR,
+                                                      'results.sqlite')
+        return ResultCache(SQLiteBackend(path, max_size), ttl)
+    raise ValueError(f"Unknown result cache {spec!r}")
+
+
+registry.register('result_cache', make_cache)
+
+
+def cached(algorithm):
+    """Cache a `(movie_list, top_n)` recommender in the 'result_cache'.
+
+    Lists containing unknown titles are passed straight through, so the
+    recommender raises as it would uncached. Callers get their own copy
+    of a cached list. Resources are reloaded first if their files changed
+    (`registry.reload_if_changed`).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(movie_list, top_n=10):
+            # Results of resources read from older files must not be
+            # stored under the new version.
+            version = registry.reload_if_changed()
+            cache = registry.get('result_cache')
+            if cache is None:
+                return func(movie_list, top_n)
+            movie_ids = registry.get('movie_index').movie_ids(movie_list,
+                                                              errors='ignore')
+            if (movie_ids < 0).any():
+                return func(movie_list, top_n)
+            key = cache.key(algorithm, movie_ids, top_n, version)
+            result = cache.get(key)
+            if result is None:
+                result = func(movie_list, top_n)
+                cache.set(key, list(result))
+            return list(result)
+        return wrapper
+    return decorator